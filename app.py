@@ -1,62 +1,117 @@
-import os
-from pathlib import Path
 import streamlit as st
 
-from src.answer import answer
+from src import artifacts, retrieve, settings, trace
 
-def _env_flag(name: str, default: bool = False) -> bool:
-    v = os.getenv(name)
-    if v is None and name in st.secrets:
-        v = str(st.secrets[name])
-    if v is None:
-        return default
-    return str(v).strip().lower() in {"1", "true", "yes", "on"}
+# Konfig (env > secrets), løst én gang i src.settings
+S = settings.get()
+USE_OPENAI = S.use_openai
+CHAT_MODEL = S.chat_model if USE_OPENAI else "tf-idf"
+DATA_DIR = S.data_dir
+KB_DIR = S.kb_dir
+# Med RAG_SERVICE_URL er appen en tynn klient mot src.service (indeksen og
+# mikrobatchingen bor der); ellers søkes det i prosessen som før
+SERVICE_URL = S.service_url
+if SERVICE_URL:
+    from src.service import Client
 
-# Konfig (secrets > env)
-USE_OPENAI = _env_flag("USE_OPENAI", False)
-CHAT_MODEL = os.getenv("CHAT_MODEL", st.secrets.get("CHAT_MODEL", "gpt-4o-mini" if USE_OPENAI else "tf-idf"))
-DATA_DIR = Path(os.getenv("DATA_DIR", st.secrets.get("DATA_DIR", "data")))
-KB_DIR = os.getenv("KB_DIR", st.secrets.get("KB_DIR", "kb"))
-
-from src.ingest import build_index, OPENAI_API_KEY
+    answer_stream = Client(SERVICE_URL).answer_stream
+else:
+    from src.answer import answer_stream
+# Debugpanel med tidsbruk per steg (slår også på sporingen); TRACE_PORT gir /metrics
+DEBUG_PANEL = S.debug_panel
+if DEBUG_PANEL:
+    trace.enable()
+if trace.enabled():
+    trace.serve()
 
 # Bygg indeksen hvis den mangler
 def ensure_index():
-    vec = DATA_DIR / "vectors.npy"
-    meta = DATA_DIR / "meta.jsonl"
+    # Filene retrieveren trenger i gjeldende generasjon; den laster bare, bygger aldri selv
+    d = artifacts.current_dir(DATA_DIR)
+    need = ("vectors.npy", "meta.jsonl") if USE_OPENAI else ("tfidf.json",)
 
-    # Sjekk for OpenAI API-nøkkel hvis USE_OPENAI er aktivert
-    if USE_OPENAI and not OPENAI_API_KEY:
+    # Sjekk for OpenAI API-nøkkel hvis embeddingene skal hentes fra OpenAI
+    if USE_OPENAI and S.embedder == "openai" and not S.openai_api_key:
         st.error("Kan ikke bygge indeks – OPENAI_API_KEY mangler. "
                  "Sett den i .env-filen eller i Streamlit Secrets.")
         st.stop()
 
-    if not vec.exists() or not meta.exists():
+    if not all((d / name).exists() for name in need):
         st.info("Indeks mangler – bygger nå …")
         DATA_DIR.mkdir(parents=True, exist_ok=True)
-        build_index(KB_DIR)
+        if USE_OPENAI:
+            from src.ingest import build_index  # bare når indeksen faktisk mangler
+
+            build_index(KB_DIR)
+        else:
+            builder = retrieve.Retriever()  # TF-IDF-settet publiseres som egen generasjon
+            builder.build_tfidf()
+            builder.close()
+
+# Én lastet indeks per prosess, delt av alle økter; sjekken over og lastingen
+# skjer bare første gang. Publiserer ingest en ny generasjon (data/CURRENT),
+# laster watch-tråden den i bakgrunnen og bytter den inn – pågående
+# spørringer fullfører på den gamle.
+@st.cache_resource(show_spinner="Laster indeksen …")
+def get_retriever() -> retrieve.Retriever:
+    ensure_index()
+    r = retrieve.Retriever().load()
+    retrieve.install(r)
+    retrieve.watch()
+    return r
 
 st.set_page_config(page_title="RAG Demo – Asker Tennis", page_icon="🔎", layout="centered")
-ensure_index()
+if not SERVICE_URL:
+    get_retriever()
 
 st.title("🔎 RAG Demo (GitHub)")
-mode_label = "**OpenAI**" if USE_OPENAI else "**TF-IDF**"
-st.caption(f"Status: indeks `ok` • Modus: {mode_label} (modell: {CHAT_MODEL})")
+if SERVICE_URL:
+    st.caption(f"Status: tjeneste `{SERVICE_URL}`")
+else:
+    mode_label = "**TF-IDF**" if not USE_OPENAI else "**OpenAI**" if S.embedder == "openai" else f"**{S.embedder}**"
+    st.caption(f"Status: indeks `ok` • Modus: {mode_label} (modell: {CHAT_MODEL})")
 
 q = st.text_input("Skriv spørsmålet ditt:", placeholder="F.eks. Hvordan resetter jeg passordet?")
 k = st.slider("Antall kilder", 2, 12, 6)
 
+def _render_hits(hits):
+    if not hits:
+        st.write("Ingen kilder.")
+        return
+    for h in hits:
+        src = h.get("source", "?")
+        hid = h.get("id", "?")
+        sc = float(h.get("score", 0.0))
+        st.markdown(f"- **{src}** — `{hid}` (score {sc:.3f})")
+
 if st.button("Svar") and q.strip():
+    events = answer_stream(q, k=k)
     with st.spinner("Henter…"):
-        text, hits = answer(q, k=k)
+        _, hits = next(events)  # kildene kommer før første token
     st.markdown("### Svar")
-    st.write(text)
+    answer_slot = st.empty()
     st.markdown("### Kilder")
-    if not hits:
-        st.write("Ingen kilder.")
-    else:
-        for h in hits:
-            src = h.get("source", "?")
-            hid = h.get("id", "?")
-            sc = float(h.get("score", 0.0))
-            st.markdown(f"- **{src}** — `{hid}` (score {sc:.3f})")
+    _render_hits(hits)
+
+    final = {}
+    def _tokens():
+        for ev, val in events:
+            if ev == "token":
+                yield val
+            elif ev == "done":
+                final["text"] = val
+
+    with answer_slot.container():
+        streamed = st.write_stream(_tokens())
+    # Feil underveis eller "Jeg vet ikke": erstatt det strømmede med endelig svar
+    if final.get("text") is not None and final["text"] != str(streamed or "").strip():
+        answer_slot.write(final["text"])
+
+    if DEBUG_PANEL:
+        with st.expander("Debug: tidsbruk og metrikker"):
+            last = trace.recent(1)
+            if last:
+                st.caption(f"Totalt {last[0]['ms']:.1f} ms")
+                st.dataframe([{"steg": s["name"], "start (ms)": s["start_ms"], "ms": s["ms"]} for s in last[0]["spans"]])
+                st.json({k: v for k, v in last[0].items() if k != "spans"})
+            st.json(trace.snapshot())
@@ -0,0 +1,211 @@
+from __future__ import annotations
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+# --- Konfig ---
+# FAISS_INDEX velger indekstype for embedding-backenden:
+#   flat  – eksakt søk (default). Skrives ikke til disk: FAISS kopierer en
+#           IndexFlat inn i RAM selv med IO_FLAG_MMAP, så src.retrieve søker
+#           i stedet i den minnemappede vectors.npy (delt via sidecachen)
+#   hnsw  – IndexHNSWFlat (graf, ingen trening)
+#   ivfpq – IndexIVFPQ (grovkvantisering + produktkvantisering, trenes på vektorene)
+#   sq8   – IndexScalarQuantizer, 8 bit per dimensjon (kvart størrelse, eksakt søk over kodene)
+INDEX_KIND = os.getenv("FAISS_INDEX", "flat").strip().lower()
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = automatisk ut fra antall vektorer
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+PQ_M = int(os.getenv("PQ_M", "0"))  # 0 = automatisk (dim/16, må gå opp i dim)
+PQ_NBITS = 8
+
+KINDS = ("flat", "hnsw", "ivfpq", "sq8")
+# Typer med tilnærmede skårer; src.retrieve henter flere kandidater og reskårer dem mot vectors.npy
+LOSSY = ("ivfpq", "sq8")
+
+
+def params_path(index_path: Path) -> Path:
+    return Path(index_path).with_suffix(".json")
+
+
+def _pq_m(dim: int) -> int:
+    m = PQ_M or max(1, dim // 16)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def build(X: np.ndarray, kind: Optional[str] = None) -> Tuple[faiss.Index, Dict]:
+    """
+    Bygg en FAISS-indeks (indreprodukt over normaliserte vektorer) av typen `kind`.
+    Returnerer (indeks, parametre). Parametrene lagres sammen med indeksen og
+    gir standardverdier for efSearch/nprobe ved spørring.
+    """
+    kind = (kind or INDEX_KIND).lower()
+    if kind not in KINDS:
+        raise ValueError(f"Ukjent FAISS_INDEX={kind!r} (gyldige: {', '.join(KINDS)})")
+    X = np.ascontiguousarray(X, dtype="float32")
+    n, dim = X.shape
+    params: Dict = {"kind": kind, "n": int(n), "dim": int(dim)}
+
+    if kind == "ivfpq":
+        nlist = IVF_NLIST or max(1, min(int(4 * math.sqrt(n)), n // 39))
+        # PQ med 8 bit trenger minst 256 treningspunkter; for små korpus er flat best uansett
+        if n < max(256, nlist * 39):
+            print(f"[ann] For få vektorer ({n}) til IVF-PQ – bruker flat indeks.")
+            kind = params["kind"] = "flat"
+        else:
+            m = _pq_m(dim)
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+            index.train(X)
+            index.add(X)
+            index.nprobe = IVF_NPROBE
+            params.update(nlist=nlist, pq_m=m, pq_nbits=PQ_NBITS, nprobe=IVF_NPROBE)
+            return index, params
+
+    if kind == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(X)
+        index.add(X)
+        return index, params
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        index.add(X)
+        params.update(m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH)
+        return index, params
+
+    index = faiss.IndexFlatIP(dim)
+    index.add(X)
+    return index, params
+
+
+def lossy(params: Dict) -> bool:
+    return params.get("kind", "flat") in LOSSY
+
+
+def write(index: faiss.Index, params: Dict, path: str | Path) -> None:
+    """Skriv indeksen og parametrene (index.json ved siden av index.faiss)."""
+    path = Path(path)
+    faiss.write_index(index, str(path))
+    params_path(path).write_text(json.dumps(params), encoding="utf-8")
+
+
+def read(path: str | Path) -> Tuple[faiss.Index, Dict]:
+    """
+    Les indeksen med IO_FLAG_MMAP sammen med lagrede parametre. Det sparer
+    RAM for HNSW/IVF-PQ/SQ8; en IndexFlat kopieres likevel inn i minnet.
+    """
+    path = Path(path)
+    index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    try:
+        params = json.loads(params_path(path).read_text(encoding="utf-8"))
+    except Exception:
+        params = {"kind": "flat", "n": int(index.ntotal), "dim": int(index.d)}
+    return index, params
+
+
+def search(index: faiss.Index, params: Dict, Q: np.ndarray, k: int,
+           ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+           subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Søk med per-spørring-tuning. efSearch/nprobe sendes som SearchParameters,
+    så indeksen selv endres ikke og kan deles mellom tråder. `subset` (bool per
+    rad) begrenser søket til de radene via en IDSelectorBitmap.
+    """
+    Q = np.ascontiguousarray(Q, dtype="float32")
+    k = min(k, int(index.ntotal))
+    kind = params.get("kind", "flat")
+    extra: Dict = {}
+    if subset is not None:
+        bits = np.packbits(subset, bitorder="little")
+        extra["sel"] = faiss.IDSelectorBitmap(len(subset), faiss.swig_ptr(bits))
+    sp = None
+    if kind == "hnsw":
+        sp = faiss.SearchParametersHNSW(efSearch=max(int(ef_search or params.get("ef_search", HNSW_EF_SEARCH)), k), **extra)
+    elif kind == "ivfpq":
+        sp = faiss.SearchParametersIVF(nprobe=int(nprobe or params.get("nprobe", IVF_NPROBE)), **extra)
+    elif extra:
+        sp = faiss.SearchParameters(**extra)
+    if sp is None:
+        return index.search(Q, k)
+    return index.search(Q, k, params=sp)  # bits og selektoren lever til søket er ferdig
+
+
+# ---------- Recall/latens-rapport mot flat baseline ----------
+def recall_report(X: np.ndarray, k: int = 10, n_queries: int = 200, noise: float = 0.05,
+                  ef_values: Sequence[int] = (16, 32, 64, 128, 256),
+                  nprobe_values: Sequence[int] = (1, 4, 16, 64)) -> List[Dict]:
+    """
+    Bygg hver indekstype over X og mål recall@k mot eksakt flat-søk, samt
+    latens per spørring. Spørringene er korpusvektorer med litt støy.
+    """
+    X = np.ascontiguousarray(X, dtype="float32")
+    rng = np.random.default_rng(0)
+    pick = rng.choice(len(X), size=min(n_queries, len(X)), replace=False)
+    Q = X[pick] + noise * rng.standard_normal((len(pick), X.shape[1])).astype("float32")
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12
+
+    rows: List[Dict] = []
+    truth = None
+    for kind in KINDS:
+        t0 = time.perf_counter()
+        index, params = build(X, kind)
+        build_s = time.perf_counter() - t0
+        if params["kind"] != kind:
+            continue
+        sweep: List[Dict] = [{}]
+        if kind == "hnsw":
+            sweep = [{"ef_search": v} for v in ef_values]
+        elif kind == "ivfpq":
+            sweep = [{"nprobe": v} for v in nprobe_values if v <= params["nlist"]]
+        for tune in sweep:
+            lat = []
+            found = []
+            for q in Q:
+                t0 = time.perf_counter()
+                _, I = search(index, params, q[None, :], k, **tune)
+                lat.append(time.perf_counter() - t0)
+                found.append(I[0])
+            I = np.vstack(found)
+            if truth is None:
+                truth = I
+            recall = float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(I, truth)]))
+            lat_ms = np.array(lat) * 1000
+            rows.append({
+                "kind": kind, **tune, "k": k, "n": len(X), "dim": X.shape[1],
+                "build_s": round(build_s, 4), f"recall@{k}": round(recall, 4),
+                "p50_ms": round(float(np.percentile(lat_ms, 50)), 4),
+                "p95_ms": round(float(np.percentile(lat_ms, 95)), 4),
+                "qps": round(len(lat) / sum(lat), 1),
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Recall vs. latens for FAISS-indekstyper mot flat baseline.")
+    ap.add_argument("--vectors", default=str(Path(os.getenv("DATA_DIR", "data")) / "vectors.npy"))
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--out", default=None, help="skriv rapporten som JSON hit")
+    args = ap.parse_args()
+
+    rows = recall_report(np.load(args.vectors, mmap_mode="r"), k=args.k, n_queries=args.queries)
+    cols = ["kind", "ef_search", "nprobe", f"recall@{args.k}", "p50_ms", "p95_ms", "qps", "build_s"]
+    print(" | ".join(cols))
+    for r in rows:
+        print(" | ".join(str(r.get(c, "")) for c in cols))
+    if args.out:
+        Path(args.out).write_text(json.dumps(rows, indent=2), encoding="utf-8")
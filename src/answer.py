@@ -1,20 +1,39 @@
 from __future__ import annotations
-import os, re
-from typing import Dict, List, Tuple, Set
+import re, time
+from typing import Dict, Iterator, List, Optional, Tuple, Set
 
-from src.utils import env_flag
-from src.retrieve import search
+import numpy as np
 
-USE_OPENAI = env_flag("USE_OPENAI", False)
-CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+from src import context, settings, trace
+from src.chunking import count_tokens
+from src.retrieve import RETRIEVAL_MODE, keyword_index, pinned, search
+from src.rerank import DOC_HINTS, SYN, bonus_from_texts
+from src.answer_cache import make_cache, normalize_query
 
+USE_OPENAI = settings.get().use_openai
+CHAT_MODEL = settings.get().chat_model
+
+# OpenAI-klient (kun hvis USE_OPENAI), lages ved første LLM-kall
 _openai = None
-if USE_OPENAI:
-    try:
-        from openai import OpenAI
-        _openai = OpenAI()
-    except Exception:
-        _openai = None
+
+def _client():
+    global _openai
+    if not USE_OPENAI:
+        return None
+    if _openai is None:
+        _openai = settings.openai_client()  # None -> ekstraktivt svar
+    return _openai
+
+# Cache for ferdige svar (normalisert spørsmål, k, modus); tømmes ved ny indeks
+_cache = make_cache()
+
+# Mikrobatcher (src.service) som samler samtidige søk i ett search_batch-kall;
+# None = hver forespørsel søker for seg
+_batcher = None
+
+def use_batcher(batcher) -> None:
+    global _batcher
+    _batcher = batcher
 
 SYSTEM_PROMPT = (
     "Du er en vennlig og hjelpsom assistent for Asker Tennis.\n"
@@ -22,13 +41,6 @@ SYSTEM_PROMPT = (
     "Hvis kildene ikke dekker spørsmålet, si 'Jeg vet ikke'."
 )
 
-SYN = {
-    "booking": ["booking", "booke", "banebooking", "banereservasjon", "reserver", "bane", "matchi"],
-    "pris": ["pris", "avgift", "timepris", "kostnad", "medlemspris", "drop-in", "billig", "rimelig", "rabatt", "off-peak", "lavsesong"],
-    "tid": ["tid", "tidspunkt", "hverdag", "helg", "dagtid", "kveld"],
-}
-DOC_HINTS = {"booking": SYN["booking"], "pris": SYN["pris"]}
-
 def _expand_query(q: str) -> Tuple[str, Set[str], List[str]]:
     ql = q.lower()
     extra: List[str] = []
@@ -52,40 +64,204 @@ def _extractive(hits: List[Dict]) -> str:
         return "Jeg vet ikke"
     return _first_sentence(hits[0].get("text", "")) or "Jeg vet ikke"
 
-def _score(h: Dict, keys: List[str], preferred: Set[str]) -> float:
-    base = float(h.get("score", 0.0))
-    bonus = 0.15 if h.get("doc_type") in preferred else 0.0
-    txt = (h.get("text") or "").lower()
-    bonus += min(0.10, 0.02 * sum(1 for t in keys if t in txt))
-    return base + bonus
-
 def _rerank(hits: List[Dict], preferred: Set[str], keys: List[str], k: int, min_score: float = 0.18) -> List[Dict]:
-    scored = [(h, _score(h, keys, preferred)) for h in hits]
-    scored.sort(key=lambda x: x[1], reverse=True)
-    good = [h for h, s in scored if s >= min_score]
-    return good[:k] if good else []
+    """
+    Skår = søkeskår + bonus (foretrukket doc_type, nøkkelord i teksten).
+    Bonusen slås opp i den forhåndsberegnede nøkkelordmatrisen for kandidat-
+    radene, så hele reranken er noen få NumPy-operasjoner.
+    """
+    if not hits:
+        return []
+    base = np.array([float(h.get("score", 0.0)) for h in hits])
+    # Hybrid-treff rangeres på RRF-skåren, men terskelen gjelder den eksakte likheten
+    gate = np.array([float(h.get("dense_score", h.get("score", 0.0))) for h in hits])
+    kw = keyword_index() if all("row" in h for h in hits) else None
+    if kw is not None and kw.covers(keys):
+        bonus = kw.bonus(np.array([h["row"] for h in hits]), keys, preferred)
+    else:
+        bonus = bonus_from_texts(hits, keys, preferred)
+    order = np.argsort(-(base + bonus), kind="stable")
+    keep = order[(gate + bonus)[order] >= min_score][:k]
+    return [hits[i] for i in keep]
+
+def _messages(q: str, hits: List[Dict]) -> List[Dict]:
+    """
+    Prompten med kontekst fra context.build (sammenslåtte naboer, uten dupliserte
+    setninger, innenfor CONTEXT_TOKENS). Tokenantallet registreres per forespørsel.
+    """
+    with trace.span("context") as sp:
+        excerpts, ctx_tokens = context.build(hits)
+        msgs = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Spørsmål: {q}\n\nKontekst:\n{context.render(excerpts)}\n\n"
+                                        "Instruks: Svar med egne ord i 1–3 setninger."},
+        ]
+        prompt_tokens = sum(count_tokens(m["content"]) for m in msgs)
+        sp.set(excerpts=len(excerpts), context_tokens=ctx_tokens, prompt_tokens=prompt_tokens)
+    trace.observe("prompt_tokens", prompt_tokens)
+    return msgs
+
+def _count_usage(usage) -> None:
+    if usage is not None:
+        trace.count("llm_tokens", getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        trace.count("llm_tokens", getattr(usage, "completion_tokens", 0) or 0, kind="completion")
 
 def _llm(q: str, hits: List[Dict]) -> str:
-    if _openai is None:
+    client = _client()
+    if client is None:
         return _extractive(hits)
-    ctx = "\n\n".join(f"Utdrag {i+1}:\n{h.get('text','')}" for i, h in enumerate(hits[:5]))
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"Spørsmål: {q}\n\nKontekst:\n{ctx}\n\nInstruks: Svar med egne ord i 1–3 setninger."},
-    ]
     try:
-        r = _openai.chat.completions.create(model=CHAT_MODEL, messages=messages, temperature=0.2, max_tokens=120)
+        with trace.span("llm", model=CHAT_MODEL):
+            r = client.chat.completions.create(model=CHAT_MODEL, messages=_messages(q, hits), temperature=0.2, max_tokens=120)
+        _count_usage(getattr(r, "usage", None))
         return (r.choices[0].message.content or "").strip()
     except Exception:
+        trace.count("llm_errors")
         return _extractive(hits)
 
+def _llm_stream(q: str, hits: List[Dict]) -> Iterator[Tuple[str, str]]:
+    """
+    Strømmer svaret som ("token", tekst)-hendelser. Feiler strømmen (før eller
+    underveis), kommer én ("reset", ekstraktivt svar) som erstatter det som er vist.
+    """
+    t0 = time.perf_counter()
+    with trace.span("llm", model=CHAT_MODEL, stream=True) as sp:
+        try:
+            stream = _client().chat.completions.create(  # type: ignore
+                model=CHAT_MODEL, messages=_messages(q, hits), temperature=0.2, max_tokens=120, stream=True,
+                stream_options={"include_usage": True},
+            )
+            first = True
+            for chunk in stream:
+                _count_usage(getattr(chunk, "usage", None))  # kommer i siste bit
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if first:
+                        sp.set(first_token_ms=round(1000 * (time.perf_counter() - t0), 3))
+                        first = False
+                    yield "token", delta
+        except Exception:
+            trace.count("llm_errors")
+            yield "reset", _extractive(hits)
+
+def _cache_key(q: str, k: int) -> str:
+    mode = f"openai:{CHAT_MODEL}" if _client() is not None else "tfidf"
+    return f"{mode}|{k}|{normalize_query(q)}"
+
+def _finish(out: str) -> str:
+    out = (out or "").strip()
+    return out if len(out.split()) >= 2 else "Jeg vet ikke"
+
+def _retrieve(q: str, k: int) -> Tuple[List[Dict], List[Dict]]:
+    """(rerankede treff, rå treff)"""
+    with trace.span("expand"):
+        qx, preferred, keys = _expand_query(q)
+    # Samme indeks for søk og rerank, selv om den byttes ut (retrieve.reload) underveis
+    with pinned() as r:
+        # Spørsmål med doc_type-hint søkes først i den partisjonen; resten av
+        # indeksen bare hvis partisjonen gir færre enn k treff etter reranken
+        part = {"doc_type": sorted(preferred)} if preferred else None
+        raw = _candidates(r, q, qx, k, part)
+        with trace.span("rerank"):
+            hits = _rerank(raw, preferred, keys, k)
+        if part is not None and len(hits) < k:
+            seen = {_hit_key(h) for h in raw}
+            raw = raw + [h for h in _candidates(r, q, qx, k, None) if _hit_key(h) not in seen]
+            with trace.span("rerank"):
+                hits = _rerank(raw, preferred, keys, k)
+        trace.observe("candidates", len(raw))
+    trace.observe("hits", len(hits))
+    return hits, raw
+
+def _candidates(r, q: str, qx: str, k: int, filters: Optional[Dict]) -> List[Dict]:
+    with trace.span("search", mode=RETRIEVAL_MODE, partition=",".join(filters["doc_type"]) if filters else ""):
+        if RETRIEVAL_MODE == "hybrid":
+            # Fusjonen gir bedre topp-k, så kandidatpoolen kan være mindre; synonymene går bare til BM25
+            return _search(r, q, k + 2, lexical_query=qx, filters=filters)
+        return _search(r, qx, max(k * 2, 6), filters=filters)
+
+def _hit_key(h: Dict):
+    return h.get("row", h.get("id"))
+
+def _search(r, q: str, k: int, lexical_query: Optional[str] = None, filters: Optional[Dict] = None) -> List[Dict]:
+    if _batcher is not None:
+        return _batcher.search(r, q, k, lexical_query, filters)
+    kw: Dict = {}
+    if lexical_query:
+        kw["lexical_query"] = lexical_query
+    if filters:
+        kw["filters"] = filters
+    return search(q, k, **kw)
+
+def _cache_get(key: str):
+    cached = _cache.get(key) if _cache is not None else None
+    if _cache is not None:
+        trace.count("cache", cache="answer", result="hit" if cached is not None else "miss")
+    return cached
+
 def answer(q: str, k: int = 6) -> Tuple[str, List[Dict]]:
-    qx, preferred, keys = _expand_query(q)
-    raw = search(qx, max(k * 2, 6))
-    hits = _rerank(raw, preferred, keys, k)
+    with trace.trace("answer", k=k):
+        key = _cache_key(q, k)
+        cached = _cache_get(key)
+        if cached is not None:
+            out, hits = cached
+            return out, [dict(h) for h in hits]
+        out, hits = _answer(q, k)
+        if _cache is not None:
+            _cache.put(key, (out, [dict(h) for h in hits]))
+        return out, hits
+
+def _answer(q: str, k: int) -> Tuple[str, List[Dict]]:
+    hits, raw = _retrieve(q, k)
     if not hits:
         return "Jeg vet ikke", raw[:k]
-    out = _llm(q, hits) if USE_OPENAI and _openai is not None else _extractive(hits)
-    if not out or len(out.split()) < 2:
-        out = "Jeg vet ikke"
-    return out, hits
+    out = _llm(q, hits) if _client() is not None else _extractive(hits)
+    return _finish(out), hits
+
+def answer_stream(q: str, k: int = 6) -> Iterator[Tuple[str, object]]:
+    """
+    Strømmende variant av `answer`. Hendelser i rekkefølge:
+      ("hits", treff)     – med en gang etter søk/rerank
+      ("token", tekst)    – svartekst etter hvert som den kommer
+      ("reset", tekst)    – erstatter alt som er strømmet (feil underveis / 'Jeg vet ikke')
+      ("done", tekst)     – det endelige svaret
+    """
+    with trace.trace("answer", k=k, stream=True):
+        yield from _answer_stream(q, k)
+
+def _answer_stream(q: str, k: int) -> Iterator[Tuple[str, object]]:
+    key = _cache_key(q, k)
+    cached = _cache_get(key)
+    if cached is not None:
+        out, hits = cached
+        yield "hits", [dict(h) for h in hits]
+        yield "token", out
+        yield "done", out
+        return
+
+    hits, raw = _retrieve(q, k)
+    if not hits:
+        out, hits = "Jeg vet ikke", raw[:k]
+        yield "hits", hits
+        yield "token", out
+    else:
+        yield "hits", hits
+        if _client() is not None:
+            parts: List[str] = []
+            for ev, val in _llm_stream(q, hits):
+                if ev == "token":
+                    parts.append(val)
+                else:
+                    parts = [val]
+                yield ev, val
+            streamed = "".join(parts)
+        else:
+            streamed = _extractive(hits)
+            yield "token", streamed
+        out = _finish(streamed)
+        if out != streamed.strip():
+            yield "reset", out
+
+    if _cache is not None:
+        _cache.put(key, (out, [dict(h) for h in hits]))
+    yield "done", out
@@ -0,0 +1,140 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src import settings
+from src.utils import env_flag
+
+# --- Konfig ---
+DATA_DIR = settings.get().data_dir  # samme katalog som indeksen (env, .env eller secrets)
+ANSWER_CACHE_ENABLED = env_flag("ANSWER_CACHE", True)
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # sekunder
+# Delt disk-nivå (SQLite) slik at flere workere gjenbruker svarene
+ANSWER_CACHE_DISK = env_flag("ANSWER_CACHE_DISK", False)
+ANSWER_CACHE_PATH = Path(os.getenv("ANSWER_CACHE_PATH", str(DATA_DIR / "answer_cache.sqlite")))
+
+# Artefaktene som avgjør hva search() returnerer; endres noen av dem, er cachen ugyldig
+ARTIFACTS = ("CURRENT", "meta.jsonl", "vectors.npy", "index.faiss", "index.json", "tfidf.npz", "tfidf.json", "manifest.json")
+
+Value = Tuple[str, List[Dict]]
+
+
+def normalize_query(q: str) -> str:
+    q = re.sub(r"\s+", " ", (q or "").strip().lower())
+    return q.rstrip(" ?!.")
+
+
+def artifact_generation(data_dir: Path = DATA_DIR) -> str:
+    """Fingeravtrykk (størrelse + mtime) av indeksartefaktene i DATA_DIR."""
+    h = hashlib.sha1()
+    for name in ARTIFACTS:
+        try:
+            st = (data_dir / name).stat()
+        except OSError:
+            continue
+        h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU/TTL-cache for ferdige (svar, treff) med valgfritt delt SQLite-nivå.
+    Hver oppføring er merket med artefaktgenerasjonen; når artefaktene i
+    DATA_DIR endres (rebuild), tømmes minnet og gamle diskrader ignoreres.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX, ttl: float = ANSWER_CACHE_TTL,
+                 disk_path: Optional[Path] = None, data_dir: Path = DATA_DIR):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.data_dir = data_dir
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, Tuple[float, Value]]" = OrderedDict()
+        self._gen = ""
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path is not None:
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(disk_path), check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, generation TEXT NOT NULL,"
+                " created REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._db.commit()
+
+    def _generation(self) -> str:
+        gen = artifact_generation(self.data_dir)
+        if gen != self._gen:
+            self._mem.clear()
+            self._gen = gen
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers WHERE generation != ?", (gen,))
+                self._db.commit()
+        return gen
+
+    def get(self, key: str) -> Optional[Value]:
+        now = time.time()
+        with self._lock:
+            gen = self._generation()
+            item = self._mem.get(key)
+            if item is not None and now - item[0] <= self.ttl:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, payload FROM answers WHERE key = ? AND generation = ?", (key, gen)
+                ).fetchone()
+                if row and now - row[0] <= self.ttl:
+                    text, hits = json.loads(row[1])
+                    self._remember(key, row[0], (text, hits))
+                    self.hits += 1
+                    return text, hits
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Value) -> None:
+        now = time.time()
+        with self._lock:
+            gen = self._generation()
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                    (key, gen, now, json.dumps(value, ensure_ascii=False)),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, created: float, value: Value) -> None:
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._mem)}
+
+
+def make_cache() -> Optional[ResultCache]:
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    disk = ANSWER_CACHE_PATH if ANSWER_CACHE_DISK else None
+    try:
+        return ResultCache(disk_path=disk)
+    except Exception as e:
+        print(f"[answer_cache] Kunne ikke åpne {disk}: {e} – kjører med bare minnecache.")
+        return ResultCache()
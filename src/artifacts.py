@@ -0,0 +1,173 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from src.utils import unique_tmp
+
+# Versjonerte indeksartefakter. Hvert bygg skriver et komplett sett til en
+# egen katalog (DATA_DIR/generations/<id>.tmp), som døpes om til <id> og
+# publiseres ved å bytte pekerfilen DATA_DIR/CURRENT atomisk (os.replace).
+# Lesere går alltid via pekeren, så de ser enten hele forrige eller hele
+# neste generasjon – aldri nye vektorer med gammel metadata. generation.json
+# i katalogen beskriver settet (filer, størrelser, tidspunkt, modus).
+#
+# Toppnivåfilene i DATA_DIR (vectors.npy, meta.jsonl, index.faiss …) speiles
+# fra gjeldende generasjon med hardlenker for eldre verktøy (src.index,
+# tester); de byttes også inn fil for fil med os.replace, og speilede filer
+# den nye generasjonen ikke har (f.eks. index.faiss etter et flat-bygg) slettes.
+
+GENERATIONS = "generations"
+POINTER = "CURRENT"
+INFO = "generation.json"
+ARTIFACT_KEEP = int(os.getenv("ARTIFACT_KEEP", "3"))  # publiserte generasjoner som beholdes
+STALE_STAGING_SECS = 24 * 3600  # halvferdige bygg (krasj) ryddes etter et døgn
+# TF-IDF-settet (src.retrieve); embeddingbygget tar dem med seg uendret
+TFIDF_FILES = ("vectorizer.pkl", "tfidf.npz", "tfidf_meta.arrow", "tfidf.json", "tfidf_bm25.npz", "tfidf_keywords.npz",
+               "tfidf_partitions.npz")
+
+
+def pointer_path(data_dir: Path) -> Path:
+    return Path(data_dir) / POINTER
+
+
+def current_id(data_dir: Path) -> Optional[str]:
+    """Id-en CURRENT peker på (None i gammelt flatt oppsett uten peker)."""
+    try:
+        gen = pointer_path(data_dir).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return gen or None
+
+
+def resolve(data_dir: Path) -> Tuple[Optional[str], Path]:
+    """(id, katalog) for gjeldende generasjon, fra én lesing av pekeren; (None, DATA_DIR) i flatt oppsett."""
+    data_dir = Path(data_dir)
+    gen = current_id(data_dir)
+    if gen is not None:
+        d = data_dir / GENERATIONS / gen
+        if d.is_dir():
+            return gen, d
+    return None, data_dir
+
+
+def current_dir(data_dir: Path) -> Path:
+    """Katalogen med gjeldende artefakter; DATA_DIR selv hvis ingen generasjon er publisert."""
+    return resolve(data_dir)[1]
+
+
+def stage(data_dir: Path) -> Path:
+    """Ny, tom byggekatalog; usynlig for lesere til den publiseres."""
+    now = time.time_ns()
+    # sorterbar id (mikrosekunder, så bygg i samme sekund holder rekkefølgen) + tilfeldig hale
+    gen = time.strftime("%Y%m%dT%H%M%S", time.localtime(now / 1e9)) + f"{now // 1000 % 1_000_000:06d}-{uuid.uuid4().hex[:8]}"
+    d = Path(data_dir) / GENERATIONS / (gen + ".tmp")
+    d.mkdir(parents=True)
+    return d
+
+
+def discard(stage_dir: Path) -> None:
+    shutil.rmtree(stage_dir, ignore_errors=True)
+
+
+def link(src: Path, dst: Path) -> None:
+    """Hardlenk (kopi hvis filsystemet ikke støtter det) og bytt inn atomisk."""
+    tmp = unique_tmp(dst)  # samtidige publiseringer lenker via hver sin fil
+    try:
+        tmp.unlink()  # os.link krever at navnet er ledig
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def publish(data_dir: Path, stage_dir: Path, inherit: Union[bool, Iterable[str]] = True,
+            mirror: bool = True, **extra) -> str:
+    """
+    Publiser `stage_dir` som ny generasjon og returner id-en. `inherit`
+    (True eller en liste filnavn) lenker filer byggeren ikke skrev inn fra
+    forrige generasjon, f.eks. TF-IDF-settet når embeddingene bygges. Til
+    slutt speiles toppnivået og gamle generasjoner ryddes.
+    """
+    data_dir = Path(data_dir)
+    stage_dir = Path(stage_dir)
+    prev_gen, prev = resolve(data_dir)
+    if inherit and prev != data_dir:
+        names = None if inherit is True else set(inherit)
+        for p in prev.iterdir():
+            if (p.is_file() and p.name != INFO and (names is None or p.name in names)
+                    and not (stage_dir / p.name).exists()):
+                link(p, stage_dir / p.name)
+
+    gen = stage_dir.name[:-len(".tmp")] if stage_dir.name.endswith(".tmp") else stage_dir.name
+    files = {p.name: p.stat().st_size for p in sorted(stage_dir.iterdir()) if p.is_file()}
+    meta = {"id": gen, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": files, **extra}
+    (stage_dir / INFO).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    final = data_dir / GENERATIONS / gen
+    if stage_dir != final:
+        os.replace(stage_dir, final)
+    tmp = unique_tmp(pointer_path(data_dir))
+    try:
+        with tmp.open("w", encoding="utf-8") as f:
+            f.write(gen + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, pointer_path(data_dir))  # selve byttet
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    if mirror:
+        for name in files:
+            link(final / name, data_dir / name)
+        # speil fra forrige generasjon som den nye ikke har (i flatt oppsett er filene originaler)
+        stale = set(info(data_dir, prev_gen).get("files", {})) - set(files) if prev_gen else set()
+        for name in stale:
+            (data_dir / name).unlink(missing_ok=True)
+    prune(data_dir)
+    print(f"[artifacts] Publiserte generasjon {gen} ({len(files)} filer) i {data_dir}")
+    return gen
+
+
+def generations(data_dir: Path) -> List[str]:
+    """Publiserte generasjoner, eldste først (id-ene sorterer på tidspunkt)."""
+    root = Path(data_dir) / GENERATIONS
+    if not root.is_dir():
+        return []
+    return sorted(p.name for p in root.iterdir() if p.is_dir() and not p.name.endswith(".tmp"))
+
+
+def info(data_dir: Path, gen: Optional[str] = None) -> Dict:
+    gen = gen or current_id(data_dir)
+    if gen is None:
+        return {}
+    try:
+        return json.loads((Path(data_dir) / GENERATIONS / gen / INFO).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def prune(data_dir: Path, keep: int = ARTIFACT_KEEP) -> None:
+    """
+    Slett eldre generasjoner utover de `keep` nyeste (gjeldende beholdes alltid).
+    Prosesser som fortsatt har filer minnemappet beholder dem til de lukkes.
+    """
+    data_dir = Path(data_dir)
+    cur = current_id(data_dir)
+    gens = [g for g in generations(data_dir) if g != cur]
+    for g in gens[:max(0, len(gens) - max(0, keep - 1))]:
+        shutil.rmtree(data_dir / GENERATIONS / g, ignore_errors=True)
+    root = data_dir / GENERATIONS
+    for p in root.glob("*.tmp"):
+        try:
+            if time.time() - p.stat().st_mtime > STALE_STAGING_SECS:
+                shutil.rmtree(p, ignore_errors=True)
+        except OSError:
+            continue
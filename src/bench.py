@@ -0,0 +1,220 @@
+"""
+Reproduserbar benchmark for søket: bygger indeksen fra kb/ i en egen
+katalog, spiller av et fast sett norske spørsmål med forventede kilder og
+rapporterer latens (p50/p95/p99), QPS, maks RSS, byggetid og recall@k/MRR.
+
+    python -m src.bench                         # TF-IDF, dense
+    python -m src.bench --mode fake --retrieval hybrid
+    python -m src.bench --compare bench/results/a.json bench/results/b.json
+
+Modus `fake` bruker embedding-stien med den deterministiske fake-serveren
+(src.fake_openai), så tallene er like fra kjøring til kjøring og uten nett.
+Modus `hashing` bruker embedding-stien med den lokale hashing-embedderen
+(src.embedders) – ingen server og ingen nettverkskall per spørring.
+Resultatet lagres som JSON (standard bench/results/<modus>-<søk>-<commit>.json).
+"""
+from __future__ import annotations
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import unicodedata
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+GOLDEN_PATH = Path("bench/golden_queries.jsonl")
+RESULTS_DIR = Path("bench/results")
+MODES = ("tfidf", "fake", "hashing")
+
+
+def load_golden(path: Path = GOLDEN_PATH) -> List[Dict]:
+    with Path(path).open(encoding="utf-8") as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+def _name(source: str) -> str:
+    return unicodedata.normalize("NFC", Path(source or "").name)
+
+
+@contextmanager
+def _patched(module, **attrs) -> Iterator[None]:
+    old = {k: getattr(module, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(module, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(module, k, v)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _score(hits: List[Dict], expected: List[str], k: int) -> Dict:
+    want = {_name(e) for e in expected}
+    names = [_name(h.get("source", "")) for h in hits[:k]]
+    rank = next((i + 1 for i, n in enumerate(names) if n in want), None)
+    return {"recall": len(want & set(names)) / len(want), "rr": 1.0 / rank if rank else 0.0, "rank": rank,
+            "top": names}
+
+
+def run(mode: str = "tfidf", kb_dir: Path = Path("kb"), k: int = 5, repeat: int = 3,
+        retrieval: str = "dense", golden: Optional[List[Dict]] = None,
+        data_dir: Optional[Path] = None) -> Dict:
+    """Bygg indeksen (målt), spill av gullsettet `repeat` ganger og returner rapporten."""
+    from src import answer, chunking, embed_cache, retrieve
+
+    if mode not in MODES:
+        raise ValueError(f"Ukjent modus {mode!r} (gyldige: {', '.join(MODES)})")
+    golden = golden if golden is not None else load_golden()
+    kb_dir = Path(kb_dir)
+
+    with ExitStack() as stack:
+        if data_dir is None:
+            data_dir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="rag-bench-")))
+        state = dict(DATA_DIR=data_dir, KB_DIRS=[kb_dir], RETRIEVAL_MODE=retrieval, _current=None)
+        stack.enter_context(_patched(embed_cache, CACHE_ENABLED=False))
+        stack.enter_context(_patched(answer, RETRIEVAL_MODE=retrieval, _cache=None))
+
+        t0 = time.perf_counter()
+        if mode == "tfidf":
+            stack.enter_context(_patched(retrieve, USE_OPENAI=False, **state))
+            stack.callback(lambda: retrieve.current().close())
+            retrieve.tfidf_index(rebuild=True)
+        elif mode == "hashing":
+            from src import ingest
+
+            stack.enter_context(_patched(ingest, USE_OPENAI=True, EMBEDDER="hashing", DATA_DIR=data_dir))
+            stack.enter_context(_patched(retrieve, USE_OPENAI=True, EMBEDDER="hashing", **state))
+            stack.callback(lambda: retrieve.current().close())
+            t0 = time.perf_counter()
+            ingest.build_index(kb_dir, full=True)
+        else:
+            from openai import OpenAI
+            from src import fake_openai, ingest
+
+            server, _, url = fake_openai.serve()
+            stack.callback(server.shutdown)
+            client = OpenAI(base_url=url, api_key="fake")
+            stack.enter_context(_patched(ingest, USE_OPENAI=True, DATA_DIR=data_dir, client=client))
+            stack.enter_context(_patched(retrieve, USE_OPENAI=True, _openai=client, **state))
+            stack.callback(lambda: retrieve.current().close())
+            t0 = time.perf_counter()
+            ingest.build_index(kb_dir, full=True)
+        build_s = time.perf_counter() - t0
+
+        # oppvarming: lat lasting av indeks, BM25 og nøkkelordmatrise
+        for g in golden[:3]:
+            answer._retrieve(g["query"], k)
+
+        lat: List[float] = []
+        per_query: List[Dict] = []
+        t_all = time.perf_counter()
+        for rep in range(max(1, repeat)):
+            for g in golden:
+                t = time.perf_counter()
+                hits, raw = answer._retrieve(g["query"], k)
+                lat.append(time.perf_counter() - t)
+                if rep == 0:
+                    raw_score = _score(raw, g["expected"], k)
+                    per_query.append({"id": g["id"], "query": g["query"], **_score(hits, g["expected"], k),
+                                      "search_rank": raw_score["rank"], "search_recall": raw_score["recall"]})
+        wall = time.perf_counter() - t_all
+        store = chunking.open_store(data_dir)
+        n_chunks = store.n if store else None
+
+    ms = np.asarray(lat) * 1000
+    return {
+        "meta": {
+            "commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "mode": mode, "retrieval": retrieval, "k": k,
+            "repeat": repeat, "queries": len(golden), "chunks": n_chunks,
+            "chunk_tokens": chunking.CHUNK_TOKENS, "chunk_overlap": chunking.CHUNK_OVERLAP_TOKENS,
+        },
+        "build_s": round(build_s, 4),
+        "latency_ms": {"p50": round(float(np.percentile(ms, 50)), 3), "p95": round(float(np.percentile(ms, 95)), 3),
+                       "p99": round(float(np.percentile(ms, 99)), 3), "mean": round(float(ms.mean()), 3)},
+        "qps": round(len(lat) / wall, 2) if wall > 0 else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        # etter rerank/terskel (det svaret ser) og rått fra search() (selve gjenfinningen)
+        f"recall@{k}": round(float(np.mean([q["recall"] for q in per_query])), 4),
+        "mrr": round(float(np.mean([q["rr"] for q in per_query])), 4),
+        f"search_recall@{k}": round(float(np.mean([q["search_recall"] for q in per_query])), 4),
+        "search_mrr": round(float(np.mean([1.0 / q["search_rank"] if q["search_rank"] else 0.0
+                                           for q in per_query])), 4),
+        "per_query": per_query,
+    }
+
+
+def save(report: Dict, out: Optional[Path] = None) -> Path:
+    m = report["meta"]
+    out = Path(out) if out else RESULTS_DIR / f"{m['mode']}-{m['retrieval']}-{m['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return out
+
+
+def _headline(report: Dict) -> Dict[str, float]:
+    out = {"build_s": report["build_s"], "qps": report["qps"], "peak_rss_mb": report["peak_rss_mb"],
+           "mrr": report["mrr"]}
+    out.update({f"latency_{p}": v for p, v in report["latency_ms"].items()})
+    out.update({key: v for key, v in report.items() if "recall@" in key or key == "search_mrr"})
+    return out
+
+
+def compare(a: Dict, b: Dict) -> List[str]:
+    """Linjer med nøkkeltall for a -> b, og spørsmål der rangen endret seg."""
+    ha, hb = _headline(a), _headline(b)
+    lines = [f"{a['meta']['commit']} -> {b['meta']['commit']}"]
+    for key in ha:
+        va, vb = ha[key], hb.get(key)
+        delta = f"{(vb - va) / va * 100:+.1f}%" if va and vb is not None else ""
+        lines.append(f"  {key:<14} {va!s:>10} -> {vb!s:>10} {delta}")
+    ranks = {q["id"]: q["rank"] for q in a.get("per_query", [])}
+    for q in b.get("per_query", []):
+        if q["id"] in ranks and ranks[q["id"]] != q["rank"]:
+            lines.append(f"  {q['id']}: rang {ranks[q['id']]} -> {q['rank']}  ({q['query']})")
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Benchmark av søket mot gullsettet i bench/.")
+    ap.add_argument("--mode", choices=MODES, default="tfidf")
+    ap.add_argument("--retrieval", choices=("dense", "hybrid"), default="dense")
+    ap.add_argument("--kb", type=Path, default=Path("kb"))
+    ap.add_argument("--golden", type=Path, default=GOLDEN_PATH)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", type=Path, default=None)
+    ap.add_argument("--compare", nargs=2, type=Path, metavar=("FØR", "ETTER"))
+    args = ap.parse_args()
+
+    if args.compare:
+        a, b = (json.loads(p.read_text(encoding="utf-8")) for p in args.compare)
+        print("\n".join(compare(a, b)))
+        sys.exit(0)
+
+    report = run(args.mode, args.kb, k=args.k, repeat=args.repeat, retrieval=args.retrieval,
+                 golden=load_golden(args.golden))
+    path = save(report, args.out)
+    print(json.dumps({key: v for key, v in report.items() if key != "per_query"}, ensure_ascii=False, indent=2))
+    print(f"[bench] Resultat skrevet til {path}")
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import hashlib
+import re
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src import metastore
+from src.utils import lazy_import, unique_tmp
+
+sp = lazy_import("scipy.sparse")
+
+# Okapi BM25 over et invertert indeks. Vektene (idf * tf-metning) beregnes
+# én gang ved bygging og lagres som en CSR-matrise term x dokument, så en
+# spørring er bare summen av postinglistene til termene i den.
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _WORD.findall(text) if len(t) > 1 or t.isdigit()]
+
+
+def meta_digest(meta: Sequence[Dict]) -> str:
+    """Identifiserer radsettet indeksen hører til (id + tekstlengde per rad)."""
+    h = hashlib.sha1()
+    if hasattr(meta, "ids_and_lengths"):  # metastore.MetaTable: kolonnevis
+        pairs = meta.ids_and_lengths()  # type: ignore[attr-defined]
+    else:
+        pairs = ((m.get("id"), len(m.get("text") or "")) for m in meta)
+    for mid, n in pairs:
+        h.update(f"{mid}:{n}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+class BM25Index:
+    def __init__(self, vocab: Dict[str, int], weights: sp.csr_matrix, digest: str = ""):
+        self.vocab = vocab
+        self.weights = weights  # (n_terms, n_docs)
+        self.digest = digest
+
+    @property
+    def n_docs(self) -> int:
+        return self.weights.shape[1]
+
+    @classmethod
+    def build(cls, texts: Iterable[str], digest: str = "", k1: float = K1, b: float = B) -> "BM25Index":
+        """Ett pass over `texts` (kan være en generator)."""
+        vocab: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        tfs: List[int] = []
+        lens: List[int] = []
+        for d, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            toks = tokenize(text or "")
+            lens.append(len(toks))
+            for t in toks:
+                tid = vocab.setdefault(t, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            rows += counts.keys()
+            cols += [d] * len(counts)
+            tfs += counts.values()
+        doc_len = np.asarray(lens, dtype="float32")
+        n_docs = len(lens)
+        tf = sp.csr_matrix((np.asarray(tfs, dtype="float32"), (rows, cols)), shape=(len(vocab), n_docs))
+        df = np.diff(tf.indptr).astype("float32")
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = float(doc_len.mean()) if n_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len / (avgdl or 1.0))
+        w = tf.copy()
+        w.data = w.data * (k1 + 1) / (w.data + norm[w.indices])
+        w.data *= np.repeat(idf, np.diff(w.indptr))
+        return cls(vocab, w.tocsr(), digest)
+
+    def scores(self, query: str) -> sp.csr_matrix:
+        ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not ids:
+            return sp.csr_matrix((1, self.n_docs), dtype="float32")
+        return sp.csr_matrix(self.weights[ids].sum(axis=0))
+
+    def top(self, query: str, n: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(dokument-id-er, skårer) for de n beste dokumentene med minst ett treff (innenfor `mask`)."""
+        s = self.scores(query)
+        docs, vals = s.indices, s.data
+        if mask is not None:
+            keep = mask[docs]
+            docs, vals = docs[keep], vals[keep]
+        if len(docs) > n:
+            keep = np.argpartition(vals, len(vals) - n)[len(vals) - n:]
+            docs, vals = docs[keep], vals[keep]
+        order = np.argsort(vals)[::-1]
+        return docs[order], vals[order]
+
+    def save(self, path: str | Path) -> None:
+        terms = np.empty(len(self.vocab), dtype=object)
+        for t, i in self.vocab.items():
+            terms[i] = t
+        w = self.weights
+        tmp = unique_tmp(Path(path))
+        with tmp.open("wb") as f:
+            np.savez(f, data=w.data, indices=w.indices, indptr=w.indptr, shape=np.array(w.shape),
+                     terms=terms.astype(str), digest=np.array(self.digest))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BM25Index":
+        z = np.load(path)
+        w = sp.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+        vocab = {str(t): i for i, t in enumerate(z["terms"])}
+        return cls(vocab, w, str(z["digest"]))
+
+
+def build_for(meta: Sequence[Dict], path: str | Path) -> BM25Index:
+    """Bygg og lagre BM25 for radene i `meta` (samme rekkefølge som vektorene)."""
+    index = BM25Index.build(metastore.iter_column(meta, "text"), digest=meta_digest(meta))
+    index.save(path)
+    return index
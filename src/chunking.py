@@ -0,0 +1,355 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from src import artifacts, loader, metastore
+
+# Felles korpus- og chunkingmotor. Ett pass over kildene (via src.loader)
+# gir et versjonert bitlager som både TF-IDF, embeddings, BM25 og
+# FAISS-byggingen leser fra. Det skrives inn i generasjonen som bygges
+# (src.artifacts) og publiseres sammen med artefaktene laget fra det, så en
+# leser aldri ser nye biter med gammel metadata:
+#   chunks.jsonl  én bit per linje (metastore.FIELDS)
+#   chunks.arrow  samme rader kolonnebasert (minnemappes)
+#   chunks.json   versjon, parametre, per fil stat/sha256 + radintervall, og
+#                 `generation` – endres bare når innholdet i lageret endres
+# Bare nye/endrede filer parses på nytt; uendrede filer kopierer radene sine.
+CHUNK_VERSION = 1
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+_TOKEN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.+?)\s*#*\s*$")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?=[\"«(\[]?[A-ZÆØÅ0-9])")
+
+
+def count_tokens(text: str) -> int:
+    """Grovt tokenantall: ord og tegnsetting hver for seg."""
+    return len(_TOKEN.findall(text))
+
+
+# ---------- Rensing og metadata ----------
+def clean_text(txt: str) -> str:
+    """Fjern codefences og NBSP, komprimer mellomrom, men behold linjeskift."""
+    txt = re.sub(r"```.*?```", " ", txt, flags=re.S)
+    txt = txt.replace(" ", " ")
+    txt = re.sub(r"[ \t\r\f\v]+", " ", txt)
+    txt = re.sub(r" ?\n ?", "\n", txt)
+    return re.sub(r"\n{3,}", "\n\n", txt).strip()
+
+
+def title_from_markdown(txt: str, fallback: str) -> str:
+    m = re.search(r"^\s*#\s+(.+)$", txt, flags=re.M)
+    if m:
+        return m.group(1).strip()
+    for line in txt.splitlines():
+        s = line.strip()
+        if s:
+            return s[:120]
+    return fallback
+
+
+def infer_doc_type(name: str, text: str) -> str:
+    low = (name + " " + text[:400]).lower()
+    if any(w in low for w in ["vilkår", "terms", "betingelser", "angrerett", "personvern", "gdpr", "privacy"]):
+        return "regel"
+    if any(w in low for w in ["pris", "timepris", "avgift", "kontingent", "kostnad", "rabatt"]):
+        return "pris"
+    if any(w in low for w in ["booking", "banebooking", "reserver", "matchi", "baneregler"]):
+        return "booking"
+    if any(w in low for w in ["håndbok"]):
+        return "håndbok"
+    return "annet"
+
+
+# ---------- Oppdeling ----------
+def _sections(text: str) -> Iterator[Tuple[str, List[str]]]:
+    """(overskrift, setninger) per seksjon; tekst før første overskrift har tom overskrift."""
+    heading, lines = "", []
+    for line in text.splitlines():
+        m = _HEADING.match(line)
+        if m:
+            if heading or lines:
+                yield heading, _sentences(lines)
+            heading, lines = m.group(1).strip(), []
+        else:
+            lines.append(line)
+    if heading or lines:
+        yield heading, _sentences(lines)
+
+
+_LIST_ITEM = re.compile(r"^\s*(?:[-*+•]|\d+[.)])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Setningene i `text`; et linjeskift avslutter også en setning."""
+    out: List[str] = []
+    for line in (text or "").splitlines():
+        out.extend(s.strip() for s in _SENTENCE_END.split(line) if s.strip())
+    return out
+
+
+def _sentences(lines: Sequence[str]) -> List[str]:
+    """Avsnitt (tomme linjer skiller, punktlister er egne avsnitt) delt i setninger."""
+    paragraphs: List[str] = []
+    cur: List[str] = []
+    for line in list(lines) + [""]:
+        line = line.strip()
+        if not line or _LIST_ITEM.match(line):
+            if cur:
+                paragraphs.append(" ".join(cur))
+            cur = [line] if line else []
+        else:
+            cur.append(line)
+    out: List[str] = []
+    for para in paragraphs:
+        out.extend(split_sentences(para))
+    return out
+
+
+def _pieces(sentence: str, max_tokens: int) -> Iterator[str]:
+    """Setninger over budsjettet deles på ordgrenser."""
+    if count_tokens(sentence) <= max_tokens:
+        yield sentence
+        return
+    cur: List[str] = []
+    n = 0
+    for word in sentence.split():
+        t = count_tokens(word)
+        if cur and n + t > max_tokens:
+            yield " ".join(cur)
+            cur, n = [], 0
+        cur.append(word)
+        n += t
+    if cur:
+        yield " ".join(cur)
+
+
+def split_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    Del teksten i biter på maks `max_tokens`: setninger pakkes sammen innenfor
+    en seksjon, og hele korte seksjoner slås sammen. En seksjon som ikke får
+    plass (eller følger etter en oppdelt seksjon) starter ny bit, og
+    fortsettelsesbiter får seksjonsoverskriften først pluss de siste
+    setningene (opptil `overlap_tokens`) fra forrige bit.
+    """
+    max_tokens = max(1, max_tokens)
+    chunks: List[str] = []
+    cur: List[Tuple[str, int]] = []
+    split = False  # forrige seksjon ble delt over flere biter
+
+    def _flush() -> None:
+        if any(t for _, t in cur):
+            chunks.append(" ".join(s for s, _ in cur))
+
+    for heading, sentences in _sections(clean_text(text)):
+        head = [(heading, count_tokens(heading))] if heading else []
+        sec_tokens = sum(t for _, t in head) + sum(count_tokens(s) for s in sentences)
+        if cur and (split or sum(t for _, t in cur) + sec_tokens > max_tokens):
+            _flush()
+            cur = []
+        split = False
+        cur.extend(head)
+        body_start = len(cur)
+        for sentence in sentences:
+            for piece in _pieces(sentence, max_tokens):
+                t = count_tokens(piece)
+                if cur[body_start:] and sum(n for _, n in cur) + t > max_tokens:
+                    _flush()
+                    split = True
+                    carry: List[Tuple[str, int]] = []
+                    for s, n in reversed(cur[body_start:]):
+                        if sum(c for _, c in carry) + n > overlap_tokens:
+                            break
+                        carry.insert(0, (s, n))
+                    cur = head + carry
+                    if sum(n for _, n in cur) + t > max_tokens:
+                        cur = list(head) if sum(n for _, n in head) + t <= max_tokens else []
+                    body_start = len(head) if cur else 0
+                cur.append((piece, t))
+    _flush()
+    return chunks
+
+
+def chunk_file(p: Path, pages: Iterable[loader.Page], max_tokens: int = CHUNK_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict]:
+    """Radene (metastore.FIELDS) for én fil; PDF-biter beholder sidenummeret."""
+    source = p.as_posix()
+    suffix = p.suffix.lower()
+    title = doc_type = None
+    ci = 0
+    for page, raw, meta in pages:
+        if suffix == ".jsonl":
+            if not raw.strip():
+                continue
+            src = str(meta.get("source") or source).replace("\\", "/")
+            title = meta.get("title") or title_from_markdown(raw, Path(src).stem)
+            doc_type = meta.get("doc_type") or infer_doc_type(title, raw)
+            version_date = meta.get("version_date")
+        else:
+            src = source
+            if title is None:
+                # tittel/doc_type fra starten av dokumentet (første PDF-side)
+                title = title_from_markdown(raw, p.stem.replace("-", " "))
+                doc_type = infer_doc_type(p.name, re.sub(r"\s+", " ", clean_text(raw)))
+            version_date = None
+        for text in split_text(raw, max_tokens, overlap_tokens):
+            yield {
+                "text": text,
+                "source": src,
+                "title": title,
+                "doc_type": doc_type,
+                "version_date": version_date,
+                "page": page,
+                "chunk_idx": ci,
+                "id": f"{src}#{ci}",
+            }
+            ci += 1
+
+
+# ---------- Bitlageret ----------
+def roots(kb_dir: str | Path) -> List[Path]:
+    """Kildekatalogene for KB_DIR; ingest og retrieve bruker samme liste, så de får samme generasjon."""
+    return [Path(kb_dir), Path("data/processed")]
+
+
+def file_sha256(p: Path) -> str:
+    h = hashlib.sha256()
+    with p.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _params() -> Dict:
+    return {"tokens": CHUNK_TOKENS, "overlap": CHUNK_OVERLAP_TOKENS}
+
+
+class ChunkStore:
+    """Et ferdig bitlager i katalogen `path` (lest fra chunks.json)."""
+
+    def __init__(self, path: Path, info: Dict):
+        self.path = Path(path)
+        self.info = info
+        self.generation: str = info["generation"]
+        self.n: int = info["n"]
+        self.jsonl = self.path / "chunks.jsonl"
+        self.arrow = self.path / "chunks.arrow"
+
+    @property
+    def files(self) -> Dict[str, Dict]:
+        return self.info["files"]
+
+    def meta(self) -> metastore.MetaTable:
+        return metastore.MetaTable.open(self.arrow)
+
+    def iter_rows(self) -> Iterator[Dict]:
+        """Radene i rekkefølge, strømmet fra chunks.jsonl."""
+        with self.jsonl.open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _load_info(d: Path) -> Dict:
+    try:
+        info = json.loads((d / "chunks.json").read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if info.get("version") != CHUNK_VERSION or info.get("params") != _params():
+        return {}
+    if not (d / "chunks.jsonl").exists() or not (d / "chunks.arrow").exists():
+        return {}
+    return info
+
+
+def open_store(data_dir: Path) -> Optional[ChunkStore]:
+    """Lageret i gjeldende generasjon, uten å se på kildene (None hvis det mangler)."""
+    d = artifacts.current_dir(Path(data_dir))
+    info = _load_info(d)
+    return ChunkStore(d, info) if info else None
+
+
+def _plan(roots: Iterable[Path], old_files: Dict[str, Dict]) -> Tuple[str, List[Tuple[Path, Dict, Optional[Dict]]]]:
+    """(generasjon, [(fil, stat/sha256, forrige oppføring hvis innholdet er uendret)]) for kildene."""
+    plan: List[Tuple[Path, Dict, Optional[Dict]]] = []
+    for p in loader.iter_files(roots):
+        stat = p.stat()
+        prev = old_files.get(p.as_posix())
+        if prev and prev["mtime"] == stat.st_mtime and prev["size"] == stat.st_size:
+            sha = prev["sha256"]
+        else:
+            sha = file_sha256(p)
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha}
+        plan.append((p, entry, prev if prev and prev["sha256"] == sha else None))
+
+    h = hashlib.sha1(json.dumps([CHUNK_VERSION, _params()]).encode("utf-8"))
+    for p, entry, _ in plan:
+        h.update(f"{p.as_posix()}\0{entry['sha256']}\n".encode("utf-8"))
+    return h.hexdigest(), plan
+
+
+def store_generation(roots: Iterable[Path], data_dir: Path) -> str:
+    """Generasjonen lageret for `roots` ville fått, uten å skrive noe (for å se om korpuset er endret)."""
+    old = _load_info(artifacts.current_dir(Path(data_dir)))
+    return _plan(roots, old.get("files", {}))[0]
+
+
+def ensure_store(roots: Iterable[Path], data_dir: Path, out: Path, rebuild: bool = False) -> ChunkStore:
+    """
+    Skriv bitlageret for filene under `roots` inn i byggekatalogen `out`
+    (artifacts.stage), så det publiseres i samme generasjon som artefaktene
+    som bygges fra det. Forrige lager leses fra gjeldende generasjon:
+    uendrede filer (samme mtime/størrelse eller sha256) gjenbruker radene
+    sine, og bare nye/endrede filer lastes og chunkes.
+    """
+    data_dir, out = Path(data_dir), Path(out)
+    prev_dir = artifacts.current_dir(data_dir)
+    old = {} if rebuild else _load_info(prev_dir)
+    old_files: Dict[str, Dict] = old.get("files", {})
+    generation, plan = _plan(roots, old_files)
+
+    if old and old.get("generation") == generation:
+        # uendret innhold: lenk radene over, men ta med ny stat (f.eks. etter en ny checkout)
+        for name in ("chunks.jsonl", "chunks.arrow"):
+            artifacts.link(prev_dir / name, out / name)
+        info = {**old, "files": {p.as_posix(): {**e, "rows": old_files[p.as_posix()]["rows"]} for p, e, _ in plan}}
+        _write_info(out, info)
+        return ChunkStore(out, info)
+
+    old_meta = metastore.MetaTable.open(prev_dir / "chunks.arrow") if old else None
+    files: Dict[str, Dict] = {}
+    n = parsed = 0
+    try:
+        with (out / "chunks.jsonl").open("w", encoding="utf-8") as f:
+            loaded = loader.iter_pages([p for p, _, prev in plan if prev is None])
+            for p, entry, prev in plan:
+                start = n
+                if prev is not None:
+                    rows: Iterable[Dict] = (dict(old_meta[i]) for i in range(*prev["rows"]))  # type: ignore[index]
+                else:
+                    _, pages = next(loaded)
+                    rows = chunk_file(p, pages)
+                    parsed += 1
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    n += 1
+                files[p.as_posix()] = {**entry, "rows": [start, n]}
+            loaded.close()
+    finally:
+        if old_meta is not None:
+            old_meta.close()
+    metastore.convert_jsonl(out / "chunks.jsonl")  # -> chunks.arrow
+    info = {"version": CHUNK_VERSION, "params": _params(), "generation": generation, "n": n, "files": files}
+    _write_info(out, info)
+    print(f"[chunking] {n} biter i {out}/chunks.jsonl ({parsed} filer chunket, "
+          f"{len(plan) - parsed} gjenbrukt).")
+    return ChunkStore(out, info)
+
+
+def _write_info(d: Path, info: Dict) -> None:
+    (d / "chunks.json").write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
@@ -0,0 +1,85 @@
+from __future__ import annotations
+import os
+import re
+from typing import Dict, List, Sequence, Tuple
+
+from src.chunking import count_tokens, split_sentences
+
+# Kontekst til LLM-en fra rerankede treff. Naboer fra samme kilde og side
+# (påfølgende chunk_idx) slås sammen til ett utdrag, setninger som allerede
+# står i konteksten (overlappen mellom biter, gjentatte avsnitt) fjernes, og
+# utdragene fylles inn i skårrekkefølge til CONTEXT_TOKENS er brukt opp.
+# Tokens telles med chunking.count_tokens, samme mål som bitstørrelsen.
+
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "900"))
+MIN_PIECE_TOKENS = 12  # mindre rest av budsjettet enn dette brukes ikke på et avkortet utdrag
+
+
+def _key(sentence: str) -> str:
+    return re.sub(r"\s+", " ", sentence).strip().lower()
+
+
+def _runs(hits: Sequence[Dict]) -> List[List[Dict]]:
+    """Treffene gruppert i sammenhengende biter fra samme kilde/side, i skårrekkefølge."""
+    groups: Dict[Tuple, List[Tuple[int, Dict]]] = {}
+    for rank, h in enumerate(hits):
+        groups.setdefault((h.get("source"), h.get("page")), []).append((rank, h))
+    runs: List[Tuple[int, List[Dict]]] = []
+    for members in groups.values():
+        members.sort(key=lambda m: (m[1].get("chunk_idx") is None, m[1].get("chunk_idx") or 0, m[0]))
+        cur: List[Tuple[int, Dict]] = []
+        for m in members:
+            idx, prev = m[1].get("chunk_idx"), cur[-1][1].get("chunk_idx") if cur else None
+            if cur and (idx is None or prev is None or idx - prev > 1):
+                runs.append((min(r for r, _ in cur), [h for _, h in cur]))
+                cur = []
+            cur.append(m)
+        if cur:
+            runs.append((min(r for r, _ in cur), [h for _, h in cur]))
+    runs.sort(key=lambda r: r[0])  # et utdrag rangeres som sitt beste treff
+    return [hs for _, hs in runs]
+
+
+def build(hits: Sequence[Dict], budget: int = CONTEXT_TOKENS) -> Tuple[List[Dict], int]:
+    """
+    Utdrag for prompten: [{"source", "title", "page", "text", "tokens", "hits"}]
+    i skårrekkefølge, og totalt antall tokens. Et utdrag som ikke får plass
+    kuttes etter hele setninger; resten av budsjettet går til neste.
+    """
+    seen: set = set()
+    out: List[Dict] = []
+    used = 0
+    for run in _runs(hits):
+        sentences: List[Tuple[str, str]] = []
+        keys: set = set()
+        for h in run:
+            for s in split_sentences(h.get("text", "")):
+                k = _key(s)
+                if k not in seen and k not in keys:
+                    keys.add(k)
+                    sentences.append((s, k))
+        if not sentences:
+            continue
+        left = budget - used
+        if left < MIN_PIECE_TOKENS and out:
+            break
+        kept: List[str] = []
+        n = 0
+        for s, k in sentences:
+            t = count_tokens(s) + 1
+            if n + t > left:
+                break
+            kept.append(s)
+            seen.add(k)  # bare setninger som faktisk står i konteksten
+            n += t
+        if not kept:
+            continue
+        first = run[0]
+        out.append({"source": first.get("source"), "title": first.get("title"), "page": first.get("page"),
+                    "text": " ".join(kept), "tokens": n, "hits": len(run)})
+        used += n
+    return out, used
+
+
+def render(excerpts: Sequence[Dict]) -> str:
+    return "\n\n".join(f"Utdrag {i+1}:\n{e['text']}" for i, e in enumerate(excerpts))
@@ -0,0 +1,139 @@
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src import settings, trace
+from src.utils import env_flag
+
+# --- Konfig ---
+DATA_DIR = settings.get().data_dir  # samme katalog som indeksen (env, .env eller secrets)
+CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", str(DATA_DIR / "embed_cache.sqlite")))
+CACHE_MAX = int(os.getenv("EMBED_CACHE_MAX", "50000"))  # maks antall vektorer før LRU-utkasting
+CACHE_ENABLED = env_flag("EMBED_CACHE", True)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embedding-cache på disk (SQLite), nøklet på (modell, sha256 av teksten).
+    Vektorene lagres som float32-bytes. `last_used` oppdateres ved treff, og
+    eldste rader kastes ut når antallet passerer `max_entries`.
+    Trådsikker; kan deles av ingest og retrieve i samme prosess.
+    """
+
+    def __init__(self, path: str | Path = CACHE_PATH, max_entries: int = CACHE_MAX):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS emb ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, dim INTEGER NOT NULL,"
+            " vec BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS emb_lru ON emb(last_used)")
+        self._db.commit()
+
+    def get_many(self, model: str, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """Returnerer {posisjon i `texts`: vektor} for tekstene som finnes i cachen."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        uniq = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                q = "SELECT hash, vec FROM emb WHERE model = ? AND hash IN (%s)" % ",".join("?" * len(part))
+                for h, blob in self._db.execute(q, [model, *part]):
+                    found[h] = np.frombuffer(blob, dtype="float32")
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE emb SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._db.commit()
+            out = {i: found[h] for i, h in enumerate(hashes) if h in found}
+            self.hits += len(out)
+            self.misses += len(texts) - len(out)
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vecs: np.ndarray) -> None:
+        if len(texts) == 0:
+            return
+        vecs = np.asarray(vecs, dtype="float32")
+        now = time.time()
+        rows = [(model, text_hash(t), int(v.shape[0]), v.tobytes(), now) for t, v in zip(texts, vecs)]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO emb VALUES (?, ?, ?, ?, ?)", rows)
+            (n,) = self._db.execute("SELECT COUNT(*) FROM emb").fetchone()
+            if n > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM emb WHERE rowid IN (SELECT rowid FROM emb ORDER BY last_used LIMIT ?)",
+                    (n - self.max_entries,),
+                )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            (n,) = self._db.execute("SELECT COUNT(*) FROM emb").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": n,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_CACHE: Optional[EmbeddingCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """Delt cache-instans per prosess (None hvis slått av med EMBED_CACHE=0)."""
+    global _CACHE
+    if not CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            try:
+                _CACHE = EmbeddingCache()
+            except Exception as e:
+                print(f"[embed_cache] Kunne ikke åpne {CACHE_PATH}: {e} – kjører uten cache.")
+                return None
+        return _CACHE
+
+
+def split_cached(model: str, texts: List[str]) -> tuple[Dict[int, np.ndarray], List[int]]:
+    """Slår opp `texts` i cachen. Returnerer (treff, posisjoner som mangler)."""
+    cache = get_cache()
+    found = cache.get_many(model, texts) if cache is not None else {}
+    if cache is not None:
+        trace.count("cache", len(found), cache="embed", result="hit")
+        trace.count("cache", len(texts) - len(found), cache="embed", result="miss")
+    return found, [i for i in range(len(texts)) if i not in found]
+
+
+def store(model: str, texts: List[str], vecs: np.ndarray) -> None:
+    cache = get_cache()
+    if cache is not None:
+        cache.put_many(model, texts, vecs)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+# --- Konfig ---
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # samtidige kall mot API-et
+EMBED_BATCH_ITEMS = int(os.getenv("EMBED_BATCH_ITEMS", "256"))  # maks tekster per kall (API-grense 2048)
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "60000"))  # maks (estimerte) tokens per kall
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "0.5"))  # sekunder, dobles per forsøk
+EMBED_BACKOFF_MAX = 30.0
+
+
+def approx_tokens(text: str) -> int:
+    # Grovt anslag uten tokenizer: ~3 tegn per token for norsk tekst
+    return len(text) // 3 + 1
+
+
+def pack_batches(texts: Sequence[str], max_items: int = EMBED_BATCH_ITEMS,
+                 max_tokens: int = EMBED_BATCH_TOKENS) -> List[List[int]]:
+    """Pakk posisjoner i `texts` i batcher begrenset av både antall og estimerte tokens."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    cur_tok = 0
+    for i, t in enumerate(texts):
+        n = approx_tokens(t)
+        if cur and (len(cur) >= max_items or cur_tok + n > max_tokens):
+            batches.append(cur)
+            cur, cur_tok = [], 0
+        cur.append(i)
+        cur_tok += n
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def _retryable(e: Exception) -> bool:
+    import openai  # her og ikke på modulnivå: ingest skal kunne importeres uten openai
+
+    if isinstance(e, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    resp = getattr(e, "response", None)
+    try:
+        return float(resp.headers.get("retry-after"))  # type: ignore
+    except Exception:
+        return None
+
+
+def _embed_once(client, model: str, batch: List[str], backoff_base: float, max_retries: int) -> np.ndarray:
+    for attempt in range(max_retries + 1):
+        try:
+            r = client.embeddings.create(model=model, input=batch)
+            break
+        except Exception as e:
+            if not _retryable(e) or attempt == max_retries:
+                raise
+            delay = min(EMBED_BACKOFF_MAX, backoff_base * (2 ** attempt))
+            hint = _retry_after(e)
+            if hint is not None:
+                delay = max(delay, hint)
+            time.sleep(delay * (0.5 + random.random() / 2))  # jitter
+    got = np.asarray([item.embedding for item in sorted(r.data, key=lambda d: d.index)], dtype="float32")
+    return got / (np.linalg.norm(got, axis=1, keepdims=True) + 1e-12)
+
+
+def embed_texts(client, model: str, texts: Sequence[str],
+                on_batch: Optional[Callable[[List[int], np.ndarray], None]] = None,
+                concurrency: int = EMBED_CONCURRENCY,
+                max_items: int = EMBED_BATCH_ITEMS,
+                max_tokens: int = EMBED_BATCH_TOKENS,
+                max_retries: int = EMBED_MAX_RETRIES,
+                backoff_base: float = EMBED_BACKOFF_BASE) -> np.ndarray:
+    """
+    Embedd `texts` med begrenset samtidighet (tråder), token-pakkede batcher og
+    eksponentiell backoff på 429/5xx/nettverksfeil. `on_batch(posisjoner, vektorer)`
+    kalles i kallerens tråd etter hver ferdige batch – ingest bruker det til å
+    sjekkpunkte i embedding-cachen, slik at et avbrutt bygg fortsetter der det stoppet.
+    Returnerer normaliserte vektorer i samme rekkefølge som `texts`.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    # Klientens egne retries slås av; backoff styres her
+    client = client.with_options(max_retries=0) if hasattr(client, "with_options") else client
+    batches = pack_batches(texts, max_items, max_tokens)
+    out: List[Optional[np.ndarray]] = [None] * len(texts)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        pending = {}
+        queue = iter(batches)
+        try:
+            # Hold maks `concurrency` batcher i luften; nye sendes etter hvert som de blir ferdige
+            for idx in queue:
+                pending[pool.submit(_embed_once, client, model, [texts[i] for i in idx], backoff_base, max_retries)] = idx
+                if len(pending) >= concurrency:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    idx = pending.pop(fut)
+                    vecs = fut.result()
+                    for i, v in zip(idx, vecs):
+                        out[i] = v
+                    if on_batch is not None:
+                        on_batch(idx, vecs)
+                    nxt = next(queue, None)
+                    if nxt is not None:
+                        pending[pool.submit(_embed_once, client, model, [texts[i] for i in nxt], backoff_base, max_retries)] = nxt
+        except BaseException:
+            for fut in pending:
+                fut.cancel()
+            raise
+
+    return np.vstack(out)  # type: ignore[arg-type]
@@ -0,0 +1,236 @@
+from __future__ import annotations
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from src import embed_pipeline, settings, trace
+from src.utils import optional_import
+
+# Embedderen bak vektorbackenden (USE_OPENAI=true), valgt med EMBEDDER:
+#   openai  – embeddings-API-et (EMBED_MODEL); ett nettverkskall per spørring
+#   hashing – hashing-trikset: ord og bokstav-n-gram hashet med fortegn inn i
+#             HASH_EMBED_DIM dimensjoner. Ingen modell, ingen nettverk.
+#   onnx    – lokal setningsmodell: LOCAL_EMBED_MODEL er en katalog med
+#             model.onnx og tokenizer.json (krever onnxruntime og tokenizers)
+# Lokale embeddere kjører på CPU i batcher av LOCAL_EMBED_BATCH tekster fordelt
+# på LOCAL_EMBED_THREADS tråder. `id` skrives i manifestet ved ingest, og
+# src.retrieve nekter å søke i vektorer bygd med en annen embedder.
+
+KINDS = ("openai", "hashing", "onnx")
+HASH_EMBED_DIM = int(os.getenv("HASH_EMBED_DIM", "512"))
+HASH_VERSION = 1  # økes når features/vekting endres (nytt id -> ny indeks)
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "")
+LOCAL_EMBED_BATCH = int(os.getenv("LOCAL_EMBED_BATCH", "32"))
+LOCAL_EMBED_THREADS = int(os.getenv("LOCAL_EMBED_THREADS", "0")) or min(8, os.cpu_count() or 1)
+LOCAL_EMBED_MAX_LEN = int(os.getenv("LOCAL_EMBED_MAX_LEN", "256"))  # tokens per tekst (onnx)
+# Prefikser for modeller trent med dem (f.eks. e5: "query: " / "passage: ")
+QUERY_PREFIX = os.getenv("LOCAL_EMBED_QUERY_PREFIX", "")
+DOC_PREFIX = os.getenv("LOCAL_EMBED_DOC_PREFIX", "")
+
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype="float32")
+    return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+
+
+def _kind(kind: Optional[str]) -> str:
+    kind = (kind or settings.get().embedder).lower()
+    if kind not in KINDS:
+        raise ValueError(f"Ukjent EMBEDDER={kind!r} (gyldige: {', '.join(KINDS)})")
+    return kind
+
+
+class Embedder:
+    """
+    Felles grensesnitt: `embed` for ingest (mange tekster, `on_batch` etter
+    hver ferdige batch) og `embed_queries` for søk. Begge gir normaliserte
+    float32-rader. `cache_key` er nøkkelen i src.embed_cache (None = ikke cache).
+    """
+
+    id: str = ""
+    dim: Optional[int] = None
+    cache_key: Optional[str] = None
+
+    def embed(self, texts: Sequence[str],
+              on_batch: Optional[Callable[[List[int], np.ndarray], None]] = None) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_queries(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenAIEmbedder(Embedder):
+    def __init__(self, model: str, client, batch_size: int = embed_pipeline.EMBED_BATCH_ITEMS):
+        self.model = model
+        self.client = client
+        self.batch_size = batch_size
+        self.id = f"openai:{model}"
+        self.cache_key = model  # samme nøkkel som før embedderne kom, så cachen gjelder fortsatt
+
+    def embed(self, texts, on_batch=None) -> np.ndarray:
+        return embed_pipeline.embed_texts(self.client, self.model, list(texts), on_batch=on_batch,
+                                          max_items=self.batch_size)
+
+    def embed_queries(self, texts) -> np.ndarray:
+        r = self.client.embeddings.create(model=self.model, input=list(texts))
+        if getattr(r, "usage", None) is not None:
+            trace.count("embed_tokens", getattr(r.usage, "total_tokens", 0) or 0)
+        return _normalize([item.embedding for item in r.data])
+
+
+class _LocalEmbedder(Embedder):
+    """CPU-embedder: `_encode(batch)` kalles for batcher av LOCAL_EMBED_BATCH tekster i en trådpool."""
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed(self, texts, on_batch=None) -> np.ndarray:
+        texts = [DOC_PREFIX + t for t in texts]
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        step = max(1, LOCAL_EMBED_BATCH)
+        batches = [list(range(a, min(a + step, len(texts)))) for a in range(0, len(texts), step)]
+        parts: List[np.ndarray] = []
+        with ThreadPoolExecutor(max_workers=max(1, min(LOCAL_EMBED_THREADS, len(batches)))) as pool:
+            # map gir resultatene i rekkefølge, så on_batch kalles i kallerens tråd som i embed_pipeline
+            for idx, vecs in zip(batches, pool.map(lambda b: self._encode([texts[i] for i in b]), batches)):
+                if on_batch is not None:
+                    on_batch(idx, vecs)
+                parts.append(vecs)
+        return np.vstack(parts)
+
+    def embed_queries(self, texts) -> np.ndarray:
+        return self._encode([QUERY_PREFIX + t for t in texts])
+
+
+@lru_cache(maxsize=1 << 18)
+def _bucket(feature: str, dim: int):
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if h >> 63 else -1.0
+
+
+class HashingEmbedder(_LocalEmbedder):
+    """
+    Ord (vekt 1) og bokstav-4-gram av hvert ord (samlet vekt 1, fanger
+    sammensetninger som "banebooking"), sublineær tf, hashet med fortegn.
+    Tilstandsløs: samme tekst gir samme vektor i alle prosesser.
+    """
+
+    def __init__(self, dim: int = HASH_EMBED_DIM):
+        self.dim = dim
+        self.id = f"hashing:v{HASH_VERSION}:{dim}"
+
+    def _features(self, text: str) -> Counter:
+        feats: Counter = Counter()
+        for w in _WORD.findall(text.lower()):
+            feats["w:" + w] += 1.0
+            padded = f"<{w}>"
+            grams = [padded[i:i + 4] for i in range(len(padded) - 3)]
+            for g in grams:
+                feats["g:" + g] += 1.0 / len(grams)
+        return feats
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for r, text in enumerate(texts):
+            feats = self._features(text)
+            if not feats:
+                continue
+            cols = np.empty(len(feats), dtype=np.int64)
+            vals = np.empty(len(feats), dtype="float32")
+            for j, (f, c) in enumerate(feats.items()):
+                cols[j], sign = _bucket(f, self.dim)
+                vals[j] = sign * (1.0 + math.log(c) if c > 1 else c)
+            np.add.at(out[r], cols, vals)
+        return _normalize(out)
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class OnnxEmbedder(_LocalEmbedder):
+    """
+    Setningsmodell eksportert til ONNX (f.eks. multilingual-e5-small):
+    mean pooling over siste lag med attention-masken. Sesjonen lastes ved
+    første bruk og deles av trådene (onnxruntime slipper GIL under kjøring).
+    """
+
+    def __init__(self, path: str | Path = LOCAL_EMBED_MODEL):
+        if not path:
+            raise ValueError("EMBEDDER=onnx krever LOCAL_EMBED_MODEL (katalog med model.onnx og tokenizer.json)")
+        path = Path(path)
+        self.model_path = path / "model.onnx" if path.is_dir() else path
+        self.tokenizer_path = self.model_path.with_name("tokenizer.json")
+        if not self.model_path.exists() or not self.tokenizer_path.exists():
+            raise FileNotFoundError(f"Fant ikke {self.model_path} og {self.tokenizer_path}")
+        self.id = f"onnx:{self.model_path.parent.name}:{_file_digest(self.model_path)[:12]}"
+        if QUERY_PREFIX or DOC_PREFIX:
+            self.id += ":" + hashlib.sha1(f"{QUERY_PREFIX}|{DOC_PREFIX}".encode("utf-8")).hexdigest()[:8]
+        self._lock = threading.Lock()
+        self._session = None
+        self._tokenizer = None
+
+    def _load(self):
+        with self._lock:
+            if self._session is None:
+                ort, tokenizers = optional_import("onnxruntime"), optional_import("tokenizers")
+                if ort is None or tokenizers is None:
+                    raise RuntimeError("EMBEDDER=onnx krever pakkene onnxruntime og tokenizers")
+                tok = tokenizers.Tokenizer.from_file(str(self.tokenizer_path))
+                tok.enable_truncation(max_length=LOCAL_EMBED_MAX_LEN)
+                tok.enable_padding()
+                opts = ort.SessionOptions()
+                # Parallelliteten ligger i batchene; hver kjøring får sin del av kjernene
+                opts.intra_op_num_threads = max(1, (os.cpu_count() or 1) // max(1, LOCAL_EMBED_THREADS))
+                self._session = ort.InferenceSession(str(self.model_path), opts, providers=["CPUExecutionProvider"])
+                self._inputs = {i.name for i in self._session.get_inputs()}
+                self._tokenizer = tok
+        return self._session, self._tokenizer
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        session, tok = self._load() if self._session is None else (self._session, self._tokenizer)
+        enc = tok.encode_batch(texts)  # type: ignore
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+        out = session.run(None, {k: v for k, v in feed.items() if k in self._inputs})[0]
+        if out.ndim == 3:  # (batch, tokens, dim): mean pooling over ekte tokens
+            m = mask[:, :, None].astype("float32")
+            out = (out * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        self.dim = int(out.shape[1])
+        return _normalize(out)
+
+
+@lru_cache(maxsize=4)
+def local(kind: Optional[str] = None) -> Embedder:
+    """Delt lokal embedder (én ONNX-sesjon per prosess, også over indeksbytter)."""
+    kind = _kind(kind)
+    if kind == "hashing":
+        return HashingEmbedder()
+    if kind == "onnx":
+        return OnnxEmbedder()
+    raise ValueError(f"EMBEDDER={kind!r} er ikke lokal")
+
+
+def embedder_id(kind: Optional[str] = None, model: Optional[str] = None) -> str:
+    """Id-en vektorene merkes med, uten å lage en OpenAI-klient."""
+    kind = _kind(kind)
+    return f"openai:{model or settings.get().embed_model}" if kind == "openai" else local(kind).id
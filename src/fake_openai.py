@@ -0,0 +1,211 @@
+"""
+Lokal, deterministisk stand-in for OpenAI sitt embeddings- og chat-API, til
+tester, benchmarks og lasttester uten nettverk og uten API-nøkkel.
+
+    python -m src.fake_openai --port 8900 --dim 256
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=fake ...
+
+Embeddings lages med hashing-trikset (ord og bigrammer hashes til `dim`
+bøtter med fortegn), så like tekster gir like vektorer og overlappende
+tekster gir høy kosinuslikhet. Chat-svaret er første setning i første
+utdrag i konteksten (som det ekstraktive svaret i src.answer), også strømmet
+(SSE, ett ord per bit). Feil (429/500) og latens kan injiseres.
+"""
+from __future__ import annotations
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def hash_embed(text: str, dim: int = 256) -> np.ndarray:
+    """Deterministisk, normalisert hashing-trick-embedding av `text`."""
+    toks = _TOKEN.findall(text.lower())
+    v = np.zeros(dim, dtype="float32")
+    for t in toks + [a + " " + b for a, b in zip(toks, toks[1:])]:
+        h = int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    n = np.linalg.norm(v)
+    return v / n if n > 0 else v
+
+
+class FakeOpenAI:
+    """Tilstand for en fake server: dimensjon, feilinjeksjon og tellere."""
+
+    def __init__(self, dim: int = 256, latency: float = 0.0, fail_first: int = 0, fail_status: int = 429,
+                 chat_latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.chat_latency = chat_latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = 0
+        self.failures = 0
+        self.inputs = 0
+        self.chat_requests = 0
+        self.max_inflight = 0
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def _enter(self) -> Optional[int]:
+        with self._lock:
+            self.requests += 1
+            self._inflight += 1
+            self.max_inflight = max(self.max_inflight, self._inflight)
+            if self.failures < self.fail_first:
+                self.failures += 1
+                return self.fail_status
+        return None
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+
+    def embeddings(self, body: Dict) -> Tuple[int, Dict]:
+        status = self._enter()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if status is not None:
+                return status, {"error": {"message": "injisert feil", "type": "fake", "code": str(status)}}
+            inputs = body.get("input")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+            with self._lock:
+                self.inputs += len(inputs)
+            b64 = body.get("encoding_format") == "base64"
+            data = []
+            for i, text in enumerate(inputs):
+                v = hash_embed(str(text), self.dim)
+                emb = base64.b64encode(v.tobytes()).decode("ascii") if b64 else v.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": emb})
+            ntok = sum(len(str(t).split()) for t in inputs)
+            return 200, {
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "fake"),
+                "usage": {"prompt_tokens": ntok, "total_tokens": ntok},
+            }
+        finally:
+            self._leave()
+
+    def chat(self, body: Dict) -> Tuple[int, Dict]:
+        status = self._enter()
+        try:
+            if self.chat_latency:
+                time.sleep(self.chat_latency)
+            if status is not None:
+                return status, {"error": {"message": "injisert feil", "type": "fake", "code": str(status)}}
+            with self._lock:
+                self.chat_requests += 1
+            prompt = "\n".join(str(m.get("content") or "") for m in body.get("messages") or [])
+            text = _reply(prompt)
+            ntok, nout = len(prompt.split()), len(text.split())
+            return 200, {
+                "id": f"chatcmpl-fake{self.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": ntok, "completion_tokens": nout, "total_tokens": ntok + nout},
+            }
+        finally:
+            self._leave()
+
+
+def _reply(prompt: str) -> str:
+    """Første setning i første utdrag ("Utdrag 1:") i prompten, ellers 'Jeg vet ikke'."""
+    m = re.search(r"Utdrag 1:\s*(.+?)(?:\n\n|$)", prompt, re.S)
+    txt = re.sub(r"\s+", " ", m.group(1)).strip() if m else ""
+    s = re.search(r"(.+?[.!?])(\s|$)", txt)
+    return ((s.group(1) if s else txt)[:280]) or "Jeg vet ikke"
+
+
+def _stream_chunks(completion: Dict, include_usage: bool) -> List[Dict]:
+    """Chat-svaret som strømbiter (ett ord per bit), som OpenAI sin stream=True."""
+    base = {k: completion[k] for k in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+    words = re.findall(r"\S+\s*", completion["choices"][0]["message"]["content"])
+    chunks = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": w}, "finish_reason": None}]}
+              for w in words]
+    chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    if include_usage:
+        chunks.append({**base, "choices": [], "usage": completion["usage"]})
+    return chunks
+
+
+def _handler(state: FakeOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # stille
+            pass
+
+        def _send(self, status: int, payload: Dict) -> None:
+            raw = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(n) or b"{}")
+            if self.path.rstrip("/").endswith("/embeddings"):
+                self._send(*state.embeddings(body))
+            elif self.path.rstrip("/").endswith("/chat/completions"):
+                status, payload = state.chat(body)
+                if status != 200 or not body.get("stream"):
+                    self._send(status, payload)
+                    return
+                # SSE uten Content-Length; forbindelsen lukkes etter [DONE]
+                include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for chunk in _stream_chunks(payload, include_usage):
+                    self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            else:
+                self._send(404, {"error": {"message": f"ukjent sti {self.path}"}})
+
+    return Handler
+
+
+def serve(port: int = 0, host: str = "127.0.0.1", **kwargs) -> Tuple[ThreadingHTTPServer, FakeOpenAI, str]:
+    """Start en fake server i en bakgrunnstråd. Returnerer (server, tilstand, base_url)."""
+    state = FakeOpenAI(**kwargs)
+    server = ThreadingHTTPServer((host, port), _handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Fake OpenAI embeddings-/chat-server for tester og lasttester.")
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--latency", type=float, default=0.0, help="sekunder per embeddings-kall")
+    ap.add_argument("--chat-latency", type=float, default=0.0, help="sekunder per chat-kall")
+    args = ap.parse_args()
+    server, _, url = serve(args.port, dim=args.dim, latency=args.latency, chat_latency=args.chat_latency)
+    print(f"[fake_openai] lytter på {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,49 +1,63 @@
-import json
+from __future__ import annotations
 from pathlib import Path
 
 import faiss
-import numpy as np
+import scipy.sparse as sp
 
 # Artefaktstier
 INDEX_PATH = Path("data/index.faiss")
 VEC_PATH = Path("data/vectors.npy")
 META_PATH = Path("data/meta.jsonl")
+TFIDF_PATH = Path("data/tfidf.npz")  # sparse TF-IDF (CSR), kun i TF-IDF-modus
 
-# Bygger hele indeksen (vectors.npy, meta.jsonl, index.faiss) hvis mangler
-# hentes fra src.ingest.build_index
-from src.ingest import build_index
+from src import ann, metastore
+from src.utils import open_vectors
+
+# Bygger indeksen (vectors.npy, meta.jsonl og eventuelt index.faiss) hvis den
+# mangler; hentes fra src.ingest.build_index
+from src.ingest import build_index, svd_project
 
 
 def _ensure_artifacts():
     """
-    Sørger for at vectors/meta/index finnes. Hvis ikke, bygges de fra kb/.
+    Sørger for at vectors/meta finnes. Hvis ikke, bygges de fra kb/. index.faiss
+    kreves ikke: flat-bygg skriver den ikke (eksakt søk går over vectors.npy).
     """
-    missing = [p for p in [VEC_PATH, META_PATH, INDEX_PATH] if not p.exists()]
+    missing = [p for p in [VEC_PATH, META_PATH] if not p.exists()]
     if missing:
         print(f"[index] Mangler artefakter: {', '.join(str(p) for p in missing)} – bygger…")
         INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
-        build_index()  # skriver alle tre filene
+        build_index()
 
 
-def load_vectors() -> np.ndarray:
+def load_vectors(sparse: bool = False):
+    """
+    Dense, normaliserte vektorer fra vectors.npy (minnemappet, skrivebeskyttet). Med `sparse=True` returneres
+    TF-IDF-matrisen (CSR) fra tfidf.npz i stedet, uten å fortette den.
+    """
     _ensure_artifacts()
-    X = np.load(VEC_PATH).astype("float32")
-    faiss.normalize_L2(X)
-    return X
+    if sparse:
+        return sp.load_npz(TFIDF_PATH).tocsr()
+    return open_vectors(VEC_PATH)
 
 
-def build_faiss_index() -> faiss.Index:
-    X = load_vectors()
-    index = faiss.IndexFlatIP(X.shape[1])
-    index.add(X)
-    faiss.write_index(index, str(INDEX_PATH))
+def build_faiss_index(X=None, kind: str | None = None) -> faiss.Index:
+    """
+    FAISS-indeks over dense vektorer; sparse input projiseres med TruncatedSVD først.
+    `kind` (flat/hnsw/ivfpq) overstyrer FAISS_INDEX.
+    """
+    X = load_vectors() if X is None else X
+    if sp.issparse(X):
+        X, _ = svd_project(X)
+    index, params = ann.build(X, kind)
+    ann.write(index, params, INDEX_PATH)
     return index
 
 
 def load_meta():
+    """Metadata som minnemappet MetaTable (meta.arrow), eller liste av dicts for eldre artefakter."""
     _ensure_artifacts()
-    with META_PATH.open(encoding="utf-8") as f:
-        return [json.loads(l) for l in f]
+    return metastore.load_meta(META_PATH)
 
 
 if __name__ == "__main__":
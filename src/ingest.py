@@ -1,232 +1,335 @@
 from __future__ import annotations
-import json, os, re
+import hashlib, json, os, shutil, sys
 from pathlib import Path
-from typing import Dict, List, Tuple
-from openai import AuthenticationError
+from typing import Dict, List, Optional, Tuple
 
 
 import numpy as np
 
-from src.utils import env_flag
+from src import (artifacts, bm25, chunking, embed_cache, embed_pipeline, embedders, metastore, partitions, quant,
+                 rerank, settings)
+from src.utils import optional_import
 
-try:
-    import streamlit as st  # type: ignore
-except Exception:
-    st = None
+_UNSET = object()
+ann = _UNSET  # src.ann (krever faiss), lastes ved første bruk; None = ikke tilgjengelig
 
-try:
-    import faiss  # type: ignore
-except Exception:
-    faiss = None
+def _ann():
+    global ann
+    if ann is _UNSET:
+        ann = optional_import("src.ann")
+    return ann
 
-from dotenv import load_dotenv
-from openai import OpenAI
-
-load_dotenv()
-
-def _get_secret(name: str) -> str | None:
-    """
-    Hent verdi fra miljøvariabel eller Streamlit Secrets – trygt i CI.
-    - Foretrekker ENV først (CI/GHA setter ofte env direkte).
-    - Aksess til st.secrets kapsles i try/except siden bare *berøring* kan kaste
-      StreamlitSecretNotFoundError hvis secrets.toml ikke finnes.
-    """
-    # 1) ENV først
-    val = os.getenv(name)
-    if isinstance(val, str) and val.strip():
-        return val.strip()
-    # 2) Streamlit Secrets (best effort)
-    try:
-        import streamlit as _st  # lokal import for å unngå sideeffekter
+def _report(msg: str) -> None:
+    """Vis feilen i appen hvis vi kjører under Streamlit (importeres aldri herfra)."""
+    st = sys.modules.get("streamlit")
+    if st is not None:
         try:
-            sval = _st.secrets[name]  # kan kaste KeyError/StreamlitSecretNotFoundError
-            return sval.strip() if isinstance(sval, str) else sval
+            st.error(msg)
         except Exception:
-            return None
-    except Exception:
-        return None
+            pass
+
+# ---------- Konfig (src.settings: env/.env først, så Streamlit Secrets) ----------
+_S = settings.get()
+USE_OPENAI = _S.ingest_use_openai  # standard true (Cloud bygger vektorindeks); USE_OPENAI=0 gir TF-IDF
+EMBED_MODEL = _S.embed_model
+EMBEDDER = _S.embedder  # src.embedders; id-en havner i manifestet og generasjonen
+DATA_DIR = _S.data_dir
+KB_DIR_DEFAULT = _S.kb_dir
+OPENAI_API_KEY = _S.openai_api_key
+
+# ---------- OpenAI-klient, lages først når noe skal embeddes ----------
+client = None
+
+def _client():
+    global client
+    if client is None:
+        client = settings.openai_client() if OPENAI_API_KEY else None
+        if client is None:
+            msg = ("Mangler/ugyldig `OPENAI_API_KEY`. "
+                   "Legg inn nøkkelen i Streamlit Secrets eller `.env`.")
+            _report(msg)
+            raise RuntimeError(msg)
+    return client
+
+# ---------- Manifest for inkrementell re-indeksering ----------
+# manifest.json holder generasjonen til bitlageret vektorene er bygd fra og
+# hash av teksten i hver rad. Ved rebuild gjenbrukes radene til biter med
+# uendret tekst, og bare nye/endrede biter embeddes på nytt.
+#
+# Hvert bygg skriver til en ny generasjonskatalog (src.artifacts) og
+# publiseres med ett atomisk pekerbytte; manifestet og forrige vektorer
+# leses fra gjeldende generasjon.
+MANIFEST_VERSION = 2
 
-# ---------- Konfig ----------
-# Tving OpenAI som default i Cloud; kan overstyres via USE_OPENAI=0
-USE_OPENAI = env_flag("USE_OPENAI", True)
-EMBED_MODEL = _get_secret("EMBED_MODEL") or "text-embedding-3-small"
-DATA_DIR = Path(_get_secret("DATA_DIR") or "data")
-KB_DIR_DEFAULT = _get_secret("KB_DIR") or "kb"
-
-# ---------- OpenAI-klient på modulnivå ----------
-OPENAI_API_KEY = _get_secret("OPENAI_API_KEY")
-OPENAI_PROJECT = _get_secret("OPENAI_PROJECT")  # valgfri (for sk-proj-… nøkler)
-if not OPENAI_API_KEY:
-    msg = ("Mangler/ugyldig `OPENAI_API_KEY`. "
-           "Legg inn nøkkelen i Streamlit Secrets eller `.env`.")
-    if st:
-        st.error(msg)
-    raise RuntimeError(msg)
-client = OpenAI(api_key=OPENAI_API_KEY, project=OPENAI_PROJECT or None)
-
-# ---------- Korpushjelpere (gjenbruker logikken fra retrieve) ----------
-def _read_text_file(p: Path) -> str:
+def _text_hash(txt: str) -> str:
+    return hashlib.sha1(txt.encode("utf-8")).hexdigest()
+
+def _backend_id() -> str:
+    return embedders.embedder_id(EMBEDDER, EMBED_MODEL) if USE_OPENAI else "tfidf"
+
+def _load_manifest() -> Dict:
     try:
-        return p.read_text(encoding="utf-8", errors="ignore")
+        m = json.loads((artifacts.current_dir(DATA_DIR) / "manifest.json").read_text(encoding="utf-8"))
     except Exception:
-        return ""
-
-def _strip(txt: str) -> str:
-    # fjern codefences og komprimer whitespace
-    txt = re.sub(r"```.*?```", " ", txt, flags=re.S)
-    txt = re.sub(r"\s+", " ", txt)
-    return txt.strip()
-
-def _iter_docs(kb_root: Path) -> List[Dict]:
-    out: List[Dict] = []
-
-    for p in sorted(list(kb_root.rglob("*.md")) + list(Path("data/processed").rglob("*.jsonl"))):
-        if not p.is_file():
-            continue
-
-        if p.suffix.lower() == ".md":
-            raw = _read_text_file(p)
-            clean = _strip(raw)
-            if not clean:
-                continue
-
-            chunks = [clean[i:i + 700] for i in range(0, len(clean), 700 - 120)]
-            for ci, ch in enumerate(chunks):
-                out.append({
-                    "text": ch,
-                    "source": str(p).replace("\\", "/"),
-                    "title": p.stem.replace("-", " "),
-                    "doc_type": None,
-                    "version_date": None,
-                    "page": None,
-                    "chunk_idx": ci,
-                    "id": f"{p.as_posix()}#{ci}",
-                })
-
-        else:
-            ci = 0
-            for line in _read_text_file(p).splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-
-                txt = _strip(obj.get("text", ""))
-                if not txt:
-                    continue
-
-                src = obj.get("metadata", {}).get("source") or str(p)
-                out.append({
-                    "text": txt,
-                    "source": str(src).replace("\\", "/"),
-                    "title": obj.get("metadata", {}).get("title"),
-                    "doc_type": obj.get("metadata", {}).get("doc_type"),
-                    "version_date": obj.get("metadata", {}).get("version_date"),
-                    "page": obj.get("metadata", {}).get("page"),
-                    "chunk_idx": ci,
-                    "id": f"{Path(src).as_posix()}#{ci}",
-                })
-                ci += 1
-
-    return out
+        return {}
+    if m.get("version") != MANIFEST_VERSION or m.get("backend") != _backend_id():
+        return {}
+    return m
+
+def _save_manifest(out: Path, n: int, **extra) -> None:
+    m = {"version": MANIFEST_VERSION, "backend": _backend_id(), "n": n, **extra}
+    (out / "manifest.json").write_text(json.dumps(m, ensure_ascii=False), encoding="utf-8")
+
+def _load_previous(manifest: Dict) -> np.ndarray | None:
+    """Forrige vektorer (minnemappet), men bare hvis de stemmer med manifestet."""
+    vec_path = artifacts.current_dir(DATA_DIR) / "vectors.npy"
+    if not manifest or not vec_path.exists():
+        return None
+    vecs = np.load(vec_path, mmap_mode="r")
+    if vecs.shape[0] != manifest.get("n") or len(manifest.get("chunks", [])) != vecs.shape[0]:
+        return None
+    return vecs
 
 # ---------- OpenAI-embeddings eller TF-IDF til disk ----------
-def _save_meta(meta: List[Dict]) -> None:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with (DATA_DIR / "meta.jsonl").open("w", encoding="utf-8") as f:
-        for m in meta:
-            f.write(json.dumps(m, ensure_ascii=False) + "\n")
-
-def _build_openai_embeddings(chunks: List[Dict], batch_size: int = 64) -> np.ndarray:
-    """Bygg normaliserte embeddings med batching og bedre feilhåndtering."""
-    if not OPENAI_API_KEY:
-        msg = (
-            "OPENAI_API_KEY mangler eller er ugyldig. "
-            "Sett den i .env-filen eller i Streamlit Secrets."
-        )
-        if st:
-            st.error(msg)
-        raise RuntimeError(msg)
+def _copy_meta(store: chunking.ChunkStore, out: Path) -> None:
+    """meta.jsonl/meta.arrow er en kopi av bitlageret vektorene ble bygd fra."""
+    for src, name in ((store.jsonl, "meta.jsonl"), (store.arrow, "meta.arrow")):
+        shutil.copyfile(src, out / name)  # arrow sist -> minst like ny som jsonl
 
+def _build_openai_embeddings(chunks: List[Dict], batch_size: int = embed_pipeline.EMBED_BATCH_ITEMS) -> np.ndarray:
+    """
+    Bygg normaliserte embeddings: cache-treff først, resten via den samtidige
+    pipelinen (begrenset samtidighet, token-pakkede batcher, backoff på 429/5xx).
+    Hver ferdige batch skrives til embedding-cachen med en gang, så et avbrutt
+    bygg gjenopptas der det stoppet ved neste kjøring. Med en lokal EMBEDDER
+    regnes alt ut her (trådpool på CPU), uten cache og uten nettverk.
+    """
     texts = [d["text"] for d in chunks]
-    vecs: List[np.ndarray] = []
+    if EMBEDDER != "openai":
+        return embedders.local(EMBEDDER).embed(texts)
+    # Treff i embedding-cachen går aldri mot API-et
+    found, todo = embed_cache.split_cached(EMBED_MODEL, texts)
+    batch_texts = [texts[j] for j in todo]
+
+    def _checkpoint(pos: List[int], vecs: np.ndarray) -> None:
+        embed_cache.store(EMBED_MODEL, [batch_texts[p] for p in pos], vecs)
+        for p, v in zip(pos, vecs):
+            found[todo[p]] = v
+
+    embed_client = _client() if batch_texts else None  # alt i cachen: ingen nøkkel nødvendig
+    try:
+        embedders.OpenAIEmbedder(EMBED_MODEL, embed_client, batch_size).embed(batch_texts, on_batch=_checkpoint)
+    except Exception as e:
+        from openai import AuthenticationError  # allerede lastet sammen med klienten
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        try:
-            r = client.embeddings.create(
-                model=EMBED_MODEL,
-                input=batch
-            )
-        except AuthenticationError:
+        if isinstance(e, AuthenticationError):
             msg = "Feil ved autentisering mot OpenAI – sjekk API-nøkkelen."
-            if st:
-                st.error(msg)
-            raise RuntimeError(msg)
-        except Exception as e:
+        else:
             msg = f"Uventet feil ved henting av embeddings: {e}"
-            if st:
-                st.error(msg)
-            raise RuntimeError(msg)
-
-        for item in r.data:
-            v = np.asarray(item.embedding, dtype="float32")
-            v = v / (np.linalg.norm(v) + 1e-12)
-            vecs.append(v)
+        _report(msg)
+        raise RuntimeError(msg)
 
-    if not vecs:
+    if not found:
         return np.zeros((0, 1536), dtype="float32")
 
-    return np.vstack(vecs)
+    return np.vstack([found[i] for i in range(len(texts))])
 
 
-def _build_tfidf_dense(chunks: List[Dict]) -> Tuple[np.ndarray, object]:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    import pickle
+# ---------- TF-IDF: sparse artefakt + SVD-projeksjon for FAISS ----------
+# Den eksakte TF-IDF-indeksen er CSR-matrisen i tfidf.npz (se src.retrieve).
+# vectors.npy/index.faiss i TF-IDF-modus er en TruncatedSVD-projeksjon ned til
+# TFIDF_SVD_DIM dimensjoner i stedet for en fortettet 60k-bredde matrise.
+TFIDF_SVD_DIM = int(os.getenv("TFIDF_SVD_DIM", "256"))
+
+def svd_project(mtx, dim: int = TFIDF_SVD_DIM) -> Tuple[np.ndarray, object]:
+    """Projiser en sparse TF-IDF-matrise til normaliserte dense float32-vektorer."""
+    from sklearn.decomposition import TruncatedSVD
+
+    n_comp = min(dim, mtx.shape[0] - 1, mtx.shape[1] - 1)
+    if n_comp < 1:
+        dense = mtx.toarray().astype("float32")
+        svd = None
+    else:
+        svd = TruncatedSVD(n_components=n_comp, random_state=0)
+        dense = svd.fit_transform(mtx).astype("float32")
+    dense /= np.linalg.norm(dense, axis=1, keepdims=True) + 1e-12
+    return np.ascontiguousarray(dense), svd
 
-    texts = [d["text"] for d in chunks] or [""]
-    vec = TfidfVectorizer(
-        ngram_range=(1, 2),
-        max_df=0.95,
-        strip_accents="unicode",
-        lowercase=True,
-        norm="l2",
-        sublinear_tf=True,
-        max_features=60000,
-    )
-
-    mtx = vec.fit_transform(texts)
-    dense = mtx.toarray()
-    norms = np.linalg.norm(dense, axis=1, keepdims=True)
-    dense = (dense / (norms + 1e-12)).astype("float32")
-
-    with (DATA_DIR / "vectorizer.pkl").open("wb") as f:
-        pickle.dump(vec, f)
-    return dense, vec
-
-def _maybe_write_faiss(vectors: np.ndarray) -> None:
-    if faiss is None or vectors.size == 0:
+def _build_tfidf_index(kb_root: Path, full: bool = False) -> None:
+    import pickle
+    from src import retrieve
+
+    # Egen retriever til byggingen, så en aktiv (serverende) retriever ikke berøres
+    builder = retrieve.Retriever(data_dir=DATA_DIR, kb_dirs=chunking.roots(kb_root), use_openai=False)
+    fingerprint = builder.tfidf_fingerprint()  # uten å skrive noe; bitlageret bygges inn i `out`
+    manifest = {} if full else _load_manifest()
+    if manifest.get("fingerprint") == fingerprint and (artifacts.current_dir(DATA_DIR) / "vectors.npy").exists():
+        print(f"[ingest] Ingen endringer i korpuset – TF-IDF-indeksen i {DATA_DIR} er oppdatert.")
         return
-    idx = faiss.IndexFlatIP(vectors.shape[1])
-    idx.add(vectors)
-    faiss.write_index(idx, str(DATA_DIR / "index.faiss"))
 
-def build_index(kb_dir: str | Path = KB_DIR_DEFAULT) -> None:
+    out = artifacts.stage(DATA_DIR)
+    try:
+        store = builder.build_tfidf(fingerprint, rebuild=full, out=out)
+        if store is None:
+            raise OSError(f"Kunne ikke skrive TF-IDF-indeksen til {out}")
+        n = len(builder.meta_tfidf)
+        vectors, svd = svd_project(builder.mtx)
+        with (out / "svd.pkl").open("wb") as f:
+            pickle.dump(svd, f)
+        np.save(out / "vectors.npy", vectors)
+        _copy_meta(store, out)
+        _maybe_write_faiss(vectors, out)
+        _save_manifest(out, n, fingerprint=fingerprint)
+        gen = artifacts.publish(DATA_DIR, out, inherit=False, backend=_backend_id(), n=n)
+    except BaseException:
+        artifacts.discard(out)
+        raise
+    finally:
+        builder.close()
+    print(f"[ingest] TF-IDF-indeks for {n} biter skrevet til {DATA_DIR}/generations/{gen} "
+          f"(SVD-projeksjon {vectors.shape[1]}d i vectors.npy).")
+
+def _faiss_kind() -> Optional[str]:
+    """FAISS-indekstypen et bygg skriver nå; None = ingen index.faiss."""
+    if _ann() is None or ann.INDEX_KIND == "flat":
+        # Eksakt søk går over den minnemappede vectors.npy (eller den kvantiserte
+        # kopien); en flat FAISS-indeks ville vært en full float32-kopi i RAM per prosess
+        return None
+    return ann.INDEX_KIND
+
+def _artifact_set() -> Dict:
+    """Hvilke vektorartefakter bygget skriver; står i manifestet, så en endring gir nytt bygg."""
+    return {"quant": quant.VECTOR_QUANT, "faiss": _faiss_kind()}
+
+def _maybe_write_faiss(vectors: np.ndarray, out: Path) -> None:
+    """Skriv index.faiss (+ index.json med parametre) med typen fra FAISS_INDEX."""
+    if _faiss_kind() is None or vectors.size == 0:
+        return
+    idx, params = ann.build(vectors)
+    if params["kind"] == "flat":
+        return  # IVF-PQ faller tilbake til flat på små korpus
+    ann.write(idx, params, out / "index.faiss")
+
+# ---------- Strømmende skriving av rader ----------
+# Radene i bitlageret strømmes til embedding i batcher, og vektorrader skrives
+# på sin plass i en rå fil etter hvert som de blir klare (gjenbrukte rader
+# straks, nye når batchen deres er embeddet). Til slutt blir den rå filen
+# vectors.npy. Minnet holder dermed bare én batch med biter.
+EMBED_STREAM_ROWS = int(os.getenv("EMBED_STREAM_ROWS", "1024"))
+
+class _RowWriter:
+    def __init__(self, old_vecs: np.ndarray | None, out: Path, batch_rows: int | None = None):
+        self.old_vecs = old_vecs
+        self.dim = int(old_vecs.shape[1]) if old_vecs is not None else 0
+        self.batch_rows = max(1, batch_rows or EMBED_STREAM_ROWS)
+        self.n = self.embedded = self.reused = 0
+        self._pending: List[Tuple[int, Dict]] = []
+        self.out = out
+        self._raw_tmp = out / "vectors.raw.tmp"
+        self._raw = self._raw_tmp.open("w+b")
+
+    def add(self, chunk: Dict, src_row: int) -> None:
+        """Legg til neste rad; src_row >= 0 gjenbruker raden fra forrige artefakt."""
+        if src_row >= 0:
+            self._put(self.n, self.old_vecs[src_row])
+            self.reused += 1
+        else:
+            self._pending.append((self.n, chunk))
+            if len(self._pending) >= self.batch_rows:
+                self.flush()
+        self.n += 1
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        vecs = _build_openai_embeddings([c for _, c in self._pending])
+        self.dim = self.dim or int(vecs.shape[1])
+        for (row, _), v in zip(self._pending, vecs):
+            self._put(row, v)
+        self.embedded += len(self._pending)
+        self._pending = []
+
+    def _put(self, row: int, v: np.ndarray) -> None:
+        self._raw.seek(row * self.dim * 4)
+        self._raw.write(np.asarray(v, dtype="float32").tobytes())
+
+    def finish(self) -> np.ndarray:
+        """Skriv vectors.npy; returnerer vektorene minnemappet."""
+        self.flush()
+        self._raw.close()
+        dim = self.dim or 1536
+        tmp = self.out / "vectors.npy.tmp"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(self.n, dim))
+        if self.n:
+            raw = np.memmap(self._raw_tmp, dtype="float32", mode="r", shape=(self.n, dim))
+            for a in range(0, self.n, 65536):
+                out[a:a + 65536] = raw[a:a + 65536]
+            del raw
+        out.flush()
+        del out
+        os.replace(tmp, self.out / "vectors.npy")
+        self._raw_tmp.unlink(missing_ok=True)
+        return np.load(self.out / "vectors.npy", mmap_mode="r")
+
+    def abort(self) -> None:
+        self._raw.close()
+        self._raw_tmp.unlink(missing_ok=True)
+
+def build_index(kb_dir: str | Path = KB_DIR_DEFAULT, full: bool = False) -> None:
+    """
+    Bygg eller oppdater indeksen inkrementelt fra bitlageret (src.chunking).
+    Bare nye/endrede filer chunkes på nytt, og bare biter med ny tekst
+    embeddes; resten gjenbruker radene sine. `full=True` tvinger full rebuild.
+    """
     kb_root = Path(kb_dir)
-    chunks = _iter_docs(kb_root)
-
-    if USE_OPENAI:
-        vectors = _build_openai_embeddings(chunks)
-        np.save(DATA_DIR / "vectors.npy", vectors)
-        _save_meta(chunks)
-        _maybe_write_faiss(vectors)
-        print(f"[ingest] OpenAI-embeddings for {len(chunks)} biter skrevet til {DATA_DIR}/vectors.npy og {DATA_DIR}/meta.jsonl.")
-    else:
-        vectors, _ = _build_tfidf_dense(chunks)
-        np.save(DATA_DIR / "vectors.npy", vectors)
-        _save_meta(chunks)
-        _maybe_write_faiss(vectors)
-        print(f"[ingest] TF-IDF vektorer for {len(chunks)} biter skrevet til {DATA_DIR}/vectors.npy og {DATA_DIR}/meta.jsonl.")
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    if not USE_OPENAI:
+        # TF-IDF-vokabularet er globalt, så der refittes alt ved endringer
+        _build_tfidf_index(kb_root, full)
+        return
+
+    roots = chunking.roots(kb_root)
+    manifest = {} if full else _load_manifest()
+    if (manifest and manifest.get("store") == chunking.store_generation(roots, DATA_DIR)
+            and manifest.get("artifacts") == _artifact_set()):
+        print(f"[ingest] Ingen endringer i {kb_root} – indeksen i {DATA_DIR} er oppdatert.")
+        return
+
+    old_vecs = _load_previous(manifest)
+    old_rows: Dict[str, int] = {}  # bit-hash -> rad i forrige artefakt
+    if old_vecs is not None:
+        for i, h in enumerate(manifest["chunks"]):
+            old_rows.setdefault(h, i)
+
+    hashes: List[str] = []
+    out = artifacts.stage(DATA_DIR)
+    writer = _RowWriter(old_vecs, out)
+    try:
+        try:
+            # bitlageret skrives inn i generasjonen og publiseres sammen med vektorene
+            store = chunking.ensure_store(roots, DATA_DIR, out, rebuild=full)
+            for row in store.iter_rows():
+                h = _text_hash(row["text"])
+                hashes.append(h)
+                writer.add(row, old_rows.get(h, -1))
+            vectors = writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+
+        _copy_meta(store, out)
+        meta = metastore.load_meta(out / "meta.jsonl")
+        bm25.build_for(meta, out / "bm25.npz")  # leksikalsk side av hybrid-søk
+        rerank.build_for(meta, bm25.meta_digest(meta), out / "keywords.npz")  # nøkkelord/doc_type for reranken
+        partitions.build_for(meta, bm25.meta_digest(meta), out / "partitions.npz")  # radbitmaps for filtre
+        quant.write(vectors, out)  # vectors.f16.npy / vectors.int8.npy når VECTOR_QUANT er satt
+        _maybe_write_faiss(vectors, out)
+        _save_manifest(out, writer.n, store=store.generation, chunks=hashes, artifacts=_artifact_set())
+        del vectors, meta
+        gen = artifacts.publish(DATA_DIR, out, inherit=artifacts.TFIDF_FILES, backend=_backend_id(), n=writer.n,
+                                quant=quant.VECTOR_QUANT)
+    except BaseException:
+        artifacts.discard(out)
+        raise
+    print(f"[ingest] Embeddings ({_backend_id()}) for {writer.n} biter publisert som {DATA_DIR}/generations/{gen} "
+          f"({writer.embedded} nye/endrede embeddet, {writer.reused} gjenbrukt).")
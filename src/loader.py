@@ -0,0 +1,117 @@
+from __future__ import annotations
+import json
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# --- Konfig ---
+SUFFIXES = (".md", ".jsonl", ".pdf")
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# Én kilde-"side": (sidenummer eller None, tekst, metadata fra jsonl eller {})
+Page = Tuple[Optional[int], str, Dict]
+
+
+def iter_files(roots: Iterable[Path], suffixes: Sequence[str] = SUFFIXES) -> List[Path]:
+    """Alle korpusfiler under `roots`, sortert og uten duplikater."""
+    seen = set()
+    for root in roots:
+        root = Path(root)
+        if not root.exists():
+            continue
+        for p in root.rglob("*"):
+            if p.is_file() and p.suffix.lower() in suffixes:
+                seen.add(p)
+    return sorted(seen)
+
+
+def read_text(p: Path) -> str:
+    try:
+        return p.read_text(encoding="utf-8", errors="ignore")
+    except Exception:
+        return ""
+
+
+def read_pdf_pages(path: str) -> List[Tuple[int, str]]:
+    """(sidenummer fra 1, tekst) for hver side med tekst. Kjøres i en prosesspool."""
+    from pypdf import PdfReader
+
+    out: List[Tuple[int, str]] = []
+    try:
+        reader = PdfReader(path)
+        for i, page in enumerate(reader.pages, start=1):
+            try:
+                txt = page.extract_text() or ""
+            except Exception:
+                txt = ""
+            if txt.strip():
+                out.append((i, txt))
+    except Exception as e:
+        print(f"[loader] Kunne ikke lese {path}: {e}")
+    return out
+
+
+def iter_jsonl(p: Path) -> Iterator[Dict]:
+    """Strømmer gyldige JSON-objekter linje for linje."""
+    try:
+        f = p.open(encoding="utf-8", errors="ignore")
+    except Exception:
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(obj, dict):
+                yield obj
+
+
+def _pages(p: Path, pdf: Optional[Future]) -> Iterator[Page]:
+    suffix = p.suffix.lower()
+    if suffix == ".pdf":
+        pages = pdf.result() if pdf is not None else read_pdf_pages(str(p))
+        for no, txt in pages:
+            yield no, txt, {}
+    elif suffix == ".jsonl":
+        for obj in iter_jsonl(p):
+            meta = obj.get("metadata") or {}
+            yield meta.get("page"), obj.get("text", "") or "", meta
+    else:
+        yield None, read_text(p), {}
+
+
+def iter_pages(paths: Sequence[Path], workers: int = LOADER_WORKERS,
+               executor: Optional[Executor] = None) -> Iterator[Tuple[Path, Iterator[Page]]]:
+    """
+    Strømmer (fil, sider) i samme rekkefølge som `paths`. PDF-er trekkes ut i
+    en prosesspool med et begrenset vindu foran lesingen; markdown leses
+    direkte og JSONL strømmes linje for linje, så minnebruken holder seg flat.
+    """
+    pdfs = [i for i, p in enumerate(paths) if p.suffix.lower() == ".pdf"]
+    own = None
+    if pdfs and executor is None and workers > 1:
+        own = executor = ProcessPoolExecutor(max_workers=min(workers, len(pdfs)))
+    try:
+        window = 2 * max(1, workers)
+        futures: Dict[int, Future] = {}
+        queue = iter(pdfs)
+
+        def _fill() -> None:
+            while len(futures) < window:
+                j = next(queue, None)
+                if j is None:
+                    return
+                futures[j] = executor.submit(read_pdf_pages, str(paths[j]))  # type: ignore[union-attr]
+
+        for i, p in enumerate(paths):
+            if executor is not None:
+                _fill()
+            yield p, _pages(p, futures.pop(i, None))
+    finally:
+        if own is not None:
+            own.shutdown(cancel_futures=True)
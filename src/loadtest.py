@@ -0,0 +1,159 @@
+"""
+Lasttest av søke-/svartjenesten (src.service): N samtidige brukere mot en
+lokal fake OpenAI-server (embeddings + chat), så tallene er uten nett og
+uten API-nøkkel.
+
+    python -m src.loadtest --users 32 --duration 10 --workers 2
+    python -m src.loadtest --users 32 --window-ms 0      # uten mikrobatching
+
+Bygger indeksen fra kb/ i en egen katalog (embedding-stien mot fake-serveren),
+starter `python -m src.service` som underprosess og lar hver bruker stille
+spørsmål fra gullsettet (bench/) i løkke. Rapporten viser latens (p50/p95/p99),
+QPS, feil og hvor mange embeddings-kall som gikk per spørsmål – med
+mikrobatching bør det være godt under 1.
+"""
+from __future__ import annotations
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from src import fake_openai
+from src.bench import GOLDEN_PATH, load_golden
+from src.service import Client
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(client: Client, proc: subprocess.Popen, timeout: float = 120.0) -> Dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Tjenesten avsluttet med kode {proc.returncode}")
+        try:
+            return client.health()
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.1)
+    raise TimeoutError("Tjenesten ble ikke klar")
+
+
+def _user(client: Client, queries: List[str], offset: int, k: int, stop: float,
+          lat: List[float], errors: List[str], lock: threading.Lock) -> None:
+    i = offset
+    while time.time() < stop:
+        q = queries[i % len(queries)]
+        i += 1
+        t = time.perf_counter()
+        try:
+            client.answer(q, k)
+        except Exception as e:
+            with lock:
+                errors.append(type(e).__name__)
+            continue
+        with lock:
+            lat.append(time.perf_counter() - t)
+
+
+def run(users: int = 16, duration: float = 10.0, workers: int = 1, window_ms: float = 5.0,
+        k: int = 6, kb_dir: Path = Path("kb"), golden: Path = GOLDEN_PATH,
+        embed_latency: float = 0.02, chat_latency: float = 0.05, retrieval: str = "dense") -> Dict:
+    queries = [g["query"] for g in load_golden(golden)]
+    server, state, base_url = fake_openai.serve(latency=embed_latency, chat_latency=chat_latency)
+    try:
+        with tempfile.TemporaryDirectory(prefix="rag-load-") as data_dir:
+            env = {**os.environ, "DATA_DIR": data_dir, "KB_DIR": str(kb_dir), "USE_OPENAI": "true",
+                   "OPENAI_API_KEY": "fake", "OPENAI_BASE_URL": base_url, "RETRIEVAL_MODE": retrieval,
+                   # hvert spørsmål skal faktisk søkes og besvares
+                   "EMBED_CACHE": "false", "ANSWER_CACHE": "false"}
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "from src.ingest import build_index; "
+                            f"build_index({str(kb_dir)!r}, full=True)"], env=env, check=True,
+                           stdout=subprocess.DEVNULL)
+            build_s = time.perf_counter() - t0
+
+            port = _free_port()
+            proc = subprocess.Popen([sys.executable, "-m", "src.service", "--port", str(port),
+                                     "--workers", str(workers), "--window-ms", str(window_ms)], env=env)
+            try:
+                client = Client(f"http://127.0.0.1:{port}")
+                _wait_healthy(client, proc)
+                for q in queries[:3]:  # oppvarming (BM25, nøkkelordmatrise)
+                    client.answer(q, k)
+
+                embed_before, inputs_before, chat_before = state.requests - state.chat_requests, state.inputs, state.chat_requests
+                lat: List[float] = []
+                errors: List[str] = []
+                lock = threading.Lock()
+                t_start = time.perf_counter()
+                stop = time.time() + duration
+                threads = [threading.Thread(target=_user, args=(client, queries, i, k, stop, lat, errors, lock))
+                           for i in range(users)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                wall = time.perf_counter() - t_start
+                embed_calls = state.requests - state.chat_requests - embed_before
+                embed_inputs = state.inputs - inputs_before
+                chat_calls = state.chat_requests - chat_before
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        server.shutdown()
+
+    ms = np.asarray(lat or [0.0]) * 1000
+    return {
+        "meta": {"users": users, "duration_s": duration, "workers": workers, "window_ms": window_ms, "k": k,
+                 "retrieval": retrieval, "embed_latency_s": embed_latency, "chat_latency_s": chat_latency,
+                 "queries": len(queries), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "build_s": round(build_s, 3),
+        "requests": len(lat),
+        "errors": len(errors),
+        "qps": round(len(lat) / wall, 2) if wall > 0 else None,
+        "latency_ms": {"p50": round(float(np.percentile(ms, 50)), 2), "p95": round(float(np.percentile(ms, 95)), 2),
+                       "p99": round(float(np.percentile(ms, 99)), 2), "mean": round(float(ms.mean()), 2)},
+        "embed_calls": embed_calls,
+        "embed_calls_per_query": round(embed_calls / len(lat), 3) if lat else None,
+        "mean_embed_batch": round(embed_inputs / embed_calls, 2) if embed_calls else None,
+        "chat_calls": chat_calls,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Lasttest av src.service med N samtidige brukere mot fake OpenAI.")
+    ap.add_argument("--users", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=10.0, help="sekunder")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--window-ms", type=float, default=5.0, help="0 slår av mikrobatching")
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--kb", type=Path, default=Path("kb"))
+    ap.add_argument("--golden", type=Path, default=GOLDEN_PATH)
+    ap.add_argument("--retrieval", choices=("dense", "hybrid"), default="dense")
+    ap.add_argument("--embed-latency", type=float, default=0.02, help="sekunder per embeddings-kall (fake)")
+    ap.add_argument("--chat-latency", type=float, default=0.05, help="sekunder per chat-kall (fake)")
+    ap.add_argument("--out", type=Path, default=None)
+    args = ap.parse_args()
+
+    report = run(args.users, args.duration, args.workers, args.window_ms, args.k, args.kb, args.golden,
+                 args.embed_latency, args.chat_latency, args.retrieval)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(text, encoding="utf-8")
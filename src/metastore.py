@@ -0,0 +1,245 @@
+from __future__ import annotations
+import bisect
+import json
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.utils import lazy_import, unique_tmp
+
+# pyarrow importeres ved første bruk (se utils.LazyModule)
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+
+# Metadata per bit som kolonnebasert Arrow IPC-fil (meta.arrow ved siden av
+# meta.jsonl). Filen minnemappes, source/title/doc_type er dictionary-kodet,
+# og treff er små radvisninger som bare henter feltene som faktisk leses.
+FIELDS = ("text", "source", "title", "doc_type", "version_date", "page", "chunk_idx", "id")
+
+_SCHEMA = None
+
+
+def schema() -> pa.Schema:
+    global _SCHEMA
+    if _SCHEMA is None:
+        _SCHEMA = pa.schema([
+            ("text", pa.large_string()),
+            ("source", pa.dictionary(pa.int32(), pa.string())),
+            ("title", pa.dictionary(pa.int32(), pa.string())),
+            ("doc_type", pa.dictionary(pa.int8(), pa.string())),
+            ("version_date", pa.string()),
+            ("page", pa.int32()),
+            ("chunk_idx", pa.int32()),
+            ("id", pa.string()),
+        ])
+    return _SCHEMA
+
+
+def arrow_path(jsonl_path: Path) -> Path:
+    return Path(jsonl_path).with_suffix(".arrow")
+
+
+def _arrays(meta: Sequence[Dict], dicts: Optional[Dict[str, pa.Array]] = None) -> List[pa.Array]:
+    cols = []
+    for name in FIELDS:
+        vals = [m.get(name) for m in meta]
+        if name in ("page", "chunk_idx"):
+            vals = [int(v) if v is not None and str(v).lstrip("-").isdigit() else None for v in vals]
+        elif name != "text":
+            vals = [None if v is None else str(v) for v in vals]
+        typ = schema().field(name).type
+        if dicts is not None and name in dicts:
+            # fast ordbok for hele filen, så alle batcher deler samme dictionary
+            idx = pc.index_in(pa.array(vals, type=pa.string()), value_set=dicts[name])
+            cols.append(pa.DictionaryArray.from_arrays(idx.cast(typ.index_type), dicts[name]))
+        elif pa.types.is_dictionary(typ):
+            cols.append(pa.array(vals, type=pa.string()).dictionary_encode().cast(typ))
+        else:
+            cols.append(pa.array(vals, type=typ))
+    return cols
+
+
+def write_meta(meta: Sequence[Dict], path: str | Path) -> None:
+    """Skriv metadata som Arrow IPC (skrives til .tmp og byttes inn)."""
+    table = pa.Table.from_arrays(_arrays(meta), schema=schema())
+    tmp = unique_tmp(Path(path))
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_file(sink, schema()) as writer:
+            writer.write_table(table)
+    tmp.replace(path)
+
+
+def _iter_jsonl_batches(jsonl_path: Path, batch_rows: int) -> Iterator[List[Dict]]:
+    batch: List[Dict] = []
+    with jsonl_path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def convert_jsonl(jsonl_path: str | Path, batch_rows: int = 4096) -> None:
+    """
+    meta.jsonl -> meta.arrow uten å holde alle tekstene i minnet: første pass
+    samler ordbøkene for de dictionary-kodede feltene (få, korte verdier),
+    andre pass skriver én record batch per `batch_rows` rader.
+    """
+    jsonl_path = Path(jsonl_path)
+    dict_fields = [f.name for f in schema() if pa.types.is_dictionary(f.type)]
+    values: Dict[str, Dict[str, None]] = {name: {} for name in dict_fields}
+    for batch in _iter_jsonl_batches(jsonl_path, batch_rows):
+        for m in batch:
+            for name in dict_fields:
+                v = m.get(name)
+                if v is not None:
+                    values[name].setdefault(str(v), None)
+    dicts = {name: pa.array(list(vals), type=pa.string()) for name, vals in values.items()}
+
+    tmp = unique_tmp(arrow_path(jsonl_path))
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_file(sink, schema()) as writer:
+            for batch in _iter_jsonl_batches(jsonl_path, batch_rows):
+                writer.write_batch(pa.RecordBatch.from_arrays(_arrays(batch, dicts), schema=schema()))
+    tmp.replace(arrow_path(jsonl_path))
+
+
+class MetaRow(MutableMapping):
+    """
+    Lett visning av én rad. Felter hentes fra tabellen først når de leses;
+    felter som settes (score, row, …) lagres lokalt. `dict(row)` materialiserer.
+    """
+
+    __slots__ = ("_table", "_i", "_extra")
+
+    def __init__(self, table: "MetaTable", i: int):
+        self._table = table
+        self._i = i
+        self._extra: Dict = {}
+
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        if key in FIELDS:
+            return self._table.value(key, self._i)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        del self._extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from FIELDS
+        yield from (k for k in self._extra if k not in FIELDS)
+
+    def __len__(self) -> int:
+        return len(FIELDS) + sum(1 for k in self._extra if k not in FIELDS)
+
+    def __repr__(self) -> str:
+        return f"MetaRow({dict(self)!r})"
+
+
+class MetaTable(Sequence):
+    """Minnemappet, kolonnebasert metadata; `table[i]` gir en `MetaRow`."""
+
+    def __init__(self, table: pa.Table, source: Optional[pa.MemoryMappedFile] = None):
+        self.table = table
+        self._source = source
+        self._cols: Dict[str, pa.ChunkedArray] = {}
+        self._starts: Dict[str, List[int]] = {}  # første rad i hver chunk, per kolonne
+
+    @classmethod
+    def open(cls, path: str | Path) -> "MetaTable":
+        mm = pa.memory_map(str(path), "r")
+        return cls(pa.ipc.open_file(mm).read_all(), mm)
+
+    def _col(self, name: str) -> pa.ChunkedArray:
+        col = self._cols.get(name)
+        if col is None:
+            # Ikke combine_chunks(): det ville kopiert hele kolonnen (alle tekstene) inn i heapen
+            col = self.table.column(name)
+            starts, n = [], 0
+            for chunk in col.chunks:
+                starts.append(n)
+                n += len(chunk)
+            self._starts[name] = starts
+            self._cols[name] = col
+        return col
+
+    def value(self, name: str, i: int):
+        """Ett felt i rad i, slått opp i record batchen raden ligger i."""
+        col = self._col(name)
+        starts = self._starts[name]
+        c = bisect.bisect_right(starts, i) - 1
+        return col.chunk(c)[i - starts[c]].as_py()
+
+    def column(self, name: str) -> List:
+        return self._col(name).to_pylist()
+
+    def ids_and_lengths(self) -> List[Tuple[str, int]]:
+        lens = pc.utf8_length(self._col("text")).to_pylist()
+        return list(zip(self.column("id"), [n or 0 for n in lens]))
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [MetaRow(self, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return MetaRow(self, i)
+
+    def close(self) -> None:
+        self._cols.clear()
+        self._starts.clear()
+        if self._source is not None:
+            self._source.close()
+
+
+def load_meta(jsonl_path: str | Path):
+    """
+    Metadata for artefaktet: meta.arrow (minnemappet) når den finnes og er minst
+    like ny som meta.jsonl, ellers list-of-dicts fra jsonl som før.
+    """
+    jsonl_path = Path(jsonl_path)
+    apath = arrow_path(jsonl_path)
+    try:
+        if apath.exists() and (not jsonl_path.exists() or apath.stat().st_mtime_ns >= jsonl_path.stat().st_mtime_ns):
+            return MetaTable.open(apath)
+    except Exception:
+        pass
+    with jsonl_path.open(encoding="utf-8") as f:
+        return [json.loads(l) for l in f]
+
+
+def save_meta(meta: Sequence[Dict], jsonl_path: str | Path) -> None:
+    """Skriv både meta.jsonl (utvekslingsformat) og meta.arrow (kjøretid)."""
+    jsonl_path = Path(jsonl_path)
+    with jsonl_path.open("w", encoding="utf-8") as f:
+        for m in meta:
+            f.write(json.dumps(dict(m), ensure_ascii=False) + "\n")
+    write_meta(meta, arrow_path(jsonl_path))
+
+
+def iter_column(meta, name: str, batch_rows: int = 4096) -> Iterator:
+    """Verdiene i ett felt, rad for rad; fra Arrow hentes de batchvis."""
+    if isinstance(meta, MetaTable):
+        col = meta.table.column(name)
+        for start in range(0, len(meta), batch_rows):
+            yield from col.slice(start, batch_rows).to_pylist()
+    else:
+        for m in meta:
+            yield m.get(name)
+
+
+def row(meta, i: int) -> MutableMapping:
+    """Et eget (muterbart) treffobjekt for rad i, uavhengig av lagringsform."""
+    return meta[i] if isinstance(meta, MetaTable) else dict(meta[i])
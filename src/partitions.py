@@ -0,0 +1,172 @@
+from __future__ import annotations
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src import metastore
+from src.utils import unique_tmp
+
+# Partisjoner av radsettet for filtrert søk: per doc_type- og source-verdi en
+# bitmap over radene (np.packbits, little-endian – samme layout som FAISS
+# sin IDSelectorBitmap), og version_date som heltall YYYYMMDD per rad.
+# Bygges ved ingest ved siden av bm25.npz og slås opp ved spørring, så et
+# filtrert søk skårer bare radene i partisjonen.
+#
+# Filtre (search(..., filters=...)):
+#   {"doc_type": "pris" | ["pris", "booking"],
+#    "source": "kb/priser.md" | "priser.md" | [...],      # full sti eller filnavn
+#    "version_date": "2024" | ["2023", "2024-05"]              # prefiks(er)
+#                    | ("2024-01-01", None) | {"from": "2024-01-01", "to": None}}  # intervall, inkl.
+# Flere verdier i ett felt (liste) er ELLER, flere felt er OG. Et intervall
+# oppgis som tuple eller som objekt med from/to (JSON har ikke tupler). Rader
+# uten dato faller bort når version_date er med i filteret.
+
+FIELDS = ("doc_type", "source")
+PARTITIONS_VERSION = 1
+_DATE = re.compile(r"(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?")
+
+
+def _date_bounds(s: str) -> Tuple[int, int]:
+    """(laveste, høyeste) YYYYMMDD som datoprefikset `s` dekker; (0, 0) hvis uleselig."""
+    m = _DATE.match(str(s or "").strip())
+    if not m:
+        return 0, 0
+    y, mo, d = int(m.group(1)), m.group(2), m.group(3)
+    lo = y * 10000 + (int(mo) * 100 if mo else 0) + (int(d) if d else 0)
+    hi = y * 10000 + (int(mo) * 100 if mo else 1299) + (int(d) if d else (99 if mo else 0))
+    return lo, hi
+
+
+def _values(v) -> List[str]:
+    return [str(x) for x in v] if isinstance(v, (list, tuple, set, frozenset)) else [str(v)]
+
+
+def _date_range(v) -> Tuple[str, str, str]:
+    """("range", fra, til) fra (fra, til) eller {"from": …, "to": …}; tom grense = åpen."""
+    if isinstance(v, dict):
+        if set(v) - {"from", "to"}:
+            raise ValueError(f"Datointervall tar bare from/to, ikke {sorted(set(v) - {'from', 'to'})}")
+        lo, hi = v.get("from"), v.get("to")
+    elif len(v) == 2:
+        lo, hi = v
+    else:
+        raise ValueError(f"Datointervall må være (fra, til), fikk {len(v)} verdier")
+    return "range", str(lo or ""), str(hi or "")
+
+
+def normalize(filters: Optional[Dict]) -> Optional[Tuple]:
+    """Kanonisk, hashbar form av et filter (nøkkel i cacher og mikrobatcher); None = ingen filter."""
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError(f"Filter må være et objekt {{felt: verdi(er)}}, ikke {type(filters).__name__}")
+    out = []
+    for field in sorted(filters):
+        v = filters[field]
+        if v is None or v == [] or v == ():
+            continue
+        if field == "version_date" and isinstance(v, (tuple, dict)):
+            out.append((field, _date_range(v)))
+        elif field in FIELDS or field == "version_date":
+            out.append((field, tuple(sorted(set(_values(v))))))
+        else:
+            raise ValueError(f"Ukjent filterfelt {field!r} (gyldige: doc_type, source, version_date)")
+    return tuple(out) or None
+
+
+class PartitionIndex:
+    def __init__(self, n: int, values: Dict[str, List[str]], bits: Dict[str, np.ndarray], dates: np.ndarray,
+                 digest: str = ""):
+        self.n = n
+        self.values = values  # felt -> verdier (rad j i bits[felt] hører til values[felt][j])
+        self.bits = bits  # felt -> (antall verdier, ceil(n/8)) uint8
+        self.dates = dates  # (n,) int32, YYYYMMDD; 0 = mangler
+        self.digest = digest
+        self._col = {f: {v: j for j, v in enumerate(vals)} for f, vals in values.items()}
+        self._by_name: Dict[str, List[int]] = {}  # filnavn -> kilder (source-filter på bare navnet)
+        for j, v in enumerate(values.get("source", [])):
+            self._by_name.setdefault(Path(v).name, []).append(j)
+
+    @classmethod
+    def build(cls, meta: Sequence[Dict], digest: str = "") -> "PartitionIndex":
+        n = len(meta)
+        values: Dict[str, List[str]] = {}
+        bits: Dict[str, np.ndarray] = {}
+        for field in FIELDS:
+            col = [v if v is not None else "" for v in metastore.iter_column(meta, field)]
+            names = sorted({v for v in col if v})
+            code = {v: j for j, v in enumerate(names)}
+            codes = np.array([code.get(v, -1) for v in col], dtype=np.int64)
+            rows = np.flatnonzero(codes >= 0)
+            packed = np.zeros((len(names), (n + 7) // 8), dtype=np.uint8)
+            np.bitwise_or.at(packed, (codes[rows], rows >> 3), (1 << (rows & 7)).astype(np.uint8))
+            values[field] = names
+            bits[field] = packed
+        dates = np.array([_date_bounds(v)[0] if v else 0 for v in metastore.iter_column(meta, "version_date")],
+                         dtype=np.int32)
+        return cls(n, values, bits, dates, digest)
+
+    def _field_mask(self, field: str, wanted: Sequence[str]) -> np.ndarray:
+        cols = set()
+        for v in wanted:
+            if v in self._col[field]:
+                cols.add(self._col[field][v])
+            elif field == "source":
+                cols.update(self._by_name.get(Path(v).name, []))
+        if not cols:
+            return np.zeros(self.n, dtype=bool)
+        packed = np.bitwise_or.reduce(self.bits[field][sorted(cols)], axis=0)
+        return np.unpackbits(packed, count=self.n, bitorder="little").astype(bool)
+
+    def mask(self, filters) -> Optional[np.ndarray]:
+        """Radmaske (bool, n) for filteret (dict eller normalize-form); None = alle rader."""
+        key = filters if isinstance(filters, tuple) or filters is None else normalize(filters)
+        if key is None:
+            return None
+        out = np.ones(self.n, dtype=bool)
+        for field, spec in key:
+            if field == "version_date":
+                if spec and spec[0] == "range":
+                    lo = _date_bounds(spec[1])[0] if spec[1] else 1
+                    hi = _date_bounds(spec[2])[1] if spec[2] else np.iinfo(np.int32).max
+                    sel = (self.dates >= lo) & (self.dates <= hi)
+                else:
+                    sel = np.zeros(self.n, dtype=bool)
+                    for v in spec:
+                        lo, hi = _date_bounds(v)
+                        sel |= (self.dates >= max(lo, 1)) & (self.dates <= hi)
+                out &= sel
+            else:
+                out &= self._field_mask(field, spec)
+        return out
+
+    def save(self, path: str | Path) -> None:
+        arrays = {"n": np.array(self.n), "dates": self.dates, "digest": np.array(self.digest)}
+        for field in FIELDS:
+            arrays[f"{field}_values"] = np.array(self.values[field], dtype=str)
+            arrays[f"{field}_bits"] = self.bits[field]
+        tmp = unique_tmp(Path(path))
+        with tmp.open("wb") as f:
+            np.savez(f, **arrays)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "PartitionIndex":
+        z = np.load(path)
+        values = {f: [str(v) for v in z[f"{f}_values"]] for f in FIELDS}
+        bits = {f: z[f"{f}_bits"] for f in FIELDS}
+        return cls(int(z["n"]), values, bits, z["dates"], str(z["digest"]))
+
+
+def digest_for(meta_digest: str) -> str:
+    return hashlib.sha1(f"{meta_digest}|partitions-v{PARTITIONS_VERSION}".encode("utf-8")).hexdigest()
+
+
+def build_for(meta: Sequence[Dict], meta_digest: str, path: str | Path) -> PartitionIndex:
+    """Bygg og lagre partisjonene for radene i `meta` (ved siden av meta.jsonl)."""
+    index = PartitionIndex.build(meta, digest=digest_for(meta_digest))
+    index.save(path)
+    return index
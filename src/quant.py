@@ -0,0 +1,139 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Kvantiserte kopier av vectors.npy for grovsøket i src.retrieve:
+#   f16  – float16 (halv størrelse)
+#   int8 – int8 med skala per dimensjon (kvart størrelse), skala = maks|x_j| / 127
+# Grovpasset skårer alle rader mot de kompakte vektorene (blokkvis omgjort til
+# float32, så båndbredden er det som spares), tar ut QUANT_RESCORE x n
+# kandidater og reskårer dem eksakt mot float32-radene i vectors.npy
+# (minnemappet; bare kandidatradene leses). Rekkefølgen på de n som returneres
+# er dermed den eksakte, så lenge de sanne topp-n er blant kandidatene.
+
+KINDS = ("none", "f16", "int8")
+VECTOR_QUANT = os.getenv("VECTOR_QUANT", "none").strip().lower()
+QUANT_RESCORE = int(os.getenv("QUANT_RESCORE", "4"))  # kandidater per returnerte treff
+QUANT_MIN_EXTRA = 16  # minst så mange ekstra kandidater (små k)
+BLOCK_ROWS = 65536  # rader per float32-omgjøring i grovpasset og ved skriving
+
+
+def _kind(kind: Optional[str]) -> str:
+    kind = (kind or VECTOR_QUANT).lower()
+    if kind not in KINDS:
+        raise ValueError(f"Ukjent VECTOR_QUANT={kind!r} (gyldige: {', '.join(KINDS)})")
+    return kind
+
+
+def paths(d: Path, kind: str) -> Tuple[Path, Optional[Path]]:
+    """(kodefil, skalafil) for `kind` i katalogen d."""
+    d = Path(d)
+    return d / f"vectors.{kind}.npy", (d / "vectors.int8.scale.npy" if kind == "int8" else None)
+
+
+def write(X: np.ndarray, d: Path, kind: Optional[str] = None) -> Optional[Path]:
+    """
+    Skriv kvantisert kopi av X (normaliserte float32-rader) til d, blokk for
+    blokk så X kan være en memmap. Returnerer stien, eller None når kvantisering er av.
+    """
+    kind = _kind(kind)
+    if kind == "none":
+        return None
+    n, dim = X.shape
+    codes_path, scale_path = paths(d, kind)
+    scale = None
+    if kind == "int8":
+        amax = np.zeros(dim, dtype="float32")
+        for a in range(0, n, BLOCK_ROWS):
+            amax = np.maximum(amax, np.abs(np.asarray(X[a:a + BLOCK_ROWS], dtype="float32")).max(axis=0))
+        scale = np.where(amax > 0, amax / 127.0, 1.0).astype("float32")
+
+    tmp = codes_path.with_name(codes_path.name + ".tmp")
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype="float16" if kind == "f16" else "int8", shape=(n, dim))
+    for a in range(0, n, BLOCK_ROWS):
+        block = np.asarray(X[a:a + BLOCK_ROWS], dtype="float32")
+        if kind == "f16":
+            out[a:a + len(block)] = block.astype("float16")
+        else:
+            out[a:a + len(block)] = np.clip(np.rint(block / scale), -127, 127).astype("int8")
+    out.flush()
+    del out
+    if scale_path is not None:
+        stmp = scale_path.with_name(scale_path.name + ".tmp")
+        with stmp.open("wb") as f:
+            np.save(f, scale)
+        os.replace(stmp, scale_path)
+    os.replace(tmp, codes_path)
+    return codes_path
+
+
+class QuantizedVectors:
+    """Minnemappede, kvantiserte vektorer med blokkvis grovskåring."""
+
+    def __init__(self, codes: np.ndarray, scale: Optional[np.ndarray], kind: str):
+        self.codes = codes
+        self.scale = scale
+        self.kind = kind
+
+    @classmethod
+    def open(cls, d: Path, kind: Optional[str] = None, n: Optional[int] = None,
+             dim: Optional[int] = None) -> Optional["QuantizedVectors"]:
+        """Åpne kopien i d; None hvis den mangler eller ikke passer til (n, dim)."""
+        kind = _kind(kind)
+        if kind == "none":
+            return None
+        codes_path, scale_path = paths(d, kind)
+        try:
+            codes = np.load(codes_path, mmap_mode="r")
+            scale = np.load(scale_path) if scale_path is not None else None
+        except (OSError, ValueError):
+            return None
+        if codes.ndim != 2 or (n is not None and codes.shape[0] != n) or (dim is not None and codes.shape[1] != dim):
+            return None
+        return cls(codes, scale, kind)
+
+    def __len__(self) -> int:
+        return int(self.codes.shape[0])
+
+    def scores(self, Q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Tilnærmede skårer (len(Q), N), eller (len(Q), len(rows)) for bare de
+        radene (filtrert søk); int8-skalaen foldes inn i spørringene.
+        """
+        Q = np.asarray(Q, dtype="float32")
+        if self.scale is not None:
+            Q = Q * self.scale
+        total = len(self) if rows is None else len(rows)
+        sims = np.empty((len(Q), total), dtype="float32")
+        for a in range(0, total, BLOCK_ROWS):
+            part = self.codes[a:a + BLOCK_ROWS] if rows is None else self.codes[rows[a:a + BLOCK_ROWS]]
+            block = np.asarray(part, dtype="float32")
+            sims[:, a:a + len(block)] = Q @ block.T
+        return sims
+
+
+def shortlist_size(n: int, total: int) -> int:
+    """Antall kandidater grovpasset skal gi for å returnere n eksakte treff."""
+    return min(total, max(n * QUANT_RESCORE, n + QUANT_MIN_EXTRA))
+
+
+def rescore(emb: np.ndarray, Q: np.ndarray, I: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Eksakte float32-skårer for kandidatene I (len(Q), m) mot emb; returnerer
+    (I, D) for de n beste per spørring, sortert synkende. -1 (tomme plasser fra FAISS) hoppes over.
+    """
+    n = min(n, I.shape[1])
+    out_I = np.full((len(Q), n), -1, dtype=np.int64)
+    out_D = np.full((len(Q), n), -np.inf, dtype="float32")
+    for r in range(len(Q)):
+        ids = np.unique(I[r][I[r] >= 0])  # sortert: lesingen fra memmap går fremover i filen
+        if ids.size == 0:
+            continue
+        d = np.asarray(emb[ids], dtype="float32") @ Q[r]
+        top = np.argsort(-d, kind="stable")[:n]
+        out_I[r, :len(top)] = ids[top]
+        out_D[r, :len(top)] = d[top]
+    return out_I, out_D
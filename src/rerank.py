@@ -0,0 +1,119 @@
+from __future__ import annotations
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+
+from src import metastore
+from src.utils import lazy_import, unique_tmp
+
+sp = lazy_import("scipy.sparse")
+
+# Synonymtabellen brukes både til query-utvidelse (src.answer) og til
+# nøkkelordmatrisen som bygges ved ingest.
+SYN = {
+    "booking": ["booking", "booke", "banebooking", "banereservasjon", "reserver", "bane", "matchi"],
+    "pris": ["pris", "avgift", "timepris", "kostnad", "medlemspris", "drop-in", "billig", "rimelig", "rabatt", "off-peak", "lavsesong"],
+    "tid": ["tid", "tidspunkt", "hverdag", "helg", "dagtid", "kveld"],
+}
+DOC_HINTS = {"booking": SYN["booking"], "pris": SYN["pris"]}
+
+# Bonuser i reranken
+DOC_TYPE_BONUS = 0.15
+KEY_BONUS = 0.02
+KEY_BONUS_MAX = 0.10
+
+
+def all_terms() -> List[str]:
+    return sorted({t for terms in SYN.values() for t in terms})
+
+
+def _digest(meta_digest: str, terms: Sequence[str]) -> str:
+    return hashlib.sha1((meta_digest + "|" + ",".join(terms)).encode("utf-8")).hexdigest()
+
+
+class KeywordIndex:
+    """
+    Forhåndsberegnet per bit: hvilke SYN-termer teksten inneholder (sparse
+    bit x term-matrise, samme delstreng-semantikk som før) og doc_type som
+    heltallskode. Reranken blir da ren NumPy over kandidatradene.
+    """
+
+    def __init__(self, terms: List[str], presence: sp.csr_matrix, doc_types: np.ndarray,
+                 type_names: List[str], digest: str = ""):
+        self.terms = terms
+        self.col = {t: i for i, t in enumerate(terms)}
+        self.presence = presence  # (n_chunks, n_terms), uint8
+        self.doc_types = doc_types  # (n_chunks,), int16; -1 = ukjent
+        self.type_names = type_names
+        self.type_code = {t: i for i, t in enumerate(type_names)}
+        self.digest = digest
+
+    @classmethod
+    def build(cls, meta: Sequence[Dict], terms: Optional[List[str]] = None, digest: str = "") -> "KeywordIndex":
+        terms = terms if terms is not None else all_terms()
+        rows: List[int] = []
+        cols: List[int] = []
+        for i, text in enumerate(metastore.iter_column(meta, "text")):
+            low = (text or "").lower()
+            hit = [j for j, t in enumerate(terms) if t in low]
+            rows += [i] * len(hit)
+            cols += hit
+        presence = sp.csr_matrix((np.ones(len(rows), dtype=np.uint8), (rows, cols)), shape=(len(meta), len(terms)))
+        types = [t or None for t in metastore.iter_column(meta, "doc_type")]
+        type_names = sorted({t for t in types if t})
+        code = {t: i for i, t in enumerate(type_names)}
+        doc_types = np.array([code.get(t, -1) for t in types], dtype=np.int16)
+        return cls(terms, presence, doc_types, type_names, digest)
+
+    def covers(self, keys: Iterable[str]) -> bool:
+        return all(k in self.col for k in keys)
+
+    def bonus(self, rows: np.ndarray, keys: Sequence[str], preferred: Set[str]) -> np.ndarray:
+        """Bonus per kandidatrad: doc_type-treff + (begrenset) antall nøkkelord i teksten."""
+        out = np.zeros(len(rows), dtype=np.float64)
+        codes = [self.type_code[d] for d in preferred if d in self.type_code]
+        if codes:
+            out += DOC_TYPE_BONUS * np.isin(self.doc_types[rows], codes)
+        if keys:
+            counts = np.asarray(self.presence[rows][:, [self.col[k] for k in keys]].sum(axis=1)).ravel()
+            out += np.minimum(KEY_BONUS_MAX, KEY_BONUS * counts)
+        return out
+
+    def save(self, path: str | Path) -> None:
+        p = self.presence
+        tmp = unique_tmp(Path(path))
+        with tmp.open("wb") as f:
+            np.savez(f, data=p.data, indices=p.indices, indptr=p.indptr, shape=np.array(p.shape),
+                     terms=np.array(self.terms, dtype=str), doc_types=self.doc_types,
+                     type_names=np.array(self.type_names, dtype=str), digest=np.array(self.digest))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "KeywordIndex":
+        z = np.load(path)
+        presence = sp.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+        return cls([str(t) for t in z["terms"]], presence, z["doc_types"],
+                   [str(t) for t in z["type_names"]], str(z["digest"]))
+
+
+def digest_for(meta_digest: str) -> str:
+    return _digest(meta_digest, all_terms())
+
+
+def build_for(meta: Sequence[Dict], meta_digest: str, path: str | Path) -> KeywordIndex:
+    """Bygg og lagre nøkkelordmatrisen for radene i `meta` (ved siden av meta.jsonl)."""
+    index = KeywordIndex.build(meta, digest=digest_for(meta_digest))
+    index.save(path)
+    return index
+
+
+def bonus_from_texts(hits: Sequence[Dict], keys: Sequence[str], preferred: Set[str]) -> np.ndarray:
+    """Fallback når treffene ikke har rad i en nøkkelordindeks (samme semantikk)."""
+    out = np.zeros(len(hits), dtype=np.float64)
+    for i, h in enumerate(hits):
+        txt = (h.get("text") or "").lower()
+        out[i] = (DOC_TYPE_BONUS if h.get("doc_type") in preferred else 0.0) + \
+            min(KEY_BONUS_MAX, KEY_BONUS * sum(1 for t in keys if t in txt))
+    return out
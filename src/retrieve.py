@@ -1,179 +1,89 @@
 from __future__ import annotations
+import contextvars
 import json
 import os
+import pickle
+import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Tuple, Iterable, Optional
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple, Optional, Sequence
 
 import numpy as np
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+from src import (artifacts, bm25, chunking, embed_cache, embedders, metastore, partitions, quant, rerank, settings,
+                 trace)
+from src.utils import lazy_import, open_vectors, optional_import, unique_tmp
 
-from src.utils import env_flag
+if TYPE_CHECKING:
+    from sklearn.feature_extraction.text import TfidfVectorizer
 
-# --- Konfig ---
-KB_DIRS = [Path("kb"), Path("data/processed")]
-CHUNK_SIZE = 700
-CHUNK_OVERLAP = 120
+# scipy/sklearn/faiss/openai lastes først når en indeks faktisk bygges eller
+# søkes i, så `import src.answer` (app, arbeidere) holder seg rask
+sp = lazy_import("scipy.sparse")
+_UNSET = object()
+ann = _UNSET  # src.ann (krever faiss); None = ikke tilgjengelig
 
-DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
-USE_OPENAI = env_flag("USE_OPENAI", False)
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+# --- Konfig ---
+_S = settings.get()
+KB_DIRS = chunking.roots(_S.kb_dir)  # samme kilder som src.ingest
+DATA_DIR = _S.data_dir
+USE_OPENAI = _S.use_openai
+EMBED_MODEL = _S.embed_model
+EMBEDDER = _S.embedder  # hvem som lager vektorene i vektorbackenden (src.embedders)
+# RETRIEVAL_MODE=hybrid: BM25 (invertert indeks) + vektorbackenden, fusjonert med RRF
+RETRIEVAL_MODE = _S.retrieval_mode
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "30"))  # kandidater fra hver side
+FILTER_EXACT_ROWS = int(os.getenv("FILTER_EXACT_ROWS", "50000"))  # partisjoner opp til dette skåres eksakt
+FILTER_CACHE = 32  # TF-IDF-delmatriser for de sist brukte filtrene
+INDEX_WATCH_SECS = float(os.getenv("INDEX_WATCH_SECS", "2"))  # hvor ofte watch() ser etter ny generasjon
+PIN_WAIT_SECS = float(os.getenv("PIN_WAIT_SECS", "5"))  # pinned() venter så lenge på en erstatning for en lukket retriever
+RRF_K = 60
 
-# OpenAI klient (kun hvis USE_OPENAI)
+# OpenAI-klient (kun hvis USE_OPENAI), lages ved første spørring
 _openai = None
-if USE_OPENAI:
-    try:
-        from openai import OpenAI
-        _openai = OpenAI()
-    except Exception:
-        _openai = None  # vi klarer fortsatt TF-IDF
-
-# TF-IDF state
-_VEC: Optional[TfidfVectorizer] = None
-_MTX = None  # scipy sparse
-_META: List[Dict] = []  # én entry per rad i _MTX
-
-# OpenAI state
-_EMB: Optional[np.ndarray] = None  # shape (n_chunks, dim)
-_META_OAI: List[Dict] = []
-
-# ---------- Utils ----------
-import re
-def _read_text_file(p: Path) -> str:
+
+def _client():
+    global _openai
+    if not USE_OPENAI:
+        return None
+    if _openai is None:
+        _openai = settings.openai_client()  # None -> vi klarer fortsatt TF-IDF
+    return _openai
+
+def _embedder(client) -> Optional[embedders.Embedder]:
+    """Embedderen for vektorbackenden; None (-> TF-IDF) når OpenAI er valgt uten klient."""
+    if EMBEDDER == "openai":
+        return embedders.OpenAIEmbedder(EMBED_MODEL, client) if client is not None else None
+    return embedders.local(EMBEDDER)
+
+def _built_with(d: Path) -> Optional[str]:
+    """Embedderen vektorene i d er bygd med (manifest.json fra src.ingest); None hvis ukjent."""
     try:
-        return p.read_text(encoding="utf-8", errors="ignore")
-    except Exception:
-        return ""
-
-def _strip_markdown_noise(txt: str) -> str:
-    txt = re.sub(r"```.*?```", " ", txt, flags=re.S)
-    txt = re.sub(r" ", " ", txt, flags=re.S)
-    txt = re.sub(r"\s+", " ", txt)
-    return txt.strip()
-
-def _title_from_markdown(txt: str, fallback: str) -> str:
-    m = re.search(r"^\s*#\s+(.+)$", txt, flags=re.M)
-    if m:
-        return m.group(1).strip()
-    for line in txt.splitlines():
-        s = line.strip()
-        if s:
-            return s[:120]
-    return fallback
-
-def _infer_doc_type(name: str, text: str) -> str:
-    low = (name + " " + text[:400]).lower()
-    if any(w in low for w in ["vilkår", "terms", "betingelser", "angrerett", "personvern", "gdpr", "privacy"]):
-        return "regel"
-    if any(w in low for w in ["pris", "timepris", "avgift", "kontingent", "kostnad", "rabatt"]):
-        return "pris"
-    if any(w in low for w in ["booking", "banebooking", "reserver", "matchi", "baneregler"]):
-        return "booking"
-    if any(w in low for w in ["håndbok"]):
-        return "håndbok"
-    return "annet"
-
-def _chunk(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
-    text = text.strip()
-    if not text:
-        return []
-    chunks = []
-    i = 0
-    n = len(text)
-    while i < n:
-        j = min(i + size, n)
-        chunk = text[i:j]
-        chunks.append(chunk)
-        if j == n:
-            break
-        i = max(j - overlap, 0)
-    return chunks
-
-def _iter_kb_files() -> Iterable[Path]:
-    seen = set()
-    for d in KB_DIRS:
-        if not d.exists():
-            continue
-        for p in d.rglob("*.md"):
-            if p.is_file():
-                seen.add(p.resolve())
-        for p in d.rglob("*.jsonl"):
-            if p.is_file():
-                seen.add(p.resolve())
-    for p in sorted(seen):
-        yield Path(p)
-
-def _load_corpus() -> List[Dict]:
-    """
-    Returnerer en liste med dicts:
-    { "text", "source", "title", "doc_type", "version_date", "page", "chunk_idx", "id" }
-    """
-    docs: List[Dict] = []
-    for p in _iter_kb_files():
-        source_path = str(p).replace("\\", "/")
-        if p.suffix.lower() == ".md":
-            raw = _read_text_file(p)
-            clean = _strip_markdown_noise(raw)
-            title = _title_from_markdown(raw, p.stem.replace("-", " "))
-            doc_type = _infer_doc_type(p.name, clean)
-            chunks = _chunk(clean)
-            for ci, ch in enumerate(chunks):
-                docs.append({
-                    "text": ch,
-                    "source": source_path,
-                    "title": title,
-                    "doc_type": doc_type,
-                    "version_date": None,
-                    "page": None,
-                    "chunk_idx": ci,
-                    "id": f"{source_path}#{ci}",
-                })
-        elif p.suffix.lower() == ".jsonl":
-            ci = 0
-            for line in _read_text_file(p).splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                txt = obj.get("text", "")
-                meta = obj.get("metadata", {})
-                if not txt.strip():
-                    continue
-                txt_clean = _strip_markdown_noise(txt)
-                title = meta.get("title") or _title_from_markdown(txt, Path(meta.get("source", p.stem)).stem)
-                doc_type = meta.get("doc_type") or _infer_doc_type(title, txt)
-                src = (meta.get("source") or source_path).replace("\\", "/")
-                page = meta.get("page")
-                docs.append({
-                    "text": txt_clean,
-                    "source": src,
-                    "title": title,
-                    "doc_type": doc_type,
-                    "version_date": meta.get("version_date"),
-                    "page": page,
-                    "chunk_idx": ci,
-                    "id": f"{src}#{ci}",
-                })
-                ci += 1
-    return docs
+        return json.loads((d / "manifest.json").read_text(encoding="utf-8")).get("backend")
+    except (OSError, ValueError):
+        return None
+
+def _ann():
+    global ann
+    if ann is _UNSET:
+        ann = optional_import("src.ann")
+    return ann
 
 # ---------- Index bygging ----------
-def _ensure_index_tfidf() -> None:
-    global _VEC, _MTX, _META
-    if _VEC is not None and _MTX is not None and _META:
-        return
-    corpus = _load_corpus()
-    _META = corpus
-    texts = [d["text"] for d in corpus]
+# TF-IDF-artefakter i DATA_DIR: tilpasset vectorizer (pickle), CSR-matrise
+# (.npz), metadata per rad (kopi av chunks.arrow) og tfidf.json med
+# fingeravtrykk av bitlageret. Lesere laster settet i gjeldende generasjon
+# som det er; bare byggere (src.ingest, rebuild=True) ser på kildene og fitter.
+TFIDF_VERSION = 2
+
+def _fit_tfidf(texts: List[str]):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
     if not texts:
-        _VEC = TfidfVectorizer(ngram_range=(1, 2), max_features=1000)
-        _MTX = _VEC.fit_transform([""])
-        return
-    _VEC = TfidfVectorizer(
+        vec = TfidfVectorizer(ngram_range=(1, 2), max_features=1000)
+        return vec, vec.fit_transform([""])
+    vec = TfidfVectorizer(
         ngram_range=(1, 2),
         max_df=0.95,
         min_df=1,
@@ -182,53 +92,668 @@ def _ensure_index_tfidf() -> None:
         norm="l2",
         sublinear_tf=True,
         max_features=60000,
+        dtype=np.float32,
     )
-    _MTX = _VEC.fit_transform(texts)
+    return vec, vec.fit_transform(texts)
+
+def _topk(sims: np.ndarray, k: int) -> np.ndarray:
+    """Radvise indekser til de k høyeste skårene, synkende – uten å sortere hele korpuset."""
+    n = sims.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((sims.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(sims, n - k, axis=1)[:, n - k:] if k < n else np.broadcast_to(np.arange(n), sims.shape)
+    vals = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(vals, axis=1)[:, ::-1]
+    return np.take_along_axis(part, order, axis=1)
+
+def _hits(meta: Sequence[Dict], I: np.ndarray, D: np.ndarray) -> List[List[Dict]]:
+    out: List[List[Dict]] = []
+    for ids, scores in zip(I, D):
+        row: List[Dict] = []
+        for idx, score in zip(ids, scores):
+            if idx < 0:
+                continue
+            m = metastore.row(meta, idx)
+            m["score"] = float(score)
+            m["row"] = int(idx)
+            row.append(m)
+        out.append(row)
+    return out
+
+def _rrf(rankings: List[np.ndarray]) -> List[Tuple[int, float]]:
+    """Reciprocal-rank fusion: sum 1/(RRF_K + rang) over listene, synkende."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(int(i) for i in ranking if i >= 0):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+QUERY_BLOCK = 256  # maks antall spørringer per matriseprodukt (begrenser minne for n_q x n_docs)
+
+# ---------- Retriever ----------
+class Retriever:
+    """
+    Én lastet indeks per prosess: TF-IDF (vectorizer + CSR) eller vektorer
+    (memmap + FAISS), metadata, BM25 og nøkkelordmatrise. load() leser alt
+    inn på forhånd; ellers lastes delene ved første spørring. close() slipper
+    minnet – utsatt til siste pågående spørring er ferdig, så en indeks kan
+    byttes ut (install/reload) uten at noen forespørsel mister grunnen under seg.
+    Konfig som ikke oppgis hentes fra modulens globale (DATA_DIR, USE_OPENAI …).
+    """
+
+    def __init__(self, data_dir: Optional[Path] = None, kb_dirs: Optional[Sequence[Path]] = None,
+                 use_openai: Optional[bool] = None, client=None, retrieval_mode: Optional[str] = None,
+                 embedder: Optional[embedders.Embedder] = None):
+        self.data_dir = Path(data_dir) if data_dir is not None else DATA_DIR
+        self.kb_dirs = list(kb_dirs) if kb_dirs is not None else list(KB_DIRS)
+        self.use_openai = USE_OPENAI if use_openai is None else use_openai
+        self.retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+        self._client = client
+        self._embedder = embedder
+        self._load_lock = threading.RLock()  # lasting skjer én gang selv med samtidige spørringer
+        self._ref_lock = threading.Lock()
+        self._inflight = 0
+        self._retired = False
+        self.closed = False
+        # Generasjonen (src.artifacts) indeksen er lest fra; settes ved første lasting
+        self.generation: Optional[str] = None
+        self.gen_dir: Optional[Path] = None
+        # TF-IDF
+        self.vec: Optional[TfidfVectorizer] = None
+        self.mtx = None  # scipy sparse
+        self.meta_tfidf: Sequence[Dict] = []  # én rad per rad i mtx (metastore.MetaTable når lastet fra disk)
+        # OpenAI
+        self.emb: Optional[np.ndarray] = None  # memmap, shape (n_chunks, dim), normalisert float32
+        self.faiss = None  # faiss.Index lest med IO_FLAG_MMAP; None -> NumPy-fallback
+        self.faiss_params: Dict = {}  # indekstype og standard efSearch/nprobe (index.json)
+        self.quant: Optional[quant.QuantizedVectors] = None  # kompakt kopi for grovpasset (VECTOR_QUANT)
+        self.meta_oai: Sequence[Dict] = []
+        # (navn, radsett) -> BM25Index/KeywordIndex/PartitionIndex; ett sett per backend, så et bytte ikke bygger om
+        self._aux: Dict[Tuple[str, str], object] = {}
+        self._subsets: Dict = {}  # normalisert filter -> TF-IDF-delmatrise
+        self._digests: Dict[str, Tuple[object, str]] = {}  # radsett -> (meta, digest) – se _meta_digest
+
+    # --- livssyklus ---
+    @property
+    def client(self):
+        """OpenAI-klienten i vektormodus (brukes av EMBEDDER=openai)."""
+        if not self.use_openai:
+            return None
+        return self._client if self._client is not None else _client()
+
+    @property
+    def embedder(self) -> Optional[embedders.Embedder]:
+        """Embedderen i vektormodus (None -> TF-IDF)."""
+        if not self.use_openai:
+            return None
+        if self._embedder is None:
+            self._embedder = _embedder(self.client)
+        return self._embedder
+
+    @property
+    def meta(self) -> Sequence[Dict]:
+        return self.meta_oai if self.embedder is not None else self.meta_tfidf
+
+    def load(self) -> "Retriever":
+        """Les inn indeksen, BM25 (hybrid) og nøkkelordmatrisen nå i stedet for ved første spørring."""
+        with self._load_lock:
+            if self.embedder is not None:
+                self._ensure_openai()
+            else:
+                self._ensure_tfidf()
+            meta = self.meta
+            if meta:
+                self._ensure_keywords(meta)
+                if self.retrieval_mode == "hybrid":
+                    self._ensure_bm25(meta)
+        return self
+
+    def acquire(self) -> bool:
+        """Registrer en pågående spørring; False hvis retrieveren allerede er lukket."""
+        with self._ref_lock:
+            if self.closed or self._retired:
+                return False
+            self._inflight += 1
+            return True
+
+    def release(self) -> None:
+        with self._ref_lock:
+            self._inflight -= 1
+            done = self._retired and self._inflight == 0
+        if done:
+            self._release()
+
+    def close(self) -> None:
+        """Slipp indeksen; venter med det til pågående spørringer er ferdige."""
+        with self._ref_lock:
+            self._retired = True
+            busy = self._inflight > 0
+        if not busy:
+            self._release()
+
+    def _release(self) -> None:
+        with self._load_lock:
+            if self.closed:
+                return
+            self.closed = True
+            for meta in (self.meta_tfidf, self.meta_oai):
+                if isinstance(meta, metastore.MetaTable):
+                    meta.close()  # Arrow-bufferne holder selv mappingen for treff som lever videre
+            self.vec = self.mtx = self.emb = self.faiss = None
+            self.meta_tfidf, self.meta_oai = [], []
+            self._aux = {}
+            self._subsets = {}
+            self._digests = {}
+
+    @property
+    def art_dir(self) -> Path:
+        """Katalogen artefaktene leses fra (gjeldende generasjon til indeksen er lastet)."""
+        return self.gen_dir if self.gen_dir is not None else artifacts.current_dir(self.data_dir)
+
+    def _pin_generation(self, gen: Optional[str], d: Path) -> None:
+        self.generation, self.gen_dir = gen, d
+
+    def stale(self) -> bool:
+        """True hvis CURRENT peker på en annen generasjon enn den som er lastet (én liten fillesing)."""
+        if self.gen_dir is None:
+            return False
+        cur = artifacts.current_id(self.data_dir)
+        return cur is not None and cur != self.generation  # forsvunnet peker: behold det som er lastet
+
+    # --- TF-IDF ---
+    @staticmethod
+    def _tfidf_paths(d: Path) -> Dict[str, Path]:
+        return {
+            "vectorizer": d / "vectorizer.pkl",
+            "matrix": d / "tfidf.npz",
+            "meta": d / "tfidf_meta.arrow",
+            "info": d / "tfidf.json",
+        }
+
+    def tfidf_fingerprint(self) -> str:
+        return f"tfidf-v{TFIDF_VERSION}:{chunking.store_generation(self.kb_dirs, self.data_dir)}"
+
+    def _save_tfidf(self, vec, mtx, store: chunking.ChunkStore, fingerprint: str, out: Path) -> None:
+        paths = self._tfidf_paths(out)
+        # skriv til .tmp og bytt inn; tfidf.json sist slik at halvskrevne sett aldri matcher
+        tmp = {k: unique_tmp(p) for k, p in paths.items()}
+        with tmp["vectorizer"].open("wb") as f:
+            pickle.dump(vec, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with tmp["matrix"].open("wb") as f:
+            sp.save_npz(f, sp.csr_matrix(mtx), compressed=False)
+        shutil.copyfile(store.arrow, tmp["meta"])
+        tmp["info"].write_text(json.dumps({"fingerprint": fingerprint, "n": store.n}), encoding="utf-8")
+        for k in ("vectorizer", "matrix", "meta", "info"):
+            os.replace(tmp[k], paths[k])
+
+    def _load_tfidf(self, fingerprint: Optional[str], d: Path) -> bool:
+        """Les TF-IDF-settet i d; med `fingerprint` bare hvis det er bygd fra det bitlageret."""
+        paths = self._tfidf_paths(d)
+        try:
+            info = json.loads(paths["info"].read_text(encoding="utf-8"))
+            if fingerprint is not None and info.get("fingerprint") != fingerprint:
+                return False
+            with paths["vectorizer"].open("rb") as f:
+                vec = pickle.load(f)
+            mtx = sp.load_npz(paths["matrix"]).tocsr()
+            meta = metastore.MetaTable.open(paths["meta"])
+        except Exception:
+            return False
+        if mtx.shape[0] != len(meta) or len(meta) != info.get("n"):
+            return False
+        self.vec, self.mtx, self.meta_tfidf = vec, mtx, meta
+        return True
+
+    def build_tfidf(self, fingerprint: Optional[str] = None, rebuild: bool = False,
+                    out: Optional[Path] = None) -> Optional[chunking.ChunkStore]:
+        """
+        Oppdater bitlageret, fit TF-IDF på det og lagre artefaktene. Med `out`
+        skrives alt dit (ingest publiserer katalogen selv); ellers publiseres en
+        ny generasjon med resten av artefaktene arvet fra gjeldende. Returnerer
+        bitlageret i byggekatalogen (None hvis lagringen feilet).
+        """
+        with self._load_lock:
+            target = out
+            try:
+                self.data_dir.mkdir(parents=True, exist_ok=True)
+                target = out if out is not None else artifacts.stage(self.data_dir)
+                store = chunking.ensure_store(self.kb_dirs, self.data_dir, target, rebuild=rebuild)
+                fingerprint = fingerprint or f"tfidf-v{TFIDF_VERSION}:{store.generation}"
+                meta = store.meta()
+                vec, mtx = _fit_tfidf([t or "" for t in metastore.iter_column(meta, "text")])
+                self.vec, self.mtx, self.meta_tfidf = vec, mtx, meta
+                self._save_tfidf(vec, mtx, store, fingerprint, target)
+                bm25.build_for(meta, target / "tfidf_bm25.npz")
+                rerank.build_for(meta, bm25.meta_digest(meta), target / "tfidf_keywords.npz")
+                partitions.build_for(meta, bm25.meta_digest(meta), target / "tfidf_partitions.npz")
+                if out is None:
+                    gen = artifacts.publish(self.data_dir, target, backend="tfidf", n=store.n)
+                    self._pin_generation(gen, self.data_dir / artifacts.GENERATIONS / gen)
+            except OSError as e:
+                print(f"[retrieve] Kunne ikke lagre TF-IDF-indeks til {self.data_dir}: {e}")
+                if out is None and target is not None:
+                    artifacts.discard(target)
+                return None
+            return store
+
+    def _ensure_tfidf(self) -> None:
+        if self.vec is not None and self.mtx is not None and self.meta_tfidf:
+            return
+        with self._load_lock:
+            if self.vec is not None and self.mtx is not None and self.meta_tfidf:
+                return
+            # Lesere (app, tjeneste) laster gjeldende generasjon eller feiler; de
+            # chunker ikke kildene og publiserer aldri selv
+            gen, d = artifacts.resolve(self.data_dir)
+            with trace.span("load_index", backend="tfidf", generation=gen):
+                if not self._load_tfidf(None, d):
+                    raise FileNotFoundError(f"TF-IDF-indeks mangler i {d} (kjør src.ingest med USE_OPENAI=false).")
+                self._pin_generation(gen, d)
+
+    def tfidf_index(self, rebuild: bool = False) -> Tuple[TfidfVectorizer, sp.csr_matrix, List[Dict]]:
+        """(vectorizer, CSR-matrise, meta) fra gjeldende generasjon; `rebuild=True` fitter og publiserer en ny."""
+        if rebuild:
+            self.build_tfidf(rebuild=True)
+        else:
+            self._ensure_tfidf()
+        return self.vec, self.mtx, self.meta_tfidf  # type: ignore
+
+    # --- OpenAI ---
+    def _open_faiss(self, path: Path, n: int, dim: int):
+        if _ann() is None or not path.exists():
+            return None, {}
+        try:
+            index, params = ann.read(path)
+        except Exception:
+            return None, {}
+        # index.faiss må høre til de samme vektorene (TF-IDF-modus skriver SVD-vektorer der).
+        # Flat fra eldre generasjoner brukes ikke: FAISS kopierer den inn i RAM, mens
+        # NumPy-stien gir samme eksakte treff over den minnemappede vectors.npy.
+        if index.ntotal != n or index.d != dim or params.get("kind") == "flat":
+            return None, {}
+        return index, params
+
+    def _ensure_openai(self) -> None:
+        if self.emb is not None and self.meta_oai:
+            return
+        with self._load_lock:
+            if self.emb is not None and self.meta_oai:
+                return
+            gen, d = artifacts.resolve(self.data_dir)
+            vec_path = d / "vectors.npy"
+            meta_path = d / "meta.jsonl"
+            if not vec_path.exists() or not meta_path.exists():
+                raise FileNotFoundError("OpenAI-indeks mangler (kjør src.ingest i USE_OPENAI=true).")
+            # Spørringer og indeks må komme fra samme modell; en blanding gir stille søppeltreff
+            built, want = _built_with(d), self.embedder.id  # type: ignore
+            if built is not None and built != want:
+                raise RuntimeError(f"Vektorene i {d} er bygd med {built}, men EMBEDDER gir {want} "
+                                   "– kjør src.ingest på nytt.")
+            with trace.span("load_index", backend="openai", generation=gen):
+                emb = open_vectors(vec_path)
+                self.meta_oai = metastore.load_meta(meta_path)
+                self.faiss, self.faiss_params = self._open_faiss(d / "index.faiss", emb.shape[0], emb.shape[1])
+                self.quant = quant.QuantizedVectors.open(d, n=emb.shape[0], dim=emb.shape[1])
+                self._pin_generation(gen, d)
+                self.emb = emb
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Normaliserte query-embeddings; cache-treff først, resten i ett kall til embedderen."""
+        e = self.embedder
+        if e.cache_key is None:  # type: ignore  # lokal: billigere å regne ut enn å slå opp
+            with trace.span("embed_query", n=len(queries), embedder=e.id):  # type: ignore
+                return e.embed_queries(queries)  # type: ignore
+        found, todo = embed_cache.split_cached(e.cache_key, queries)  # type: ignore
+        if todo:
+            batch = [queries[i] for i in todo]
+            with trace.span("embed_query", n=len(batch), embedder=e.id):  # type: ignore
+                got = e.embed_queries(batch)  # type: ignore
+            embed_cache.store(e.cache_key, batch, got)  # type: ignore
+            for i, v in zip(todo, got):
+                found[i] = v
+        return np.vstack([found[i] for i in range(len(queries))])
+
+    # --- søk ---
+    def _dense_candidates(self, queries: List[str], n: int, ef_search: Optional[int], nprobe: Optional[int],
+                          filters=None):
+        """
+        Topp-n per spørring fra vektorbackenden. Returnerer (meta, I, D, exact, mask) der
+        exact(r, ids) gir eksakte skårer for spørring r mot vilkårlige rader og mask
+        er radmasken for `filters` (None uten filter). Med filter skåres bare partisjonen.
+        """
+        I_parts: List[np.ndarray] = []
+        D_parts: List[np.ndarray] = []
+        if self.embedder is not None:
+            self._ensure_openai()
+            emb, index, qv = self.emb, self.faiss, self.quant
+            mask, rows = self._partition(self.meta_oai, filters)
+            if rows is not None and rows.size <= FILTER_EXACT_ROWS:
+                index = None  # liten partisjon: eksakt over radene er raskere enn FAISS med selektor
+            Q = self._embed_queries(list(queries))
+            backend = "faiss" if index is not None else (qv.kind if qv is not None else "numpy")
+            with trace.span("dense", backend=backend, n=n, rows=len(emb) if rows is None else len(rows)):  # type: ignore
+                sub = np.asarray(emb[rows]) if rows is not None and index is None and qv is None else emb  # type: ignore
+                for b in range(0, len(queries), QUERY_BLOCK):
+                    Qb = Q[b:b + QUERY_BLOCK]
+                    # Kosinus ~ dot (siden alt er normalisert); FAISS-indeksen hvis den finnes.
+                    # Tilnærmede skårer (IVF-PQ/SQ8, f16/int8) gir en bredere kandidatliste
+                    # som reskåres eksakt mot float32-radene.
+                    if index is not None:
+                        lossy = ann.lossy(self.faiss_params)
+                        m = quant.shortlist_size(n, len(emb)) if lossy else n  # type: ignore
+                        D, I = ann.search(index, self.faiss_params, Qb, m, ef_search=ef_search, nprobe=nprobe,
+                                          subset=mask)
+                        if lossy:
+                            I, D = quant.rescore(emb, Qb, I, n)  # type: ignore
+                    elif qv is not None:
+                        total = len(qv) if rows is None else len(rows)
+                        I = _topk(qv.scores(Qb, rows), quant.shortlist_size(n, total))
+                        I, D = quant.rescore(emb, Qb, I if rows is None else rows[I], n)  # type: ignore
+                    else:
+                        sims = Qb @ sub.T  # type: ignore
+                        I = _topk(sims, n)
+                        D = np.take_along_axis(sims, I, axis=1)
+                        if rows is not None:
+                            I = rows[I]
+                    I_parts.append(I)
+                    D_parts.append(D)
+            exact = lambda r, ids: np.asarray(emb[ids]) @ Q[r]  # type: ignore
+            return self.meta_oai, np.vstack(I_parts), np.vstack(D_parts), exact, mask
+
+        # TF-IDF: sparse prikkprodukt mot CSR-matrisen (radene er L2-normaliserte)
+        self._ensure_tfidf()
+        vec, mtx = self.vec, self.mtx
+        mask, rows = self._partition(self.meta_tfidf, filters)
+        sub = mtx if rows is None else self._tfidf_subset(filters, rows)
+        with trace.span("dense", backend="tfidf", n=n, rows=sub.shape[0]):  # type: ignore
+            Qs = vec.transform(list(queries))  # type: ignore
+            for b in range(0, len(queries), QUERY_BLOCK):
+                sims = (Qs[b:b + QUERY_BLOCK] @ sub.T).toarray()  # type: ignore
+                I = _topk(sims, n)
+                D_parts.append(np.take_along_axis(sims, I, axis=1))
+                I_parts.append(I if rows is None else rows[I])
+        exact = lambda r, ids: (mtx[ids] @ Qs[r].T).toarray().ravel()  # type: ignore
+        return self.meta_tfidf, np.vstack(I_parts), np.vstack(D_parts), exact, mask
 
-def _ensure_index_openai() -> None:
-    global _EMB, _META_OAI
-    if _EMB is not None and _META_OAI:
+    def _partition(self, meta: Sequence[Dict], filters) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """(radmaske, rad-id-er) for filteret; (None, None) uten filter."""
+        if not filters:
+            return None, None
+        mask = self._ensure_partitions(meta).mask(filters)
+        if mask is None:
+            return None, None
+        return mask, np.flatnonzero(mask)
+
+    def _tfidf_subset(self, filters, rows: np.ndarray):
+        """CSR-radene for partisjonen; de siste FILTER_CACHE filtrene holdes i minnet."""
+        key = (self._ensure_partitions(self.meta_tfidf).digest, partitions.normalize(filters) if isinstance(filters, dict) else filters)  # type: ignore
+        with self._load_lock:
+            hit = self._subsets.pop(key, None)
+            if hit is None:
+                hit = self.mtx[rows]  # type: ignore
+            self._subsets[key] = hit  # sist brukt bakerst
+            while len(self._subsets) > FILTER_CACHE:
+                self._subsets.pop(next(iter(self._subsets)))
+        return hit
+
+    def _side(self, meta: Sequence[Dict]) -> str:
+        """Filprefikset til radsettet: "" for vektorbackenden, "tfidf_" for TF-IDF."""
+        return "" if meta is self.meta_oai else "tfidf_"
+
+    def _meta_digest(self, meta: Sequence[Dict]) -> str:
+        """bm25.meta_digest, men beregnet én gang per lastet radsett."""
+        side = self._side(meta)
+        cached = self._digests.get(side)
+        if cached is None or cached[0] is not meta:
+            cached = self._digests[side] = (meta, bm25.meta_digest(meta))
+        return cached[1]
+
+    def _ensure_aux(self, name: str, meta: Sequence[Dict], digest: str, load, build):
+        """
+        Hjelpeindeksen `name` (bm25/keywords/partitions) for `meta`: fra generasjonen
+        (bygget ved ingest), ellers bygget i minnet. Den publiserte generasjonen
+        skrives aldri til herfra; `src.ingest` gir neste generasjon filen.
+        """
+        key = (name, self._side(meta))
+        index = self._aux.get(key)
+        if index is not None and index.digest == digest:
+            return index
+        path = self.art_dir / f"{key[1]}{name}.npz"
+        try:
+            index = load(path)
+            if index.digest != digest:
+                raise ValueError("utdatert")
+        except Exception:
+            print(f"[retrieve] {path.name} mangler eller er utdatert i {self.art_dir} – bygger i minnet")
+            index = build()
+        self._aux[key] = index
+        return index
+
+    def _ensure_bm25(self, meta: Sequence[Dict]) -> bm25.BM25Index:
+        """BM25 for radsettet `meta`."""
+        digest = self._meta_digest(meta)
+        return self._ensure_aux("bm25", meta, digest, bm25.BM25Index.load,
+                                lambda: bm25.BM25Index.build(metastore.iter_column(meta, "text"), digest=digest))
+
+    def _ensure_keywords(self, meta: Sequence[Dict]) -> rerank.KeywordIndex:
+        """Nøkkelordmatrisen for `meta`."""
+        digest = rerank.digest_for(self._meta_digest(meta))
+        return self._ensure_aux("keywords", meta, digest, rerank.KeywordIndex.load,
+                                lambda: rerank.KeywordIndex.build(meta, digest=digest))
+
+    def _ensure_partitions(self, meta: Sequence[Dict]) -> partitions.PartitionIndex:
+        """Partisjonsbitmapene for `meta`."""
+        digest = partitions.digest_for(self._meta_digest(meta))
+        return self._ensure_aux("partitions", meta, digest, partitions.PartitionIndex.load,
+                                lambda: partitions.PartitionIndex.build(meta, digest=digest))
+
+    def keyword_index(self) -> Optional[rerank.KeywordIndex]:
+        """Nøkkelordmatrisen for den lastede backenden (None hvis ingen indeks er lastet ennå)."""
+        meta = self.meta
+        return self._ensure_keywords(meta) if meta else None
+
+    def search_batch(self, queries: List[str], k: int = 6,
+                     ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                     lexical_queries: Optional[List[str]] = None, filters=None) -> List[List[Dict]]:
+        """Se modulfunksjonen `search_batch`."""
+        if self.closed:
+            raise RuntimeError("Retrieveren er lukket")
+        if not queries:
+            return []
+        queries = list(queries)
+        hybrid = self.retrieval_mode == "hybrid"
+        meta, I, D, exact, mask = self._dense_candidates(queries, max(k, HYBRID_CANDIDATES) if hybrid else k,
+                                                         ef_search, nprobe, filters)
+        if not hybrid:
+            return _hits(meta, I, D)
+
+        index = self._ensure_bm25(meta)
+        best = 2.0 / (RRF_K + 1)
+        out: List[List[Dict]] = []
+        for r, lq in enumerate(lexical_queries or queries):
+            with trace.span("bm25"):
+                lex_ids, _ = index.top(lq, HYBRID_CANDIDATES, mask)
+            fused = _rrf([I[r], lex_ids])[:k]
+            ids = np.array([i for i, _ in fused], dtype=np.int64)
+            dense = exact(r, ids) if len(ids) else []
+            row: List[Dict] = []
+            for (idx, f), ds in zip(fused, dense):
+                m = metastore.row(meta, idx)
+                m["score"] = f / best
+                m["dense_score"] = float(ds)
+                m["row"] = int(idx)
+                row.append(m)
+            out.append(row)
+        return out
+
+    def search(self, query: str, k: int = 6, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+               lexical_query: Optional[str] = None, filters=None) -> List[Dict]:
+        lex = [lexical_query] if lexical_query else None
+        return self.search_batch([query], k, ef_search=ef_search, nprobe=nprobe, lexical_queries=lex,
+                                 filters=filters)[0]
+
+# ---------- Aktiv retriever ----------
+# Én delt retriever per prosess (appen legger den i st.cache_resource).
+# install()/reload() bytter den ut atomisk: nye forespørsler får den nye,
+# mens de som allerede har en (pinned) fullfører på den gamle, som lukkes
+# når siste av dem er ferdig.
+_current: Optional[Retriever] = None
+_swap_lock = threading.Lock()
+_swapped = threading.Condition(_swap_lock)  # signaliseres av install()
+_reload_lock = threading.Lock()
+_pinned: contextvars.ContextVar[Optional[Retriever]] = contextvars.ContextVar("retriever", default=None)
+
+def current() -> Retriever:
+    """Retrieveren denne forespørselen bruker (pinned), ellers den aktive (lages ved behov)."""
+    global _current
+    r = _pinned.get()
+    if r is not None:
+        return r
+    r = _current
+    if r is None:
+        with _swap_lock:
+            if _current is None:
+                _current = Retriever()
+            r = _current
+    return r
+
+def install(r: Retriever) -> None:
+    """Gjør `r` til aktiv retriever; den forrige lukkes når pågående spørringer er ferdige."""
+    global _current
+    with _swapped:
+        old, _current = _current, r
+        _swapped.notify_all()
+    if old is not None and old is not r:
+        old.close()
+
+def reload(background: bool = False, **kwargs) -> Optional[Retriever]:
+    """
+    Last en ny retriever fra disk ved siden av den aktive og bytt den inn når
+    den er klar. background=True gjør lastingen i en egen tråd (appen), og
+    hopper over kallet hvis en omlasting allerede pågår.
+    """
+    if background:
+        threading.Thread(target=_reload_once, kwargs=kwargs, daemon=True).start()
+        return None
+    with _reload_lock:
+        return _swap_in(**kwargs)
+
+def _reload_once(**kwargs) -> None:
+    if not _reload_lock.acquire(blocking=False):
         return
-    vec_path = DATA_DIR / "vectors.npy"
-    meta_path = DATA_DIR / "meta.jsonl"
-    if not vec_path.exists() or not meta_path.exists():
-        raise FileNotFoundError("OpenAI-indeks mangler (kjør src.ingest i USE_OPENAI=true).")
-    _EMB = np.load(vec_path)
-    _META_OAI = []
-    with meta_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            _META_OAI.append(json.loads(line))
+    try:
+        _swap_in(**kwargs)
+    except Exception as e:
+        print(f"[retrieve] Omlasting feilet, beholder aktiv indeks: {e}")
+    finally:
+        _reload_lock.release()
+
+def _swap_in(**kwargs) -> Retriever:
+    new = Retriever(**kwargs).load()
+    install(new)
+    print(f"[retrieve] Generasjon {new.generation} lastet fra {new.data_dir} ({len(new.meta)} rader)")
+    return new
+
+_watcher: Optional[threading.Thread] = None
+_watch_stop = threading.Event()
+
+def watch(interval: float = INDEX_WATCH_SECS) -> None:
+    """
+    Start (én gang per prosess) en bakgrunnstråd som leser CURRENT hvert
+    `interval` sekund og laster + bytter inn ny generasjon når ingest har
+    publisert en. Spørringer venter aldri på lastingen.
+    """
+    global _watcher
+    with _swap_lock:
+        if _watcher is not None and _watcher.is_alive():
+            return
+        _watch_stop.clear()
+        _watcher = threading.Thread(target=_watch_loop, args=(interval,), name="index-watch", daemon=True)
+        _watcher.start()
+
+def unwatch() -> None:
+    """Stopp watch-tråden (tester, nedstenging)."""
+    global _watcher
+    _watch_stop.set()
+    if _watcher is not None:
+        _watcher.join()
+        _watcher = None
+
+def _watch_loop(interval: float) -> None:
+    while not _watch_stop.wait(interval):
+        r = _current
+        if r is not None and not r.closed and r.stale():
+            _reload_once(data_dir=r.data_dir, kb_dirs=r.kb_dirs, use_openai=r.use_openai,
+                         retrieval_mode=r.retrieval_mode, embedder=r._embedder)
+
+@contextmanager
+def pinned() -> Iterator[Retriever]:
+    """
+    Hold samme retriever gjennom en hel forespørsel, slik at søk og rerank
+    (radnumre i nøkkelordmatrisen) ser samme indeks selv om den byttes underveis.
+    Er den aktive lukket, ventes det (høyst PIN_WAIT_SECS) på at install() bytter inn en ny.
+    """
+    r = _pinned.get()
+    if r is not None:
+        yield r
+        return
+    while True:
+        r = current()
+        if r.acquire():
+            break
+        with _swapped:
+            if not _swapped.wait_for(lambda: _current is not r, timeout=PIN_WAIT_SECS):
+                raise RuntimeError("Retrieveren er lukket og ble ikke erstattet")
+    token = _pinned.set(r)
+    try:
+        yield r
+    finally:
+        _pinned.reset(token)
+        r.release()
 
 # ---------- Public API ----------
-def search(query: str, k: int = 6) -> List[Dict]:
+def tfidf_fingerprint() -> str:
+    return Retriever().tfidf_fingerprint()
+
+def build_tfidf(fingerprint: Optional[str] = None, rebuild: bool = False) -> None:
+    current().build_tfidf(fingerprint, rebuild)
+
+def tfidf_index(rebuild: bool = False) -> Tuple[TfidfVectorizer, sp.csr_matrix, List[Dict]]:
+    """(vectorizer, CSR-matrise, meta) for den aktive retrieveren."""
+    return current().tfidf_index(rebuild)
+
+def keyword_index() -> Optional[rerank.KeywordIndex]:
+    """Nøkkelordmatrisen for den lastede backenden (None hvis ingen indeks er lastet ennå)."""
+    return current().keyword_index()
+
+def search_batch(queries: List[str], k: int = 6,
+                 ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                 lexical_queries: Optional[List[str]] = None, filters=None) -> List[List[Dict]]:
     """
-    Returnerer topp k treff som liste av dicts:
-    { "text", "source", "title", "score", "doc_type", "version_date", "page", "chunk_idx", "id" }
+    Søk for mange spørringer samtidig: ett matriseprodukt per blokk og
+    argpartition-basert topp-k. Returnerer én treffliste per spørring
+    (samme format som `search`). `ef_search`/`nprobe` tuner HNSW/IVF-PQ-
+    indekser per kall (ignoreres for flat og TF-IDF).
+
+    Med RETRIEVAL_MODE=hybrid hentes HYBRID_CANDIDATES kandidater fra både
+    vektorbackenden og BM25 (på `lexical_queries`, f.eks. synonymutvidet),
+    og de fusjoneres med RRF. "score" blir da den normaliserte RRF-skåren
+    (1.0 = først i begge lister) og "dense_score" den eksakte likheten.
+
+    `filters` (se src.partitions) begrenser søket til radene i partisjonen,
+    f.eks. {"doc_type": ["pris"], "version_date": ("2024-01-01", None)}.
     """
-    if USE_OPENAI and _openai is not None:
-        _ensure_index_openai()
-        # Embedd spørringen
-        r = _openai.embeddings.create(model=EMBED_MODEL, input=query)
-        qvec = np.array(r.data[0].embedding, dtype="float32")
-        qvec = qvec / (np.linalg.norm(qvec) + 1e-12)
-        # Kosinus ~ dot (siden alt er normalisert)
-        sims = _EMB @ qvec  # type: ignore
-        order = np.argsort(-sims)[:k]
-        out: List[Dict] = []
-        for idx in order:
-            m = dict(_META_OAI[idx])
-            m["score"] = float(sims[idx])
-            out.append(m)
-        return out
+    with pinned() as r:
+        return r.search_batch(queries, k, ef_search=ef_search, nprobe=nprobe, lexical_queries=lexical_queries,
+                              filters=filters)
 
-    # TF-IDF (din eksisterende flyt)
-    _ensure_index_tfidf()
-    qvec = _VEC.transform([query])  # type: ignore
-    sims = linear_kernel(qvec, _MTX).ravel()  # type: ignore
-    order = np.argsort(-sims)[:k]
-    out: List[Dict] = []
-    for idx in order:
-        m = dict(_META[idx])
-        m["score"] = float(sims[idx])
-        out.append(m)
-    return out
+def search(query: str, k: int = 6, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+           lexical_query: Optional[str] = None, filters=None) -> List[Dict]:
+    """
+    Returnerer topp k treff som liste av dicts:
+    { "text", "source", "title", "score", "doc_type", "version_date", "page", "chunk_idx", "id", "row" }
+    der "row" er raden i indeksen (brukes av reranken i src.answer).
+    """
+    lex = [lexical_query] if lexical_query else None
+    return search_batch([query], k, ef_search=ef_search, nprobe=nprobe, lexical_queries=lex, filters=filters)[0]
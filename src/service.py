@@ -0,0 +1,359 @@
+"""
+Frittstående søke-/svartjeneste rundt src.retrieve og src.answer, så appen
+kan være en tynn klient (RAG_SERVICE_URL) og flere økter deler én indeks.
+
+    python -m src.service --port 8800 --workers 4
+    RAG_SERVICE_URL=http://127.0.0.1:8800 streamlit run app.py
+
+Samtidige forespørsler samles i mikrobatcher: den første venter høyst
+BATCH_WINDOW_MS på flere, og hele batchen embeddes og skåres med ett
+search_batch-kall (ett embeddings-kall og ett matriseprodukt i stedet for
+ett per spørsmål). Med --workers > 1 forker prosessen etter at porten er
+bundet, og hver arbeider laster indeksen selv; vektorer og metadata er
+minnemappet, så sidene deles via sidecachen. Nye generasjoner (src.artifacts)
+plukkes opp av retrieve.watch() i hver arbeider.
+
+Endepunkter (JSON):
+    POST /search  {"query", "k", "lexical_query"?, "filters"?}   -> {"hits"}
+    POST /answer  {"q", "k", "stream"?}              -> {"answer", "hits"} eller NDJSON-hendelser
+    GET  /health                                      -> generasjon, rader, batchstatistikk
+    GET  /metrics                                     -> Prometheus-tekst (src.trace)
+"""
+from __future__ import annotations
+import itertools
+import json
+import os
+import queue
+import signal
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src import trace
+from src.utils import lazy_import
+
+# Søk og svar lastes først i arbeiderne; klienten (appen) trenger dem ikke
+answer = lazy_import("src.answer")
+retrieve = lazy_import("src.retrieve")
+partitions = lazy_import("src.partitions")
+
+# --- Konfig ---
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8800"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "1"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "5"))  # 0 = ingen mikrobatching
+BATCH_MAX = int(os.getenv("BATCH_MAX", "64"))
+CLIENT_TIMEOUT = float(os.getenv("RAG_SERVICE_TIMEOUT", "60"))
+
+
+class MicroBatcher:
+    """
+    Samler søk fra mange tråder til search_batch-kall. search() blokkerer til
+    batchen den havnet i er ferdig. Søk mot ulike retrievere (under et bytte)
+    havner i hver sin gruppe, så hvert søk går mot indeksen forespørselen har festet;
+    det samme gjelder søk med ulike filtre (se src.partitions).
+    """
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX):
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.queries = 0
+        self.largest = 0
+        self._q: "queue.Queue[Optional[Tuple]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batch", daemon=True)
+        self._thread.start()
+
+    def search(self, r, query: str, k: int, lexical_query: Optional[str] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
+        fut: Future = Future()
+        self._q.put((r, query, k, lexical_query, fut, filters))
+        return fut.result()
+
+    def stats(self) -> Dict:
+        return {"batches": self.batches, "queries": self.queries, "largest": self.largest,
+                "mean": round(self.queries / self.batches, 2) if self.batches else 0.0}
+
+    def close(self) -> None:
+        self._q.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    # det som allerede står i køen tas med uansett; ellers vent ut vinduet
+                    nxt = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._q.put(None)
+                    break
+                batch.append(nxt)
+            try:
+                self._dispatch(batch)
+            except Exception as e:  # en feilende batch skal aldri stoppe tråden
+                print(f"[service] Mikrobatch feilet: {e}")
+                for it in batch:
+                    if not it[4].done():
+                        it[4].set_exception(e)
+
+    def _dispatch(self, batch: List[Tuple]) -> None:
+        groups: Dict[Tuple, List[Tuple]] = {}
+        for item in batch:
+            try:
+                key = (id(item[0]), partitions.normalize(item[5]))
+            except Exception as e:
+                item[4].set_exception(e)
+                continue
+            groups.setdefault(key, []).append(item)
+        for items in groups.values():
+            r, filters = items[0][0], items[0][5]
+            queries = [it[1] for it in items]
+            lexical = [it[3] or it[1] for it in items] if any(it[3] for it in items) else None
+            kw = {"filters": filters} if filters else {}
+            try:
+                with trace.span("search_batch", n=len(items)):
+                    results = r.search_batch(queries, max(it[2] for it in items), lexical_queries=lexical, **kw)
+            except Exception as e:
+                for it in items:
+                    it[4].set_exception(e)
+                continue
+            for it, hits in zip(items, results):
+                it[4].set_result(hits[:it[2]])  # topp-k er et prefiks av topp-max(k)
+        self.batches += len(groups)
+        self.queries += len(batch)
+        self.largest = max(self.largest, len(batch))
+        trace.observe("batch_size", len(batch))
+
+
+def _jsonable(hits) -> List[Dict]:
+    return [dict(h) for h in hits]
+
+
+def _handler(batcher: Optional[MicroBatcher]):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # stille
+            pass
+
+        def _send(self, status: int, payload, content_type: str = "application/json") -> None:
+            raw = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/health":
+                r = retrieve.current()
+                self._send(200, {"status": "ok", "pid": os.getpid(), "generation": r.generation,
+                                 "rows": len(r.meta), "batching": batcher.stats() if batcher else None})
+            elif path == "/metrics":
+                self._send(200, trace.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self._send(404, {"error": f"ukjent sti {self.path}"})
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(n) or b"{}")
+            except ValueError:
+                self._send(400, {"error": "ugyldig JSON"})
+                return
+            path = self.path.split("?")[0]
+            try:
+                if path == "/search":
+                    self._search(body)
+                elif path == "/answer":
+                    self._answer(body)
+                else:
+                    self._send(404, {"error": f"ukjent sti {self.path}"})
+            except Exception as e:
+                print(f"[service] Feil i {path}: {e}")
+                self._send(500, {"error": str(e)})
+
+        def _search(self, body: Dict) -> None:
+            q = str(body.get("query") or "")
+            k = int(body.get("k") or 6)
+            try:
+                partitions.normalize(body.get("filters"))
+            except (TypeError, ValueError) as e:
+                self._send(400, {"error": f"ugyldig filter: {e}"})
+                return
+            with retrieve.pinned() as r:
+                if batcher is not None:
+                    hits = batcher.search(r, q, k, body.get("lexical_query"), body.get("filters"))
+                else:
+                    hits = r.search(q, k, lexical_query=body.get("lexical_query"), filters=body.get("filters"))
+                self._send(200, {"hits": _jsonable(hits)})
+
+        def _answer(self, body: Dict) -> None:
+            q = str(body.get("q") or "")
+            k = int(body.get("k") or 6)
+            if not body.get("stream"):
+                out, hits = answer.answer(q, k=k)
+                self._send(200, {"answer": out, "hits": _jsonable(hits)})
+                return
+            # NDJSON, én hendelse per linje (samme som answer_stream), chunked.
+            # Første hendelse (treffene) hentes før statuslinjen, så søkefeil blir 500.
+            # Feil etter det (f.eks. LLM-en) sendes som en "error"-hendelse og strømmen
+            # avsluttes riktig; en ny statuslinje midt i kroppen ville ødelagt den.
+            events = answer.answer_stream(q, k=k)
+            first = next(events)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for ev, val in itertools.chain([first], events):
+                    if ev == "hits":
+                        val = _jsonable(val)
+                    self._event(ev, val)
+            except Exception as e:
+                print(f"[service] Feil i strømmet svar: {e}")
+                try:
+                    self._event("error", str(e))
+                except OSError:
+                    return  # klienten er borte
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _event(self, ev: str, val) -> None:
+            self._chunk((json.dumps({"event": ev, "value": val}, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    return Handler
+
+
+def _prepare_worker(window_ms: float) -> Optional[MicroBatcher]:
+    """Last indeksen, start watch og mikrobatcheren i denne prosessen."""
+    r = retrieve.Retriever().load()
+    retrieve.install(r)
+    retrieve.watch()
+    batcher = MicroBatcher(window_ms) if window_ms > 0 else None
+    answer.use_batcher(batcher)
+    print(f"[service] pid {os.getpid()}: generasjon {r.generation} ({len(r.meta)} rader), "
+          f"mikrobatch {window_ms:g} ms")
+    return batcher
+
+
+def start(port: int = 0, host: str = "127.0.0.1", window_ms: float = BATCH_WINDOW_MS
+          ) -> Tuple[ThreadingHTTPServer, str]:
+    """Start tjenesten i en bakgrunnstråd i denne prosessen (tester). Returnerer (server, base_url)."""
+    batcher = _prepare_worker(window_ms)
+    server = ThreadingHTTPServer((host, port), _handler(batcher))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def serve(port: int = SERVICE_PORT, host: str = SERVICE_HOST, workers: int = SERVICE_WORKERS,
+          window_ms: float = BATCH_WINDOW_MS) -> None:
+    """
+    Kjør tjenesten i forgrunnen. Porten bindes før fork, så alle arbeiderne
+    aksepterer fra samme lyttesokkel; indeksen lastes etter fork (tråder og
+    minnemappinger arves ikke pent).
+    """
+    server = ThreadingHTTPServer((host, port), None)  # handler settes i arbeideren
+    server.daemon_threads = True
+    url = f"http://{host}:{server.server_address[1]}"
+    if workers <= 1 or not hasattr(os, "fork"):
+        server.RequestHandlerClass = _handler(_prepare_worker(window_ms))
+        print(f"[service] lytter på {url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    pids: List[int] = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                server.RequestHandlerClass = _handler(_prepare_worker(window_ms))
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    server.socket.close()
+    print(f"[service] lytter på {url} med {workers} arbeidere")
+
+    def _stop(*_):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    # SIGTERM til forelderen (supervisor, lasttesten) stopper også arbeiderne
+    signal.signal(signal.SIGTERM, lambda *a: (_stop(), os._exit(0)))
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        _stop()
+
+
+class Client:
+    """Tynn HTTP-klient med samme grensesnitt som src.answer (answer/answer_stream) og search."""
+
+    def __init__(self, url: str, timeout: float = CLIENT_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, path: str, payload: Dict):
+        req = urllib.request.Request(self.url + path, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def search(self, query: str, k: int = 6, lexical_query: Optional[str] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
+        with self._post("/search", {"query": query, "k": k, "lexical_query": lexical_query,
+                                    "filters": filters}) as resp:
+            return json.loads(resp.read())["hits"]
+
+    def answer(self, q: str, k: int = 6) -> Tuple[str, List[Dict]]:
+        with self._post("/answer", {"q": q, "k": k}) as resp:
+            data = json.loads(resp.read())
+        return data["answer"], data["hits"]
+
+    def answer_stream(self, q: str, k: int = 6) -> Iterator[Tuple[str, object]]:
+        with self._post("/answer", {"q": q, "k": k, "stream": True}) as resp:
+            for line in resp:
+                if line.strip():
+                    ev = json.loads(line)
+                    if ev["event"] == "error":  # feilet etter at strømmen startet (som i prosess: unntak)
+                        raise RuntimeError(ev["value"])
+                    yield ev["event"], ev["value"]
+
+    def health(self) -> Dict:
+        with urllib.request.urlopen(self.url + "/health", timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Søke-/svartjeneste med mikrobatching over én delt indeks.")
+    ap.add_argument("--host", default=SERVICE_HOST)
+    ap.add_argument("--port", type=int, default=SERVICE_PORT)
+    ap.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    ap.add_argument("--window-ms", type=float, default=BATCH_WINDOW_MS, help="0 slår av mikrobatching")
+    args = ap.parse_args()
+    serve(args.port, args.host, args.workers, args.window_ms)
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import os
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+# Felles konfig, løst én gang per prosess: miljøvariabler (inkl. .env) først,
+# deretter Streamlit Secrets. st.secrets brukes bare når appen allerede har
+# importert streamlit; ellers leses .streamlit/secrets.toml direkte, så CLI,
+# tester og arbeidere slipper å importere streamlit for å finne en nøkkel.
+# OpenAI-klienten (og dermed openai-pakken) lages først ved første bruk.
+
+try:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+except ImportError:
+    pass
+
+SECRETS_FILES = (Path.home() / ".streamlit" / "secrets.toml", Path(".streamlit") / "secrets.toml")
+
+
+def _file_secrets() -> dict:
+    out: dict = {}
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        return out
+    for p in SECRETS_FILES:
+        try:
+            with p.open("rb") as f:
+                out.update(tomllib.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def _secret(name: str, secrets) -> Optional[str]:
+    """ENV først (CI setter ofte env direkte), så secrets; tomme verdier teller som mangler."""
+    val = os.getenv(name)
+    if val is None:
+        try:
+            val = secrets[name]  # st.secrets kan kaste KeyError/StreamlitSecretNotFoundError
+        except Exception:
+            return None
+    val = str(val).strip()
+    return val or None
+
+
+def _flag(val: Optional[str], default: bool) -> bool:
+    if val is None:
+        return default
+    return val.lower() in {"1", "true", "yes", "on"}
+
+
+@dataclass(frozen=True)
+class Settings:
+    use_openai: bool = False
+    ingest_use_openai: bool = True  # samme USE_OPENAI, men src.ingest bygger vektorer når den mangler
+    openai_api_key: Optional[str] = None
+    openai_project: Optional[str] = None  # valgfri (for sk-proj-… nøkler)
+    chat_model: str = "gpt-4o-mini"
+    embed_model: str = "text-embedding-3-small"
+    embedder: str = "openai"  # EMBEDDER: openai | hashing | onnx (se src.embedders)
+    data_dir: Path = Path("data")
+    kb_dir: str = "kb"
+    retrieval_mode: str = "dense"
+    service_url: Optional[str] = None  # RAG_SERVICE_URL: appen blir tynn klient mot src.service
+    debug_panel: bool = False  # DEBUG_PANEL: tidsbruk per steg i appen (slår på sporingen)
+
+    @classmethod
+    def resolve(cls) -> "Settings":
+        st = sys.modules.get("streamlit")
+        secrets = st.secrets if st is not None else _file_secrets()
+        get = lambda name: _secret(name, secrets)  # noqa: E731
+        return cls(
+            use_openai=_flag(get("USE_OPENAI"), False),
+            ingest_use_openai=_flag(get("USE_OPENAI"), True),
+            openai_api_key=get("OPENAI_API_KEY"),
+            openai_project=get("OPENAI_PROJECT"),
+            chat_model=get("CHAT_MODEL") or cls.chat_model,
+            embed_model=get("EMBED_MODEL") or cls.embed_model,
+            embedder=(get("EMBEDDER") or cls.embedder).lower(),
+            data_dir=Path(get("DATA_DIR") or "data"),
+            kb_dir=get("KB_DIR") or cls.kb_dir,
+            retrieval_mode=(get("RETRIEVAL_MODE") or cls.retrieval_mode).lower(),
+            service_url=get("RAG_SERVICE_URL"),
+            debug_panel=_flag(get("DEBUG_PANEL"), False),
+        )
+
+
+@lru_cache(maxsize=1)
+def get() -> Settings:
+    return Settings.resolve()
+
+
+@lru_cache(maxsize=1)
+def openai_client():
+    """Delt OpenAI-klient, laget ved første kall. None uten nøkkel eller openai-pakke."""
+    s = get()
+    if not s.openai_api_key:
+        return None
+    try:
+        from openai import OpenAI
+
+        return OpenAI(api_key=s.openai_api_key, project=s.openai_project)
+    except Exception as e:
+        print(f"[settings] Kunne ikke lage OpenAI-klient: {e}")
+        return None
+
+
+def reload() -> Settings:
+    """Løs konfig på nytt (tester, eller etter at secrets er endret)."""
+    get.cache_clear()
+    openai_client.cache_clear()
+    return get()
@@ -0,0 +1,290 @@
+from __future__ import annotations
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from src.utils import env_flag
+
+# Lett sporing av svar-pipelinen: spenn (tid per steg), tellere (cache-treff,
+# LLM-tokens) og observasjoner (størrelse på kandidatpoolen). Avslått er
+# span()/count()/observe() bare et flaggsjekk og returnerer et felles no-op-
+# objekt, så det kan stå på i produksjon. Påslått aggregeres alt i prosessen
+# (Prometheus-tekst via prometheus_text()/serve()) og hver ferdige trace kan
+# logges som én JSON-linje.
+
+# --- Konfig ---
+TRACE_ENABLED = env_flag("TRACE", False)
+TRACE_LOG = os.getenv("TRACE_LOG", "")  # sti til JSONL-logg, eller "stdout"
+TRACE_PORT = int(os.getenv("TRACE_PORT", "0"))  # >0: /metrics på denne porten
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "50"))  # siste traces i minnet (debugpanelet)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_hist: Dict[str, List[float]] = {}  # steg -> [antall per bøtte..., +Inf, sum]
+_counters: Dict[Tuple[str, Labels], float] = {}
+_observed: Dict[str, List[float]] = {}  # navn -> [antall, sum, maks]
+_recent: Deque[Dict] = deque(maxlen=TRACE_KEEP)
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("rag_trace", default=None)
+_server = None
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NOOP = _Noop()
+
+
+def enabled() -> bool:
+    return TRACE_ENABLED
+
+
+def enable(on: bool = True) -> None:
+    global TRACE_ENABLED
+    TRACE_ENABLED = on
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _record(stage: str, seconds: float) -> None:
+    with _lock:
+        h = _hist.get(stage)
+        if h is None:
+            h = _hist[stage] = [0.0] * (len(BUCKETS) + 2)
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                h[i] += 1
+                break
+        else:
+            h[len(BUCKETS)] += 1
+        h[-1] += seconds
+
+
+class Span:
+    """Måler ett steg; legges både i aggregatet og i aktiv trace."""
+
+    __slots__ = ("name", "attrs", "_t0")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> "Span":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        dur = time.perf_counter() - self._t0
+        _record(self.name, dur)
+        tr = _current.get()
+        if tr is not None:
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            tr.spans.append({"name": self.name, "start_ms": round((self._t0 - tr.t0) * 1000, 3),
+                             "ms": round(dur * 1000, 3), **self.attrs})
+        return False
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+
+class Trace(Span):
+    """Rotspenn for én forespørsel; samler spenn, tellere og observasjoner."""
+
+    __slots__ = ("t0", "started", "spans", "counters", "_token")
+
+    def __init__(self, name: str, attrs: Dict):
+        super().__init__(name, attrs)
+        self.spans: List[Dict] = []
+        self.counters: Dict[str, float] = {}
+
+    def __enter__(self) -> "Trace":
+        self.started = time.time()
+        self._token = _current.set(self)
+        super().__enter__()
+        self.t0 = self._t0
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        dur = time.perf_counter() - self._t0
+        try:
+            _current.reset(self._token)
+        except ValueError:  # avsluttet fra en annen kontekst (f.eks. forlatt generator)
+            _current.set(None)
+        _record(self.name, dur)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _finish(self.to_dict(dur))
+        return False
+
+    def to_dict(self, dur: float) -> Dict:
+        return {"trace": self.name, "ts": round(self.started, 3), "ms": round(dur * 1000, 3),
+                **self.attrs, "counters": self.counters, "spans": self.spans}
+
+
+def _finish(record: Dict) -> None:
+    with _lock:
+        _recent.append(record)
+    if not TRACE_LOG:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    if TRACE_LOG == "stdout":
+        print(f"[trace] {line}")
+        return
+    try:
+        with _lock, Path(TRACE_LOG).open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"[trace] Kunne ikke skrive {TRACE_LOG}: {e}")
+
+
+# ---------- API ----------
+def trace(name: str, **attrs):
+    """Start en trace (rotspenn) for én forespørsel."""
+    if not TRACE_ENABLED:
+        return _NOOP
+    return Trace(name, attrs)
+
+
+def span(name: str, **attrs):
+    """Mål ett steg: `with trace.span("search"): ...`."""
+    if not TRACE_ENABLED:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def count(name: str, n: float = 1, **labels) -> None:
+    """Øk en teller, f.eks. count("cache", cache="answer", result="hit")."""
+    if not TRACE_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+    tr = _current.get()
+    if tr is not None:
+        tkey = name + "".join(f".{v}" for _, v in key[1])
+        tr.counters[tkey] = tr.counters.get(tkey, 0) + n
+
+
+def observe(name: str, value: float) -> None:
+    """Registrer en størrelse, f.eks. observe("candidates", len(raw))."""
+    if not TRACE_ENABLED:
+        return
+    with _lock:
+        o = _observed.get(name)
+        if o is None:
+            o = _observed[name] = [0.0, 0.0, float("-inf")]
+        o[0] += 1
+        o[1] += value
+        o[2] = max(o[2], value)
+    tr = _current.get()
+    if tr is not None:
+        tr.attrs[name] = value
+
+
+def recent(n: int = 1) -> List[Dict]:
+    """De n siste fullførte tracene (nyeste sist)."""
+    with _lock:
+        return list(_recent)[-n:]
+
+
+def snapshot() -> Dict:
+    """Aggregatene som dict: steg (antall/snitt), tellere, cache-treffrate og observasjoner."""
+    with _lock:
+        stages = {k: {"count": int(sum(h[:-1])), "avg_ms": round(1000 * h[-1] / max(1, sum(h[:-1])), 3)}
+                  for k, h in _hist.items()}
+        counters = {k[0] + "".join(f"{{{a}={b}}}" for a, b in k[1]): v for k, v in _counters.items()}
+        hit_rates: Dict[str, float] = {}
+        for (name, labels), v in _counters.items():
+            lab = dict(labels)
+            if name == "cache" and lab.get("result") == "hit":
+                miss = _counters.get((name, _labels({**lab, "result": "miss"})), 0)
+                hit_rates[lab.get("cache", "?")] = v / (v + miss) if v + miss else 0.0
+        observed = {k: {"count": int(o[0]), "avg": o[1] / o[0] if o[0] else 0.0, "max": o[2]}
+                    for k, o in _observed.items()}
+    return {"stages": stages, "counters": counters, "cache_hit_rate": hit_rates, "observed": observed}
+
+
+def prometheus_text() -> str:
+    """Aggregatene i Prometheus' tekstformat (for /metrics)."""
+    out: List[str] = []
+    with _lock:
+        out.append("# TYPE rag_stage_seconds histogram")
+        for stage, h in sorted(_hist.items()):
+            acc = 0.0
+            for b, c in zip(list(BUCKETS) + ["+Inf"], h[:-1]):
+                acc += c
+                out.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{b}"}} {acc:g}')
+            out.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {h[-1]:.6f}')
+            out.append(f'rag_stage_seconds_count{{stage="{stage}"}} {acc:g}')
+        for name in sorted({k[0] for k in _counters}):
+            out.append(f"# TYPE rag_{name}_total counter")
+            for (n, labels), v in sorted(_counters.items()):
+                if n == name:
+                    lab = ",".join(f'{a}="{b}"' for a, b in labels)
+                    out.append(f"rag_{name}_total{{{lab}}} {v:g}" if lab else f"rag_{name}_total {v:g}")
+        for name, o in sorted(_observed.items()):
+            out.append(f"# TYPE rag_{name} summary")
+            out.append(f"rag_{name}_sum {o[1]:g}")
+            out.append(f"rag_{name}_count {o[0]:g}")
+    return "\n".join(out) + "\n"
+
+
+def serve(port: int = TRACE_PORT, host: str = "127.0.0.1"):
+    """Start /metrics i en bakgrunnstråd (én gang per prosess). Returnerer serveren."""
+    global _server
+    if _server is not None or port <= 0:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        _server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"[trace] Kunne ikke starte /metrics på port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"[trace] Prometheus-metrikker på http://{host}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def reset() -> None:
+    """Nullstill aggregatene (tester)."""
+    with _lock:
+        _hist.clear()
+        _counters.clear()
+        _observed.clear()
+        _recent.clear()
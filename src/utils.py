@@ -1,9 +1,13 @@
 from __future__ import annotations
+import importlib
 import os
+import tempfile
 from pathlib import Path
 from typing import Dict, List
 from datetime import datetime
 
+import numpy as np
+
 def _read_text_file(p: Path) -> str:
     try:
         return p.read_text(encoding="utf-8")
@@ -27,24 +31,68 @@ def read_markdown_files(kb_dir: str) -> List[Dict]:
     return out
 
 def simple_chunks(text: str, size: int = 800, overlap: int = 120) -> List[str]:
+    """Bakoverkompatibel inngang til den felles chunkeren (size/overlap i tokens)."""
     if size <= 0:
         return [text]
-    toks = text.split()
-    if not toks:
-        return []
-    out: List[str] = []
-    i = 0
-    while i < len(toks):
-        chunk = " ".join(toks[i:i+size]).strip()
-        if chunk:
-            out.append(chunk)
-        if i + size >= len(toks):
-            break
-        i += max(1, size - overlap)
-    return out
+    from src.chunking import split_text
+
+    return split_text(text, max_tokens=size, overlap_tokens=overlap)
+
+class LazyModule:
+    """
+    Stedfortreder for en tung modul (scipy, pyarrow, sklearn …): selve
+    importen skjer ved første attributtoppslag, ikke når src-modulen lastes.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._mod = None
+
+    def __getattr__(self, attr: str):
+        mod = self._mod
+        if mod is None:
+            mod = self._mod = importlib.import_module(self._name)
+        return getattr(mod, attr)
+
+    def __repr__(self) -> str:
+        state = "lastet" if self._mod is not None else "ikke lastet"
+        return f"<LazyModule {self._name} ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+def optional_import(name: str):
+    """Importer en valgfri modul (f.eks. src.ann som krever faiss); None hvis den mangler."""
+    try:
+        return importlib.import_module(name)
+    except Exception:
+        return None
 
 def env_flag(name: str, default: bool = False) -> bool:
     v = os.getenv(name)
     if v is None:
         return default
     return v.strip().lower() in {"1", "true", "yes", "on"}
+
+def unique_tmp(path: Path) -> Path:
+    """Tom .tmp-fil ved siden av `path` med unikt navn, så samtidige skrivere ikke deler fil før os.replace."""
+    path = Path(path)
+    fd, name = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    os.close(fd)
+    return Path(name)
+
+def open_vectors(path: Path) -> np.ndarray:
+    """
+    Åpne vectors.npy minnemappet (mmap_mode="r") slik at OS-ets page cache deles
+    mellom prosesser. Ingest skriver alltid normalisert, C-sammenhengende
+    float32; bare eldre artefakter som ikke oppfyller det kopieres og normaliseres.
+    """
+    X = np.load(path, mmap_mode="r")
+    if X.dtype == np.float32 and X.ndim == 2 and X.flags.c_contiguous:
+        sample = np.asarray(X[: min(len(X), 256)])
+        norms = np.linalg.norm(sample, axis=1)
+        if sample.size == 0 or np.allclose(norms[norms > 0], 1.0, atol=1e-3):
+            return X
+    X = np.array(X, dtype="float32", order="C")
+    X /= np.linalg.norm(X, axis=1, keepdims=True) + 1e-12
+    return X
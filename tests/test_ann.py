@@ -0,0 +1,31 @@
+import numpy as np
+
+from src import ann
+
+
+def _data(n=2000, dim=32):
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(n, dim)).astype("float32")
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+def test_index_kinds_roundtrip_with_params(tmp_path, monkeypatch):
+    monkeypatch.setattr(ann, "PQ_M", 16)
+    X = _data()
+    flat, fp = ann.build(X, "flat")
+    _, truth = flat.search(X[:20], 10)
+    for kind in ("hnsw", "ivfpq", "sq8"):
+        index, params = ann.build(X, kind)
+        ann.write(index, params, tmp_path / f"{kind}.faiss")
+        loaded, lp = ann.read(tmp_path / f"{kind}.faiss")
+        assert lp["kind"] == kind and lp["n"] == len(X)
+        wide = {"hnsw": {"ef_search": 256}, "ivfpq": {"nprobe": lp.get("nlist")}}.get(kind, {})
+        _, I = ann.search(loaded, lp, X[:20], 10, **wide)
+        recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(I, truth)])
+        assert recall > (0.6 if kind == "ivfpq" else 0.9)
+        assert ann.lossy(lp) == (kind != "hnsw")
+
+
+def test_ivfpq_falls_back_to_flat_on_small_corpus():
+    _, params = ann.build(_data(n=100), "ivfpq")
+    assert params["kind"] == "flat"
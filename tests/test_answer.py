@@ -0,0 +1,97 @@
+from src import answer as ans
+from src.answer_cache import ResultCache
+
+
+def test_answer_cache_hits_and_invalidates_on_rebuild(tmp_path, monkeypatch):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "meta.jsonl").write_text("v1", encoding="utf-8")
+    calls = []
+
+    def fake_search(q, k, filters=None):
+        calls.append(q)
+        return [{"text": "Timepris er 300 kroner. Mer tekst.", "score": 0.9, "doc_type": "pris", "id": "p#0"}]
+
+    monkeypatch.setattr(ans, "search", fake_search)
+    monkeypatch.setattr(ans, "_cache", ResultCache(disk_path=tmp_path / "answers.sqlite", data_dir=data))
+
+    first = ans.answer("Hva koster banebooking?", k=3)
+    per_answer = len(calls)  # pris-partisjonen først, så resten av indeksen (for få treff)
+    assert ans.answer("  hva koster   banebooking ", k=3) == first
+    assert len(calls) == per_answer
+    ans.answer("Hva koster banebooking?", k=4)
+    assert len(calls) == 2 * per_answer
+
+    # ny worker med tom minnecache deler disk-nivået
+    monkeypatch.setattr(ans, "_cache", ResultCache(disk_path=tmp_path / "answers.sqlite", data_dir=data))
+    assert ans.answer("hva koster banebooking", k=3) == first
+    assert len(calls) == 2 * per_answer
+
+    (data / "meta.jsonl").write_text("v2 – ny indeks", encoding="utf-8")
+    ans.answer("hva koster banebooking", k=3)
+    assert len(calls) == 3 * per_answer
+
+
+class _StreamingChat:
+    def __init__(self, parts, fail_after=None):
+        self.parts, self.fail_after = parts, fail_after
+
+    def create(self, **kwargs):
+        from types import SimpleNamespace as NS
+        assert kwargs.get("stream") is True
+        for i, p in enumerate(self.parts):
+            if i == self.fail_after:
+                raise ConnectionError("strømmen brøt")
+            yield NS(choices=[NS(delta=NS(content=p))])
+
+
+def _stream_setup(monkeypatch, chat):
+    from types import SimpleNamespace as NS
+
+    hit = {"text": "Timepris er 300 kroner. Mer tekst.", "score": 0.9, "doc_type": "pris", "id": "p#0"}
+    monkeypatch.setattr(ans, "search", lambda q, k, filters=None: [hit])
+    monkeypatch.setattr(ans, "_cache", None)
+    monkeypatch.setattr(ans, "USE_OPENAI", True)
+    monkeypatch.setattr(ans, "_openai", NS(chat=NS(completions=chat)))
+
+
+def test_answer_stream_yields_hits_then_tokens(monkeypatch):
+    _stream_setup(monkeypatch, _StreamingChat(["Det ", "koster ", "300 kr."]))
+    events = list(ans.answer_stream("hva koster det?", k=3))
+    assert events[0][0] == "hits" and events[0][1][0]["id"] == "p#0"
+    assert [v for e, v in events if e == "token"] == ["Det ", "koster ", "300 kr."]
+    assert events[-1] == ("done", "Det koster 300 kr.")
+
+
+def test_answer_stream_falls_back_to_extractive_midway(monkeypatch):
+    _stream_setup(monkeypatch, _StreamingChat(["Det ", "koster ", "300 kr."], fail_after=2))
+    events = list(ans.answer_stream("hva koster det?", k=3))
+    assert ("reset", "Timepris er 300 kroner.") in events
+    assert events[-1] == ("done", "Timepris er 300 kroner.")
+
+
+def test_vectorized_rerank_bonus_matches_text_scan():
+    import numpy as np
+    from src.rerank import KeywordIndex, SYN, bonus_from_texts
+
+    meta = [
+        {"text": "Banebooking skjer i Matchi. Timepris 300.", "doc_type": "pris"},
+        {"text": "Book bane på kveld og i helg.", "doc_type": "booking"},
+        {"text": "Sommerleir for barn.", "doc_type": None},
+    ]
+    kw = KeywordIndex.build(meta)
+    rows = np.array([2, 0, 1])
+    hits = [meta[i] for i in rows]
+    for keys, preferred in [(SYN["booking"], {"booking"}), (SYN["pris"] + SYN["tid"], {"pris"}), ([], set())]:
+        np.testing.assert_allclose(kw.bonus(rows, keys, preferred), bonus_from_texts(hits, keys, preferred))
+
+
+def test_rerank_orders_and_thresholds(monkeypatch):
+    monkeypatch.setattr(ans, "keyword_index", lambda: None)
+    hits = [
+        {"text": "noe annet", "score": 0.30, "doc_type": None},
+        {"text": "timepris og avgift", "score": 0.20, "doc_type": "pris"},
+        {"text": "lite relevant", "score": 0.05, "doc_type": None},
+    ]
+    out = ans._rerank(hits, {"pris"}, ["avgift", "timepris"], k=5)
+    assert [h["text"] for h in out] == ["timepris og avgift", "noe annet"]
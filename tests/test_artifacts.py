@@ -0,0 +1,47 @@
+from src import artifacts
+
+
+def _publish(data, files, **kw):
+    out = artifacts.stage(data)
+    for name, text in files.items():
+        (out / name).write_text(text, encoding="utf-8")
+    return artifacts.publish(data, out, **kw)
+
+
+def test_publish_switches_pointer_and_inherits_untouched_files(tmp_path):
+    data = tmp_path / "data"
+    assert artifacts.current_dir(data) == data  # flatt oppsett uten peker
+
+    g1 = _publish(data, {"tfidf.npz": "a", "vectors.npy": "v1"})
+    assert artifacts.current_id(data) == g1
+    assert (artifacts.current_dir(data) / "vectors.npy").read_text() == "v1"
+
+    g2 = _publish(data, {"vectors.npy": "v2"}, inherit=artifacts.TFIDF_FILES, backend="openai")
+    d = artifacts.current_dir(data)
+    assert artifacts.current_id(data) == g2 and d.name == g2
+    assert (d / "tfidf.npz").read_text() == "a" and (d / "vectors.npy").read_text() == "v2"
+    assert artifacts.info(data)["backend"] == "openai"
+    assert (data / "vectors.npy").read_text() == "v2"  # toppnivået speiles
+    # forrige generasjon er urørt, så lesere av den ser et helt sett
+    assert (data / artifacts.GENERATIONS / g1 / "vectors.npy").read_text() == "v1"
+    assert not list(data.glob("*.tmp"))
+
+
+def test_mirror_drops_files_missing_from_new_generation(tmp_path):
+    data = tmp_path / "data"
+    _publish(data, {"vectors.npy": "v1", "index.faiss": "hnsw"})
+    assert (data / "index.faiss").exists()
+    _publish(data, {"vectors.npy": "v2"}, inherit=False)  # f.eks. flat-bygg uten index.faiss
+    assert not (data / "index.faiss").exists() and (data / "vectors.npy").read_text() == "v2"
+
+
+def test_prune_keeps_newest_generations(tmp_path):
+    data = tmp_path / "data"
+    gens = [_publish(data, {"vectors.npy": str(i)}) for i in range(5)]
+    assert artifacts.generations(data) == gens[-artifacts.ARTIFACT_KEEP:]
+    artifacts.prune(data, keep=1)
+    assert artifacts.generations(data) == [gens[-1]]
+
+    half = artifacts.stage(data)  # pågående bygg ryddes ikke
+    artifacts.prune(data, keep=1)
+    assert half.exists()
@@ -0,0 +1,31 @@
+import unicodedata
+from pathlib import Path
+
+from src import bench
+
+
+def test_golden_set_points_at_files_in_kb():
+    names = {unicodedata.normalize("NFC", p.name) for p in Path("kb").iterdir()}
+    golden = bench.load_golden()
+    assert len(golden) >= 20 and len({g["id"] for g in golden}) == len(golden)
+    for g in golden:
+        assert g["expected"] and set(g["expected"]) <= names, g["id"]
+
+
+def test_run_reports_latency_and_quality(tmp_path):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "booking.md").write_text("# Banebooking\nBook bane i Matchi-appen.", encoding="utf-8")
+    (kb / "leir.md").write_text("# Sommerleir\nSommerleir for barn i juli.", encoding="utf-8")
+    golden = [{"id": "a", "query": "Hvordan booker jeg bane i Matchi?", "expected": ["booking.md"]},
+              {"id": "b", "query": "Når er sommerleiren for barn?", "expected": ["leir.md"]}]
+
+    report = bench.run("tfidf", kb, k=2, repeat=2, golden=golden, data_dir=tmp_path / "data")
+    assert report["search_recall@2"] == 1.0 and report["search_mrr"] == 1.0
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"]
+    assert report["qps"] > 0 and report["build_s"] > 0 and report["meta"]["chunks"] == 2
+
+    out = bench.save(report, tmp_path / "r.json")
+    assert out.exists()
+    worse = dict(report, per_query=[dict(q, rank=None) for q in report["per_query"]])
+    assert any("rang" in line for line in bench.compare(report, worse))
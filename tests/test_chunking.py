@@ -0,0 +1,70 @@
+from src import artifacts, chunking
+
+
+def test_split_text_respects_budget_sections_and_overlap():
+    text = ("# Priser\n" + " ".join(f"Setning nummer {i} om timepris." for i in range(12)) +
+            "\n\n# Booking\nBook bane i Matchi.\n")
+    chunks = chunking.split_text(text, max_tokens=30, overlap_tokens=8)
+    assert all(chunking.count_tokens(c) <= 30 for c in chunks)
+    assert all(c.startswith("Priser ") for c in chunks[:-1])  # overskriften følger fortsettelsene
+    assert chunks[-1] == "Booking Book bane i Matchi."  # ny seksjon -> ny bit
+    assert "Setning nummer 3" in chunks[0] and "Setning nummer 3" in chunks[1]  # overlapp
+
+
+def _build(kb, data, rebuild=False):
+    out = artifacts.stage(data)
+    store = chunking.ensure_store([kb], data, out, rebuild=rebuild)
+    artifacts.publish(data, out)
+    return store
+
+
+def test_store_rechunks_only_changed_files(tmp_path, monkeypatch):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "a.md").write_text("# A\nBanebooking skjer i Matchi.", encoding="utf-8")
+    (kb / "b.md").write_text("# B\nTimepris er 300 kroner.", encoding="utf-8")
+    data = tmp_path / "data"
+
+    parsed = []
+    real = chunking.chunk_file
+    monkeypatch.setattr(chunking, "chunk_file", lambda p, pages, *a: parsed.append(p.name) or real(p, pages, *a))
+
+    first = _build(kb, data)
+    assert parsed == ["a.md", "b.md"] and first.n == 2
+    assert chunking.store_generation([kb], data) == first.generation
+    assert _build(kb, data).generation == first.generation
+    assert parsed == ["a.md", "b.md"]
+
+    (kb / "b.md").write_text("# B\nTimepris er 350 kroner.", encoding="utf-8")
+    assert chunking.store_generation([kb], data) != first.generation
+    assert chunking.open_store(data).generation == first.generation  # ingenting skrevet ennå
+    _build(kb, data)
+    store = chunking.open_store(data)
+    assert parsed[2:] == ["b.md"] and store.generation != first.generation
+    assert store.path == artifacts.current_dir(data)  # lageret hører til generasjonen
+    rows = list(store.iter_rows())
+    assert [r["title"] for r in rows] == ["A", "B"] and "350" in rows[1]["text"]
+    assert rows[0]["doc_type"] == "booking" and store.meta().column("id") == [r["id"] for r in rows]
+
+
+def test_concurrent_builds_do_not_share_files(tmp_path, monkeypatch):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "a.md").write_text("# A\nBanebooking skjer i Matchi.", encoding="utf-8")
+    (kb / "b.md").write_text("# B\nTimepris er 300 kroner.", encoding="utf-8")
+    data = tmp_path / "data"
+
+    real = chunking.chunk_file
+    other = []
+
+    def chunk_file(p, pages, *a):
+        if not other:  # et annet bygg mot samme DATA_DIR midt i dette
+            other.append(None)
+            other[0] = _build(kb, data, rebuild=True)
+        return real(p, pages, *a)
+
+    monkeypatch.setattr(chunking, "chunk_file", chunk_file)
+    store = _build(kb, data, rebuild=True)
+    assert store.n == other[0].n == 2 and store.path != other[0].path
+    assert [r["title"] for r in chunking.open_store(data).iter_rows()] == ["A", "B"]
+    assert not list(data.glob("*.tmp"))
@@ -0,0 +1,51 @@
+from src import answer, context, trace
+from src.chunking import count_tokens
+
+
+def _hit(idx, text, score, source="kb/pris.md", page=None):
+    return {"source": source, "title": "Priser", "page": page, "chunk_idx": idx, "text": text, "score": score}
+
+
+def test_adjacent_chunks_merge_and_overlap_is_dropped():
+    hits = [
+        _hit(1, "Priser\nJunior betaler 150 kroner. Voksne betaler 300 kroner.", 0.9),
+        _hit(0, "Priser\nTimepris gjelder per bane. Junior betaler 150 kroner.", 0.7),
+        _hit(0, "Booking\nBook bane i Matchi-appen. Timepris gjelder per bane.", 0.5, source="kb/booking.md"),
+    ]
+    excerpts, used = context.build(hits)
+    assert [e["source"] for e in excerpts] == ["kb/pris.md", "kb/booking.md"]
+    assert excerpts[0]["hits"] == 2
+    assert excerpts[0]["text"] == ("Priser Timepris gjelder per bane. Junior betaler 150 kroner. "
+                                   "Voksne betaler 300 kroner.")  # i bitrekkefølge, overlappen én gang
+    assert excerpts[1]["text"] == "Booking Book bane i Matchi-appen."  # setning allerede i konteksten
+    assert used == sum(e["tokens"] for e in excerpts)
+
+
+def test_budget_is_filled_in_score_order_with_whole_sentences():
+    long = " ".join(f"Setning nummer {i} om baner." for i in range(40))
+    hits = [_hit(0, "Timepris er 300 kroner.", 0.9), _hit(5, long, 0.8, source="kb/lang.md")]
+    excerpts, used = context.build(hits, budget=60)
+    assert used <= 60 and excerpts[0]["text"] == "Timepris er 300 kroner."
+    assert excerpts[1]["text"].endswith("baner.") and 0 < excerpts[1]["text"].count("Setning") < 40
+
+
+def test_sentence_cut_by_budget_can_come_from_a_later_hit():
+    long = "Banene " + " og ".join(f"bane {i}" for i in range(10)) + " er åpne."
+    hits = [_hit(0, f"Kort innledning. {long} Timepris er 300 kroner.", 0.9),
+            _hit(0, "Timepris er 300 kroner.", 0.5, source="kb/kort.md")]
+    excerpts, _ = context.build(hits, budget=25)
+    assert "Timepris" not in excerpts[0]["text"]  # kuttet av budsjettet …
+    assert excerpts[1]["text"] == "Timepris er 300 kroner."  # … så det korte treffet får ha den
+
+
+def test_prompt_tokens_are_reported_per_request(monkeypatch):
+    monkeypatch.setattr(trace, "TRACE_ENABLED", True)
+    trace.reset()
+    hits = [_hit(0, "Timepris er 300 kroner.", 0.9), _hit(1, "Timepris er 300 kroner. Rabatt for junior.", 0.8)]
+    with trace.trace("answer"):
+        msgs = answer._messages("Hva koster det?", hits)
+    assert msgs[1]["content"].count("Timepris er 300 kroner.") == 1
+    spans = {s["name"]: s for s in trace.recent(1)[0]["spans"]}
+    assert spans["context"]["prompt_tokens"] == sum(count_tokens(m["content"]) for m in msgs)
+    assert trace.snapshot()["observed"]["prompt_tokens"]["count"] == 1
+    trace.reset()
@@ -0,0 +1,23 @@
+import numpy as np
+
+from src.embed_cache import EmbeddingCache
+
+
+def test_cache_hits_misses_and_lru_eviction(tmp_path):
+    cache = EmbeddingCache(tmp_path / "emb.sqlite", max_entries=2)
+    vecs = np.eye(3, dtype="float32")
+
+    assert cache.get_many("m", ["a", "b"]) == {}
+    cache.put_many("m", ["a", "b"], vecs[:2])
+    got = cache.get_many("m", ["b", "x", "a"])
+    assert sorted(got) == [0, 2]
+    np.testing.assert_array_equal(got[2], vecs[0])
+    assert cache.get_many("other-model", ["a"]) == {}
+
+    cache.get_many("m", ["a"])  # "a" er nå nyligst brukt
+    cache.put_many("m", ["c"], vecs[2:])
+    assert sorted(cache.get_many("m", ["a", "b", "c"])) == [0, 2]
+
+    s = cache.stats()
+    assert s["entries"] == 2
+    assert s["hits"] == 5 and s["misses"] == 5
@@ -0,0 +1,31 @@
+import numpy as np
+from openai import OpenAI
+
+from src import embed_pipeline
+from src.fake_openai import hash_embed, serve
+
+
+def test_pipeline_retries_rate_limits_against_fake_server():
+    server, state, url = serve(fail_first=3, fail_status=429, latency=0.01)
+    try:
+        client = OpenAI(api_key="fake", base_url=url)
+        texts = [f"tekst nummer {i} om banebooking" for i in range(40)]
+        done = []
+        X = embed_pipeline.embed_texts(
+            client, "fake", texts, on_batch=lambda idx, v: done.extend(idx),
+            concurrency=4, max_items=5, backoff_base=0.001,
+        )
+    finally:
+        server.shutdown()
+
+    assert sorted(done) == list(range(40))
+    assert state.failures == 3 and state.requests == 8 + 3
+    assert 1 < state.max_inflight <= 4
+    np.testing.assert_allclose(X[7], hash_embed(texts[7]), rtol=1e-6)
+
+
+def test_pack_batches_respects_token_budget():
+    texts = ["a" * 300] * 10  # ~101 tokens hver
+    batches = embed_pipeline.pack_batches(texts, max_items=100, max_tokens=250)
+    assert [len(b) for b in batches] == [2] * 5
+    assert sum(batches, []) == list(range(10))
@@ -0,0 +1,55 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src import embedders, ingest, retrieve
+
+
+def test_hashing_embedder_is_deterministic_and_batched(monkeypatch):
+    monkeypatch.setattr(embedders, "LOCAL_EMBED_BATCH", 2)
+    e = embedders.HashingEmbedder(dim=64)
+    texts = ["Book bane i Matchi-appen.", "Timepris er 300 kroner.", "Banebooking skjer i Matchi.", ""]
+    seen = []
+    X = e.embed(texts, on_batch=lambda idx, vecs: seen.append(idx))
+    assert seen == [[0, 1], [2, 3]]  # i rekkefølge, i kallerens tråd
+    assert X.shape == (4, 64) and np.allclose(np.linalg.norm(X[:3], axis=1), 1.0, atol=1e-5)
+    assert np.allclose(X, embedders.HashingEmbedder(dim=64).embed(texts))
+    q = e.embed_queries(["booking matchi"])[0]
+    assert q @ X[2] > q @ X[1] and q @ X[0] > q @ X[1]
+    assert e.id == "hashing:v1:64"
+    with pytest.raises(ValueError):
+        embedders.local("word2vec")
+
+
+def test_local_embedder_index_refuses_other_models(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "booking.md").write_text("# Banebooking\nBook bane i Matchi-appen.", encoding="utf-8")
+    (kb / "pris.md").write_text("# Priser\nTimepris er 300 kroner for medlemmer.", encoding="utf-8")
+    for mod in (ingest, retrieve):
+        monkeypatch.setattr(mod, "DATA_DIR", tmp_path / "data")
+        monkeypatch.setattr(mod, "USE_OPENAI", True)
+        monkeypatch.setattr(mod, "EMBEDDER", "hashing")
+    monkeypatch.setattr(ingest, "client", None)
+    monkeypatch.setattr(retrieve, "_openai", None)  # ingen nøkkel: alt skjer lokalt
+    monkeypatch.setattr(retrieve, "_current", None)
+
+    ingest.build_index(kb)
+    manifest = json.loads((tmp_path / "data" / "manifest.json").read_text(encoding="utf-8"))
+    assert manifest["backend"] == embedders.local("hashing").id
+    hits = retrieve.search("timepris medlemmer", 1)
+    assert hits[0]["source"].endswith("pris.md")
+    assert retrieve.current().embedder.id == manifest["backend"]
+
+    # Samme vektorer, annen embedder: søket nektes i stedet for å blande modeller
+    class _Embeddings:
+        def create(self, model, input):
+            raise AssertionError("skal ikke embedde mot en fremmed indeks")
+
+    r = retrieve.Retriever(embedder=embedders.OpenAIEmbedder("text-embedding-3-small",
+                                                            SimpleNamespace(embeddings=_Embeddings())))
+    with pytest.raises(RuntimeError, match="hashing"):
+        r.search("timepris", 1)
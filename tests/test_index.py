@@ -0,0 +1,16 @@
+import numpy as np
+
+from src import index, metastore
+
+
+def test_flat_build_without_index_faiss_is_not_rebuilt(tmp_path, monkeypatch):
+    np.save(tmp_path / "vectors.npy", np.eye(2, dtype="float32"))
+    metastore.save_meta([{"id": "a#0", "text": "a"}, {"id": "b#0", "text": "b"}], tmp_path / "meta.jsonl")
+    monkeypatch.setattr(index, "VEC_PATH", tmp_path / "vectors.npy")
+    monkeypatch.setattr(index, "META_PATH", tmp_path / "meta.jsonl")
+    monkeypatch.setattr(index, "INDEX_PATH", tmp_path / "index.faiss")  # finnes ikke (FAISS_INDEX=flat)
+    builds = []
+    monkeypatch.setattr(index, "build_index", lambda *a, **kw: builds.append(1))
+
+    assert index.load_vectors().shape == (2, 2) and len(index.load_meta()) == 2
+    assert builds == []
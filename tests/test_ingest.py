@@ -0,0 +1,91 @@
+import os
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from src import ingest
+
+
+def _fake_embeddings(calls):
+    def embed(chunks, batch_size=64):
+        calls.append(len(chunks))
+        out = np.zeros((len(chunks), 8), dtype="float32")
+        for i, c in enumerate(chunks):
+            out[i, hash(c["text"]) % 8] = 1.0
+        return out
+    return embed
+
+
+def test_incremental_rebuild_only_embeds_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    kb = tmp_path / "mykb"  # ikke standardkatalogen: build_index må bruke argumentet
+    kb.mkdir()
+    (kb / "a.md").write_text("Banebooking skjer i Matchi. " * 10, encoding="utf-8")
+    (kb / "b.md").write_text("Timepris er 300 kroner. " * 10, encoding="utf-8")
+    (kb / "c.md").write_text("Sommerleir for juniorer. " * 10, encoding="utf-8")
+
+    calls = []
+    monkeypatch.setattr(ingest, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(ingest, "USE_OPENAI", True)
+    monkeypatch.setattr(ingest, "_build_openai_embeddings", _fake_embeddings(calls))
+
+    ingest.build_index(kb)
+    n_first = calls[-1]
+    assert n_first > 0
+
+    ingest.build_index(kb)
+    assert len(calls) == 1  # ingen endringer -> ingen embedding
+
+    (kb / "b.md").write_text("Timepris er 350 kroner.", encoding="utf-8")
+    (kb / "c.md").unlink()
+    ingest.build_index(kb)
+    assert calls[-1] == 1
+
+    meta = [l for l in (tmp_path / "data" / "meta.jsonl").read_text(encoding="utf-8").splitlines()]
+    X = np.load(tmp_path / "data" / "vectors.npy")
+    assert X.shape[0] == len(meta)
+    assert not any("Sommerleir" in l for l in meta)
+
+
+def test_tfidf_build_writes_sparse_matrix_and_svd_vectors(tmp_path, monkeypatch):
+    import scipy.sparse as sp
+
+    monkeypatch.chdir(tmp_path)
+    kb = tmp_path / "mykb"  # ikke standardkatalogen: build_index må bruke argumentet
+    kb.mkdir()
+    for i, txt in enumerate(["Banebooking i Matchi.", "Timepris 300 kr.", "Sommerleir i juli.", "Klubbhus til leie."]):
+        (kb / f"{i}.md").write_text(txt, encoding="utf-8")
+    monkeypatch.setattr(ingest, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(ingest, "USE_OPENAI", False)
+
+    ingest.build_index(kb)
+    mtx = sp.load_npz(tmp_path / "data" / "tfidf.npz")
+    X = np.load(tmp_path / "data" / "vectors.npy")
+    assert mtx.shape[0] == X.shape[0] == 4
+    assert X.shape[1] < mtx.shape[1]
+    np.testing.assert_allclose(np.linalg.norm(X, axis=1), 1.0, atol=1e-3)
+
+
+def test_unchanged_rebuild_with_quantization_is_a_no_op(tmp_path, monkeypatch):
+    from src import artifacts, quant
+
+    monkeypatch.chdir(tmp_path)
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "a.md").write_text("Banebooking skjer i Matchi. " * 10, encoding="utf-8")
+    (kb / "b.md").write_text("Timepris er 300 kroner. " * 10, encoding="utf-8")
+    calls = []
+    monkeypatch.setattr(ingest, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(ingest, "USE_OPENAI", True)
+    monkeypatch.setattr(ingest, "_build_openai_embeddings", _fake_embeddings(calls))
+    monkeypatch.setattr(quant, "VECTOR_QUANT", "f16")
+
+    ingest.build_index(kb)
+    first = artifacts.resolve(tmp_path / "data")[0]
+    ingest.build_index(kb)
+    assert artifacts.resolve(tmp_path / "data")[0] == first  # ingen ny generasjon å laste inn
+
+    monkeypatch.setattr(quant, "VECTOR_QUANT", "int8")  # annet artefaktsett -> nytt bygg, uten ny embedding
+    ingest.build_index(kb)
+    assert artifacts.resolve(tmp_path / "data")[0] != first
+    assert len(calls) == 1 and (tmp_path / "data" / "vectors.int8.npy").exists()
@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from src import ingest, loader, metastore
+
+
+def _pdf(path, pages):
+    """Minimal PDF med én tekstlinje per side (Helvetica)."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = b"%PDF-1.4\n", []
+    for i, o in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{o}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(out)
+
+
+def test_iter_pages_keeps_order_and_pdf_pages(tmp_path):
+    (tmp_path / "a.md").write_text("Banebooking i Matchi.", encoding="utf-8")
+    _pdf(tmp_path / "b.pdf", ["Timepris 300 kroner", "Sommerleir i juli"])
+    (tmp_path / "c.jsonl").write_text(
+        json.dumps({"text": "Klubbhus", "metadata": {"page": 4}}) + "\nikke json\n", encoding="utf-8")
+
+    files = loader.iter_files([tmp_path])
+    got = [(p.name, [(page, txt.strip()) for page, txt, _ in pages])
+           for p, pages in loader.iter_pages(files, workers=2)]
+    assert got == [
+        ("a.md", [(None, "Banebooking i Matchi.")]),
+        ("b.pdf", [(1, "Timepris 300 kroner"), (2, "Sommerleir i juli")]),
+        ("c.jsonl", [(4, "Klubbhus")]),
+    ]
+
+
+def test_streaming_build_embeds_in_batches_with_pdf_pages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    for i in range(5):
+        (kb / f"{i}.md").write_text(f"Dokument nummer {i} om tennis. " * 3, encoding="utf-8")
+    _pdf(kb / "z.pdf", ["Styremote i mars", "Arsmote i april"])
+
+    calls = []
+
+    def embed(chunks, batch_size=64):
+        calls.append(len(chunks))
+        return np.eye(8, dtype="float32")[[len(c["text"]) % 8 for c in chunks]]
+
+    monkeypatch.setattr(ingest, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(ingest, "USE_OPENAI", True)
+    monkeypatch.setattr(ingest, "EMBED_STREAM_ROWS", 2)
+    monkeypatch.setattr(ingest, "_build_openai_embeddings", embed)
+
+    ingest.build_index(kb)
+    assert calls == [2, 2, 2, 1]
+
+    meta = metastore.load_meta(tmp_path / "data" / "meta.jsonl")
+    X = np.load(tmp_path / "data" / "vectors.npy")
+    assert isinstance(meta, metastore.MetaTable) and X.shape == (len(meta), 8)
+    for i in range(len(meta)):
+        assert X[i, len(meta[i]["text"]) % 8] == 1.0
+    pdf_rows = [dict(meta[i]) for i in range(len(meta)) if meta[i]["source"].endswith("z.pdf")]
+    assert [(m["page"], m["chunk_idx"]) for m in pdf_rows] == [(1, 0), (2, 1)]
+
+
+def test_convert_jsonl_writes_batches_with_shared_dictionaries(tmp_path):
+    rows = [{"text": f"t{i}", "source": f"s{i % 3}", "doc_type": "pris" if i % 2 else None,
+             "chunk_idx": i, "id": f"s#{i}"} for i in range(7)]
+    path = tmp_path / "meta.jsonl"
+    path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+
+    metastore.convert_jsonl(path, batch_rows=3)
+    table = metastore.MetaTable.open(metastore.arrow_path(path))
+    assert len(table) == 7
+    assert table.column("source") == [r["source"] for r in rows]
+    assert table.column("doc_type") == [r["doc_type"] for r in rows]
+    assert list(metastore.iter_column(table, "text", batch_rows=2)) == [r["text"] for r in rows]
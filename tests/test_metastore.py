@@ -0,0 +1,37 @@
+import json
+
+import pyarrow as pa
+
+from src import metastore
+
+
+def test_arrow_meta_roundtrip_with_lazy_rows(tmp_path):
+    meta = [
+        {"text": f"tekst {i}", "source": f"kb/{i % 2}.md", "title": "Priser", "doc_type": "pris" if i % 2 else None,
+         "version_date": None, "page": None if i % 3 else i, "chunk_idx": i, "id": f"kb/{i % 2}.md#{i}"}
+        for i in range(6)
+    ]
+    metastore.save_meta(meta, tmp_path / "meta.jsonl")
+    table = metastore.load_meta(tmp_path / "meta.jsonl")
+    assert isinstance(table, metastore.MetaTable) and len(table) == 6
+    assert pa.types.is_dictionary(table.table.schema.field("source").type)
+
+    row = table[3]
+    row["score"] = 0.5
+    assert row["doc_type"] == "pris" and row.get("page") == 3 and row["score"] == 0.5
+    assert dict(table[4]) == meta[4]
+    assert "score" not in table[3]  # nye visninger deler ikke lokale felter
+
+
+def test_rows_are_read_per_record_batch_without_combining(tmp_path):
+    meta = [{"text": f"tekst {i}", "source": "kb/a.md", "title": "A", "doc_type": None, "version_date": None,
+             "page": None, "chunk_idx": i, "id": f"kb/a.md#{i}"} for i in range(10)]
+    with (tmp_path / "meta.jsonl").open("w", encoding="utf-8") as f:
+        f.writelines(json.dumps(m) + "\n" for m in meta)
+    metastore.convert_jsonl(tmp_path / "meta.jsonl", batch_rows=3)
+    table = metastore.MetaTable.open(tmp_path / "meta.arrow")
+    assert table.table.column("text").num_chunks == 4
+    assert [table[i]["text"] for i in range(10)] == [m["text"] for m in meta]  # også over batchgrensene
+    assert table._col("text").num_chunks == 4  # ingen sammenslått kopi av kolonnen
+    assert table.column("id") == [m["id"] for m in meta]
+    assert [n for _, n in table.ids_and_lengths()] == [len(m["text"]) for m in meta]
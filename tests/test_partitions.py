@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from src import partitions
+
+META = [
+    {"doc_type": "pris", "source": "kb/priser.md", "version_date": "2024-05-01"},
+    {"doc_type": "booking", "source": "kb/booking.md", "version_date": "2023-11-20"},
+    {"doc_type": "pris", "source": "arkiv/priser.md", "version_date": None},
+    {"doc_type": None, "source": "kb/regler.md", "version_date": "2024-01"},
+]
+
+
+def test_masks_combine_fields_and_date_ranges(tmp_path):
+    index = partitions.PartitionIndex.build(META)
+    rows = lambda f: np.flatnonzero(index.mask(f)).tolist()
+    assert index.mask(None) is None and index.mask({}) is None
+    assert rows({"doc_type": "pris"}) == [0, 2]
+    assert rows({"doc_type": ["pris", "booking"]}) == [0, 1, 2]
+    assert rows({"source": "priser.md"}) == [0, 2]  # filnavn treffer alle stier
+    assert rows({"source": "kb/priser.md", "doc_type": "pris"}) == [0]
+    assert rows({"doc_type": "ukjent"}) == []
+    assert rows({"version_date": "2024"}) == [0, 3]
+    assert rows({"version_date": ("2024-01-15", None)}) == [0]
+    assert rows({"version_date": (None, "2023-12")}) == [1]
+    assert rows({"version_date": {"from": "2024-01-15"}}) == [0]  # JSON-formen av et intervall
+    assert rows({"version_date": {"from": "2023-11", "to": "2024-01"}}) == [1, 3]
+    assert rows({"version_date": ["2023", "2024-01"]}) == [1, 3]  # liste: ELLER, ikke intervall
+    assert rows({"version_date": ["2024-05", "2023"]}) == [0, 1]
+    with pytest.raises(ValueError):
+        partitions.normalize({"version_date": ("2024",)})
+    with pytest.raises(ValueError):
+        partitions.normalize({"version_date": {"fra": "2024"}})
+    with pytest.raises(ValueError):
+        partitions.normalize({"forfatter": "x"})
+
+    index.save(tmp_path / "partitions.npz")
+    loaded = partitions.PartitionIndex.load(tmp_path / "partitions.npz")
+    for f in ({"doc_type": "pris"}, {"source": "regler.md"}, {"version_date": "2024-05"}):
+        assert rows(f) == np.flatnonzero(loaded.mask(f)).tolist()
+
+
+def test_normalize_is_order_independent():
+    a = partitions.normalize({"doc_type": ["pris", "booking"], "source": "x.md"})
+    b = partitions.normalize({"source": ["x.md"], "doc_type": ("booking", "pris", "pris")})
+    assert a == b and hash(a) == hash(b)
+    assert partitions.normalize({"doc_type": []}) is None
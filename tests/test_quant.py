@@ -0,0 +1,46 @@
+import numpy as np
+
+from src import quant
+
+
+def _data(n=3000, dim=64, seed=2):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, dim)).astype("float32")
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+def test_quantized_files_are_compact_and_close(tmp_path):
+    X = _data()
+    np.save(tmp_path / "vectors.npy", X)
+    full = (tmp_path / "vectors.npy").stat().st_size
+    for kind, ratio in (("f16", 2), ("int8", 4)):
+        path = quant.write(np.load(tmp_path / "vectors.npy", mmap_mode="r"), tmp_path, kind)
+        assert path.stat().st_size < full / ratio * 1.05
+        qv = quant.QuantizedVectors.open(tmp_path, kind, n=len(X), dim=X.shape[1])
+        assert isinstance(qv.codes, np.memmap)
+        assert np.abs(qv.scores(X[:5]) - X[:5] @ X.T).max() < 0.02
+    assert quant.QuantizedVectors.open(tmp_path, "int8", n=len(X) + 1) is None  # hører til andre vektorer
+    assert quant.write(X, tmp_path, "none") is None
+
+
+def test_rescored_shortlist_matches_exact_top_k():
+    X = _data()
+    rng = np.random.default_rng(3)
+    Q = X[:50] + 0.3 * rng.normal(size=(50, X.shape[1])).astype("float32")
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    k = 10
+    sims = Q @ X.T
+    truth = np.argsort(-sims, axis=1)[:, :k]
+    for kind in ("f16", "int8"):
+        qv = quant.QuantizedVectors(*_codes(X, kind), kind)
+        coarse = np.argsort(-qv.scores(Q), axis=1)[:, :quant.shortlist_size(k, len(X))]
+        I, D = quant.rescore(X, Q, coarse, k)
+        assert (I == truth).all()
+        assert np.allclose(D, np.take_along_axis(sims, truth, axis=1), atol=1e-6)
+
+
+def _codes(X, kind):
+    if kind == "f16":
+        return X.astype("float16"), None
+    scale = np.abs(X).max(axis=0) / 127
+    return np.clip(np.rint(X / scale), -127, 127).astype("int8"), scale.astype("float32")
@@ -0,0 +1,305 @@
+from pathlib import Path
+
+from src import retrieve
+
+
+def _kb(tmp_path, monkeypatch):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "booking.md").write_text("# Banebooking\nBook bane i Matchi-appen.", encoding="utf-8")
+    (kb / "pris.md").write_text("# Priser\nTimepris er 300 kroner for medlemmer.", encoding="utf-8")
+    monkeypatch.setattr(retrieve, "KB_DIRS", [kb])
+    monkeypatch.setattr(retrieve, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(retrieve, "USE_OPENAI", False)
+    _publish()
+    return kb
+
+
+def _publish():
+    """Som ingest: bygg TF-IDF fra kildene og publiser en ny generasjon."""
+    builder = retrieve.Retriever()
+    builder.build_tfidf()
+    builder.close()
+
+
+def _reset(monkeypatch):
+    monkeypatch.setattr(retrieve, "_current", None)  # ny retriever (tom) ved neste søk
+
+
+def test_reader_loads_published_tfidf_without_rebuilding(tmp_path, monkeypatch):
+    from src import artifacts
+
+    kb = _kb(tmp_path, monkeypatch)
+    assert (artifacts.current_dir(tmp_path / "data") / "tfidf.npz").exists()
+    fits = []
+    real_fit = retrieve._fit_tfidf
+    monkeypatch.setattr(retrieve, "_fit_tfidf", lambda texts: fits.append(1) or real_fit(texts))
+
+    _reset(monkeypatch)
+    assert retrieve.search("timepris", 1)[0]["source"].endswith("pris.md")
+    gens = artifacts.generations(tmp_path / "data")
+
+    (kb / "ny.md").write_text("# Sommerleir\nSommerleir i juli.", encoding="utf-8")
+    _reset(monkeypatch)
+    assert Path(retrieve.search("sommerleir", 1)[0]["source"]).name != "ny.md"  # leseren chunker ikke kildene
+    assert fits == [] and artifacts.generations(tmp_path / "data") == gens
+
+    retrieve.tfidf_index(rebuild=True)  # eksplisitt ombygging
+    assert Path(retrieve.search("sommerleir", 1)[0]["source"]).name == "ny.md"
+    assert fits == [1]
+
+
+def test_reader_without_published_index_fails(tmp_path, monkeypatch):
+    import pytest
+
+    monkeypatch.setattr(retrieve, "KB_DIRS", [tmp_path / "kb"])
+    monkeypatch.setattr(retrieve, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(retrieve, "USE_OPENAI", False)
+    _reset(monkeypatch)
+    with pytest.raises(FileNotFoundError):
+        retrieve.search("timepris", 1)
+    assert not (tmp_path / "data").exists()
+
+
+def test_reload_swaps_index_without_dropping_inflight_queries(tmp_path, monkeypatch):
+    kb = _kb(tmp_path, monkeypatch)
+    _reset(monkeypatch)
+    old = retrieve.current().load()
+    assert not old.stale()
+
+    with retrieve.pinned() as held:  # en forespørsel som pågår under byttet
+        (kb / "ny.md").write_text("# Sommerleir\nSommerleir i juli.", encoding="utf-8")
+        _publish()
+        new = retrieve.reload()
+        assert held is old and old.stale() and not old.closed
+        assert Path(retrieve.search("sommerleir", 1)[0]["source"]).name != "ny.md"  # fortsatt gammel indeks
+        assert len(old.meta) == 2
+    assert old.closed and retrieve.current() is new and len(new.meta) == 3
+    assert Path(retrieve.search("sommerleir", 1)[0]["source"]).name == "ny.md"
+
+
+def test_pinned_waits_for_replacement_of_closed_retriever(tmp_path, monkeypatch):
+    import threading
+
+    import pytest
+
+    _kb(tmp_path, monkeypatch)
+    _reset(monkeypatch)
+    old = retrieve.current()
+    old.close()
+    monkeypatch.setattr(retrieve, "PIN_WAIT_SECS", 0.05)
+    with pytest.raises(RuntimeError):  # lukket for godt: feiler i stedet for å spinne
+        with retrieve.pinned():
+            pass
+
+    new = retrieve.Retriever()
+    monkeypatch.setattr(retrieve, "PIN_WAIT_SECS", 5)
+    timer = threading.Timer(0.05, retrieve.install, args=(new,))
+    timer.start()
+    with retrieve.pinned() as held:
+        assert held is new
+    timer.join()
+
+
+def test_watch_picks_up_published_generation(tmp_path, monkeypatch):
+    import time
+    from src import artifacts
+
+    kb = _kb(tmp_path, monkeypatch)
+    _reset(monkeypatch)
+    old = retrieve.current().load()
+    first = artifacts.current_id(tmp_path / "data")
+    assert old.generation == first and old.gen_dir.parent.name == artifacts.GENERATIONS
+
+    retrieve.watch(0.01)
+    try:
+        with retrieve.pinned():
+            (kb / "ny.md").write_text("# Sommerleir\nSommerleir i juli.", encoding="utf-8")
+            _publish()  # som ingest i en annen prosess
+            deadline = time.time() + 5
+            while retrieve._current is old and time.time() < deadline:
+                time.sleep(0.01)
+            assert retrieve._current is not old and not old.closed  # current() gir den festede
+        assert old.closed and retrieve.current().generation == artifacts.current_id(tmp_path / "data") != first
+        assert Path(retrieve.search("sommerleir", 1)[0]["source"]).name == "ny.md"
+    finally:
+        retrieve.unwatch()
+
+
+class _FakeEmbeddings:
+    def __init__(self, vec):
+        self.vec = vec
+        self.calls = 0
+
+    def create(self, model, input):
+        from types import SimpleNamespace
+        self.calls += 1
+        items = [input] if isinstance(input, str) else input
+        return SimpleNamespace(data=[SimpleNamespace(embedding=list(self.vec)) for _ in items])
+
+
+def _openai_index(tmp_path, monkeypatch, n=50, dim=16):
+    import json
+    import numpy as np
+    from types import SimpleNamespace
+    from src import embed_cache
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(n, dim)).astype("float32")
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    data = tmp_path / "data"
+    data.mkdir()
+    np.save(data / "vectors.npy", X)
+    with (data / "meta.jsonl").open("w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(json.dumps({"id": f"doc#{i}", "text": f"tekst {i}", "source": "doc"}) + "\n")
+    from src import ann
+    idx, params = ann.build(X, "hnsw")
+    ann.write(idx, params, data / "index.faiss")
+
+    emb = _FakeEmbeddings(X[7])
+    monkeypatch.setattr(embed_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(retrieve, "DATA_DIR", data)
+    monkeypatch.setattr(retrieve, "USE_OPENAI", True)
+    monkeypatch.setattr(retrieve, "_openai", SimpleNamespace(embeddings=emb))
+    _reset(monkeypatch)
+    return X, emb
+
+
+def test_openai_search_uses_mmapped_vectors_and_faiss(tmp_path, monkeypatch):
+    import numpy as np
+
+    X, _ = _openai_index(tmp_path, monkeypatch)
+    hits = retrieve.search("hva som helst", 3)
+    assert hits[0]["id"] == "doc#7"
+    assert abs(hits[0]["score"] - 1.0) < 1e-5
+    r = retrieve.current()
+    assert isinstance(r.emb, np.memmap)
+    assert r.faiss is not None and r.faiss.ntotal == len(X)
+
+
+def test_flat_faiss_index_is_not_loaded(tmp_path, monkeypatch):
+    import faiss
+
+    X, _ = _openai_index(tmp_path, monkeypatch)
+    (tmp_path / "data" / "index.json").unlink()  # eldre generasjon: flat uten parametre
+    idx = faiss.IndexFlatIP(X.shape[1])
+    idx.add(X)
+    faiss.write_index(idx, str(tmp_path / "data" / "index.faiss"))
+    assert retrieve.search("hva som helst", 3)[0]["id"] == "doc#7"
+    assert retrieve.current().faiss is None  # NumPy over vectors.npy i stedet for en RAM-kopi
+
+
+def test_quantized_coarse_pass_keeps_exact_ranking(tmp_path, monkeypatch):
+    import numpy as np
+    from src import quant
+
+    X, _ = _openai_index(tmp_path, monkeypatch, n=500, dim=32)
+    monkeypatch.setattr(retrieve, "ann", None)
+    exact = retrieve.search("hva som helst", 10)
+    for kind in ("f16", "int8"):
+        quant.write(X, tmp_path / "data", kind)
+        monkeypatch.setattr(quant, "VECTOR_QUANT", kind)
+        _reset(monkeypatch)
+        hits = retrieve.search("hva som helst", 10)
+        assert retrieve.current().quant.kind == kind
+        assert [h["id"] for h in hits] == [h["id"] for h in exact]
+        assert np.allclose([h["score"] for h in hits], [h["score"] for h in exact], atol=1e-6)
+
+
+def test_search_batch_matches_full_sort(tmp_path, monkeypatch):
+    import numpy as np
+
+    X, emb = _openai_index(tmp_path, monkeypatch)
+    monkeypatch.setattr(retrieve, "ann", None)  # NumPy-stien med argpartition
+    results = retrieve.search_batch(["a", "b", "c"], 5)
+    assert emb.calls == 1 and len(results) == 3
+    expected = np.argsort(-(X @ X[7]))[:5]
+    assert [h["id"] for h in results[0]] == [f"doc#{i}" for i in expected]
+
+    sims = np.array([[0.1, 0.9, 0.5, 0.7], [0.3, 0.2, 0.8, 0.1]])
+    assert retrieve._topk(sims, 2).tolist() == [[1, 3], [2, 0]]
+    assert retrieve._topk(sims, 10).tolist() == [[1, 3, 2, 0], [2, 0, 1, 3]]
+
+
+def test_hybrid_mode_fuses_bm25_and_dense(tmp_path, monkeypatch):
+    _kb(tmp_path, monkeypatch)
+    _reset(monkeypatch)
+    monkeypatch.setattr(retrieve, "RETRIEVAL_MODE", "hybrid")
+    hits = retrieve.search("matchi", 2, lexical_query="matchi booking bane")
+    assert hits[0]["source"].endswith("booking.md")
+    assert abs(hits[0]["score"] - 1.0) < 1e-6  # først i begge lister
+    assert 0 < hits[0]["dense_score"] <= 1.0
+    assert (tmp_path / "data" / "tfidf_bm25.npz").exists()  # bygget og speilet ved publisering
+
+
+def test_bm25_ranks_rare_terms_higher():
+    from src.bm25 import BM25Index
+
+    index = BM25Index.build(["tennis bane booking", "tennis tennis klubb", "sommerleir for barn"])
+    ids, scores = index.top("booking tennis", 5)
+    assert ids.tolist() == [0, 1] and scores[0] > scores[1]
+    assert index.top("fotball", 5)[0].size == 0
+
+
+def test_filters_restrict_search_to_partition(tmp_path, monkeypatch):
+    kb = _kb(tmp_path, monkeypatch)
+    (kb / "kurs.jsonl").write_text('{"text": "Kurs for nybegynnere i Matchi-hallen.", "metadata": '
+                                   '{"doc_type": "kurs", "version_date": "2024-03-01"}}\n', encoding="utf-8")
+    _publish()
+    _reset(monkeypatch)
+    assert {Path(h["source"]).name for h in retrieve.search("matchi", 2)} == {"booking.md", "kurs.jsonl"}
+    hits = retrieve.search("matchi", 3, filters={"doc_type": "kurs"})
+    assert [Path(h["source"]).name for h in hits] == ["kurs.jsonl"]
+    assert [Path(h["source"]).name for h in retrieve.search("matchi", 3, filters={"source": "pris.md"})] == ["pris.md"]
+    assert retrieve.search("matchi", 3, filters={"version_date": ("2024-01-01", "2024-12-31")})[0]["doc_type"] == "kurs"
+    assert retrieve.search("matchi", 3, filters={"version_date": "2023"}) == []
+    assert (tmp_path / "data" / "tfidf_partitions.npz").exists()
+
+    monkeypatch.setattr(retrieve, "RETRIEVAL_MODE", "hybrid")
+    hits = retrieve.search("matchi", 3, lexical_query="matchi", filters={"doc_type": ["kurs"]})
+    assert [Path(h["source"]).name for h in hits] == ["kurs.jsonl"]
+
+
+def test_fallback_indexes_are_kept_per_row_set_and_not_written(tmp_path, monkeypatch):
+    from src import rerank
+
+    r = retrieve.Retriever(data_dir=tmp_path / "data", use_openai=False)
+    r.meta_oai = [{"id": "a#0", "text": "Banebooking i Matchi.", "doc_type": "booking"}]
+    r.meta_tfidf = [{"id": "b#0", "text": "Timepris 300 kroner.", "doc_type": "pris"},
+                    {"id": "b#1", "text": "Sommerleir i juli.", "doc_type": "kurs"}]
+    builds = []
+    real = rerank.KeywordIndex.build
+    monkeypatch.setattr(rerank.KeywordIndex, "build", lambda meta, **kw: builds.append(len(meta)) or real(meta, **kw))
+    for _ in range(3):  # bytte mellom backendene bygger ikke om
+        r._ensure_keywords(r.meta_oai)
+        r._ensure_keywords(r.meta_tfidf)
+        r._ensure_partitions(r.meta_tfidf)
+    assert builds == [1, 2]
+    assert not (tmp_path / "data").exists()
+
+
+def test_filtered_dense_search_matches_exact_over_partition(tmp_path, monkeypatch):
+    import json
+    import numpy as np
+
+    X, _ = _openai_index(tmp_path, monkeypatch, n=200, dim=16)
+    with (tmp_path / "data" / "meta.jsonl").open("w", encoding="utf-8") as f:
+        for i in range(len(X)):
+            f.write(json.dumps({"id": f"doc#{i}", "text": f"tekst {i}", "source": "doc",
+                                "doc_type": ["pris", "booking", "kurs"][i % 3]}) + "\n")
+    rows = np.arange(1, len(X), 3)
+    expected = [f"doc#{i}" for i in rows[np.argsort(-(X[rows] @ X[7]))[:5]]]
+    for exact_rows in (10**6, 0):  # eksakt over radene / FAISS med bitmap-selektor
+        monkeypatch.setattr(retrieve, "FILTER_EXACT_ROWS", exact_rows)
+        hits = retrieve.search("hva som helst", 5, filters={"doc_type": "booking"})
+        assert [h["id"] for h in hits] == expected
+        assert all(h["doc_type"] == "booking" for h in hits)
+    assert not (tmp_path / "data" / "partitions.npz").exists()  # bygget i minnet; generasjonen er urørt
+
+    from src import quant
+    quant.write(X, tmp_path / "data", "int8")
+    monkeypatch.setattr(quant, "VECTOR_QUANT", "int8")
+    monkeypatch.setattr(retrieve, "FILTER_EXACT_ROWS", 10**6)
+    _reset(monkeypatch)
+    assert [h["id"] for h in retrieve.search("hva som helst", 5, filters={"doc_type": "booking"})] == expected
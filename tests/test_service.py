@@ -0,0 +1,189 @@
+import threading
+
+from src import answer, retrieve, service
+
+
+class _Recorder:
+    """Retriever-stand-in som logger search_batch-kallene."""
+
+    def __init__(self):
+        self.calls = []
+
+    def search_batch(self, queries, k, lexical_queries=None):
+        self.calls.append((list(queries), k, lexical_queries))
+        return [[{"id": f"{q}#{i}"} for i in range(k)] for q in queries]
+
+
+def test_micro_batcher_merges_concurrent_queries():
+    r = _Recorder()
+    batcher = service.MicroBatcher(window_ms=200, max_batch=8)
+    results = {}
+    start = threading.Barrier(8)
+
+    def ask(i):
+        start.wait()
+        results[i] = batcher.search(r, f"q{i}", 1 + i % 3, "utvidet" if i == 0 else None)
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+
+    assert len(r.calls) < 8 and sum(len(c[0]) for c in r.calls) == 8
+    for i in range(8):  # hver får sin egen k, fra sin egen spørring
+        assert [h["id"] for h in results[i]] == [f"q{i}#{j}" for j in range(1 + i % 3)]
+    queries, _, lexical = next(c for c in r.calls if "q0" in c[0])
+    assert lexical == ["utvidet" if q == "q0" else q for q in queries]  # uten utvidelse: spørringen selv
+    assert batcher.stats()["queries"] == 8
+
+
+def test_service_search_and_streamed_answer(tmp_path, monkeypatch):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "pris.md").write_text("# Priser\nTimepris er 300 kroner for medlemmer.", encoding="utf-8")
+    (kb / "booking.md").write_text("# Banebooking\nBook bane i Matchi-appen.", encoding="utf-8")
+    monkeypatch.setattr(retrieve, "KB_DIRS", [kb])
+    monkeypatch.setattr(retrieve, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(retrieve, "USE_OPENAI", False)
+    monkeypatch.setattr(retrieve, "_current", None)
+    builder = retrieve.Retriever()  # publiser indeksen som ingest ville gjort
+    builder.build_tfidf()
+    builder.close()
+    monkeypatch.setattr(answer, "_cache", None)
+    monkeypatch.setattr(answer, "_batcher", None)
+
+    server, url = service.start(window_ms=2)
+    try:
+        client = service.Client(url)
+        assert client.search("timepris", 1)[0]["source"].endswith("pris.md")
+        assert client.health()["rows"] == 2
+
+        events = list(client.answer_stream("Hva er timepris for medlemmer?", k=2))
+        assert events[0][0] == "hits" and events[0][1][0]["source"].endswith("pris.md")
+        assert events[-1][0] == "done" and "300 kroner" in events[-1][1]
+        assert client.answer("Hva er timepris for medlemmer?", k=2)[0] == events[-1][1]
+        assert answer._batcher.stats()["queries"] >= 3  # også answer() går via mikrobatcheren
+    finally:
+        server.shutdown()
+        answer._batcher.close()
+        retrieve.unwatch()
+        retrieve.current().close()
+
+
+def test_fake_openai_chat_streams_first_sentence_of_context(monkeypatch):
+    from openai import OpenAI
+    from src import fake_openai
+
+    server, state, url = fake_openai.serve()
+    try:
+        monkeypatch.setattr(answer, "USE_OPENAI", True)
+        monkeypatch.setattr(answer, "_openai", OpenAI(base_url=url, api_key="fake"))
+        hits = [{"text": "Timepris er 300 kroner. Medlemmer får rabatt."}]
+        assert answer._llm("Hva koster det?", hits) == "Timepris er 300 kroner."
+        tokens = [v for ev, v in answer._llm_stream("Hva koster det?", hits) if ev == "token"]
+        assert len(tokens) > 1 and "".join(tokens) == "Timepris er 300 kroner."
+        assert state.chat_requests == 2
+    finally:
+        server.shutdown()
+
+
+def test_micro_batcher_keeps_filters_apart():
+    class _Filtered(_Recorder):
+        def search_batch(self, queries, k, lexical_queries=None, filters=None):
+            self.calls.append((list(queries), k, filters))
+            return [[{"id": f"{q}@{filters}"}] for q in queries]
+
+    r = _Filtered()
+    batcher = service.MicroBatcher(window_ms=200, max_batch=8)
+    filters = [None, {"doc_type": "pris"}, {"doc_type": ["pris"]}, {"doc_type": "kurs"}]
+    results = {}
+    start = threading.Barrier(len(filters))
+
+    def ask(i):
+        start.wait()
+        results[i] = batcher.search(r, f"q{i}", 1, None, filters[i])
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(len(filters))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+
+    assert sorted(len(c[0]) for c in r.calls) == [1, 1, 2]  # "pris" og ["pris"] er samme partisjon
+    assert results[3][0]["id"] == "q3@{'doc_type': 'kurs'}"
+
+
+def test_malformed_filter_is_rejected_and_batcher_keeps_serving(tmp_path, monkeypatch):
+    import urllib.error
+
+    import pytest
+
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "pris.md").write_text("# Priser\nTimepris er 300 kroner for medlemmer.", encoding="utf-8")
+    (kb / "booking.md").write_text("# Banebooking\nBook bane i Matchi-appen.", encoding="utf-8")
+    monkeypatch.setattr(retrieve, "KB_DIRS", [kb])
+    monkeypatch.setattr(retrieve, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(retrieve, "USE_OPENAI", False)
+    monkeypatch.setattr(retrieve, "_current", None)
+    builder = retrieve.Retriever()  # publiser indeksen som ingest ville gjort
+    builder.build_tfidf()
+    builder.close()
+    monkeypatch.setattr(answer, "_batcher", None)
+
+    server, url = service.start(window_ms=2)
+    try:
+        client = service.Client(url)
+        with pytest.raises(urllib.error.HTTPError) as err:
+            client.search("timepris", 1, filters=["pris"])
+        assert err.value.code == 400
+        # direkte mot batcheren: feilen havner på det ene søket, tråden lever videre
+        with pytest.raises(ValueError):
+            answer._batcher.search(retrieve.current(), "timepris", 1, None, ["pris"])
+        assert client.search("timepris", 1)[0]["source"].endswith("pris.md")
+    finally:
+        server.shutdown()
+        answer._batcher.close()
+        retrieve.unwatch()
+        retrieve.current().close()
+
+
+def test_stream_failing_midway_ends_with_error_event(tmp_path, monkeypatch):
+    import pytest
+
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "pris.md").write_text("# Priser\nTimepris er 300 kroner for medlemmer.", encoding="utf-8")
+    (kb / "booking.md").write_text("# Banebooking\nBook bane i Matchi-appen.", encoding="utf-8")
+    monkeypatch.setattr(retrieve, "KB_DIRS", [kb])
+    monkeypatch.setattr(retrieve, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(retrieve, "USE_OPENAI", False)
+    monkeypatch.setattr(retrieve, "_current", None)
+    builder = retrieve.Retriever()
+    builder.build_tfidf()
+    builder.close()
+    monkeypatch.setattr(answer, "_cache", None)
+
+    def broken_llm(q, hits):
+        yield "token", "Timepris er"
+        raise ConnectionError("LLM-en falt ut")
+
+    monkeypatch.setattr(answer, "_client", lambda: object())
+    monkeypatch.setattr(answer, "_llm_stream", broken_llm)
+
+    server, url = service.start(window_ms=0)
+    try:
+        client = service.Client(url)
+        events = []
+        with pytest.raises(RuntimeError, match="LLM-en falt ut"):
+            for ev in client.answer_stream("Hva er timepris?", k=2):
+                events.append(ev)
+        assert [e for e, _ in events] == ["hits", "token"]  # strømmen var gyldig fram til feilen
+        assert client.search("timepris", 1)[0]["source"].endswith("pris.md")
+    finally:
+        server.shutdown()
+        retrieve.unwatch()
+        retrieve.current().close()
@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+
+from src import settings
+
+# Budsjett for `import src.answer` / `import src.ingest` (kumulativt fra -X importtime).
+# Målt til ~160 ms lokalt (mot ~1,1 s med sklearn/scipy/pyarrow/openai lastet
+# ivrig); romslig margin for trege CI-maskiner.
+IMPORT_BUDGET_MS = 600
+HEAVY = {"sklearn", "scipy", "pyarrow", "faiss", "openai", "streamlit"}
+
+
+def _importtime(module: str):
+    env = {k: v for k, v in os.environ.items() if k not in {"OPENAI_API_KEY", "USE_OPENAI"}}
+    code = f"import sys, {module}; print(','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({sorted(HEAVY)!r}))))"
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env)
+    assert r.returncode == 0, r.stderr[-2000:]
+    m = re.search(rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$", r.stderr, re.M)
+    return int(m.group(1)) / 1000, set(filter(None, r.stdout.strip().split(",")))
+
+
+def test_import_is_lazy_and_within_budget():
+    for module in ("src.answer", "src.ingest"):  # ingest skal heller ikke kreve API-nøkkel
+        ms, heavy = _importtime(module)
+        assert heavy == set(), f"{module} laster {heavy} ved import"
+        assert ms < IMPORT_BUDGET_MS, f"{module}: {ms:.0f} ms"
+
+
+def test_settings_env_wins_over_secrets_file(tmp_path, monkeypatch):
+    secrets = tmp_path / "secrets.toml"
+    secrets.write_text('OPENAI_API_KEY = "sk-fil"\nUSE_OPENAI = "true"\nCHAT_MODEL = "fra-fil"\n', encoding="utf-8")
+    monkeypatch.setattr(settings, "SECRETS_FILES", (secrets,))
+    for name in ("OPENAI_API_KEY", "USE_OPENAI", "CHAT_MODEL", "DATA_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("CHAT_MODEL", "fra-env")
+
+    s = settings.Settings.resolve()
+    assert s.use_openai and s.openai_api_key == "sk-fil"
+    assert s.chat_model == "fra-env" and s.data_dir.name == "data"
+
+
+def test_ingest_defaults_to_openai_when_use_openai_is_unset(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SECRETS_FILES", (tmp_path / "mangler.toml",))
+    monkeypatch.delenv("USE_OPENAI", raising=False)
+    s = settings.Settings.resolve()
+    assert s.ingest_use_openai and not s.use_openai  # appen og søket: TF-IDF; ingest: vektorer
+
+    monkeypatch.setenv("USE_OPENAI", "0")
+    assert not settings.Settings.resolve().ingest_use_openai
+
+
+def test_caches_follow_data_dir_from_secrets(tmp_path):
+    (tmp_path / ".streamlit").mkdir()
+    (tmp_path / ".streamlit" / "secrets.toml").write_text('DATA_DIR = "fra-secrets"\n', encoding="utf-8")
+    env = {k: v for k, v in os.environ.items()
+           if k not in {"DATA_DIR", "EMBED_CACHE_PATH", "ANSWER_CACHE_PATH"}}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    code = "from src import answer_cache, embed_cache; print(embed_cache.CACHE_PATH, answer_cache.ANSWER_CACHE_PATH)"
+    r = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, cwd=tmp_path)
+    assert r.returncode == 0, r.stderr[-2000:]
+    assert r.stdout.split() == [os.path.join("fra-secrets", "embed_cache.sqlite"),
+                                os.path.join("fra-secrets", "answer_cache.sqlite")]
+
+
+def test_retrieve_reads_the_same_kb_roots_as_ingest(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k != "KB_DIR"}
+    env["KB_DIR"] = "min-kb"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    code = ("from src import chunking, ingest, retrieve; "
+            "print(retrieve.KB_DIRS == chunking.roots(ingest.KB_DIR_DEFAULT), retrieve.KB_DIRS[0])")
+    r = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, cwd=tmp_path)
+    assert r.returncode == 0, r.stderr[-2000:]
+    assert r.stdout.split() == ["True", "min-kb"]
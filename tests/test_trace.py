@@ -0,0 +1,45 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from src import answer as ans
+from src import trace
+from src.answer_cache import ResultCache
+
+
+def _setup(tmp_path, monkeypatch, on=True):
+    hit = {"text": "Timepris er 300 kroner. Mer tekst.", "score": 0.9, "doc_type": "pris", "id": "p#0"}
+    monkeypatch.setattr(ans, "search", lambda q, k: [hit, dict(hit, id="p#1", score=0.1)])
+    monkeypatch.setattr(ans, "_cache", ResultCache(data_dir=tmp_path))
+    monkeypatch.setattr(ans, "USE_OPENAI", False)
+    monkeypatch.setattr(trace, "TRACE_ENABLED", on)
+    monkeypatch.setattr(trace, "TRACE_LOG", str(tmp_path / "trace.jsonl"))
+    trace.reset()
+
+
+def test_answer_records_stage_spans_cache_and_pool_sizes(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    ans.answer("hva koster det?", k=3)
+    ans.answer("Hva koster det", k=3)
+
+    first, second = trace.recent(2)
+    assert [s["name"] for s in first["spans"]] == ["expand", "search", "rerank"]
+    assert first["candidates"] == 2 and first["hits"] == 1
+    assert first["counters"] == {"cache.answer.miss": 1}
+    assert second["spans"] == [] and second["counters"] == {"cache.answer.hit": 1}
+
+    snap = trace.snapshot()
+    assert snap["cache_hit_rate"]["answer"] == 0.5
+    assert snap["stages"]["search"]["count"] == 1
+    text = trace.prometheus_text()
+    assert 'rag_stage_seconds_count{stage="answer"} 2' in text
+    assert 'rag_cache_total{cache="answer",result="hit"} 1' in text
+    assert len((tmp_path / "trace.jsonl").read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_disabled_tracing_is_a_noop(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch, on=False)
+    assert trace.span("search") is trace.trace("answer")
+    ans.answer("hva koster det?", k=3)
+    assert trace.recent(5) == [] and trace.snapshot()["stages"] == {}
+    assert not (tmp_path / "trace.jsonl").exists()